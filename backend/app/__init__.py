@@ -1,10 +1,26 @@
+import os
 from flask import Flask
 from flask_cors import CORS
 
 def create_app():
+    # 结构化日志（附带请求ID和任务ID），替代分散的 print 输出
+    from app.logs import configure_logging
+    configure_logging()
+    
     app = Flask(__name__)
+    
+    # 上传文件在内存阈值以内时不写磁盘，转换直接从内存缓冲区读取
+    from app.uploads import UploadRequest
+    app.request_class = UploadRequest
     CORS(app)  # 启用CORS支持跨域请求
     
+    # 设置 PDF2MD_USE_X_SENDFILE=1 后由前端Web服务器（如Apache/Lighttpd）发送图片文件
+    app.config['USE_X_SENDFILE'] = os.environ.get('PDF2MD_USE_X_SENDFILE') == '1'
+    
+    # 请求ID、请求耗时和进行中转换数的统计，通过 /metrics 输出
+    from app import metrics
+    metrics.init_app(app)
+    
     # 导入并注册蓝图
     from app.routes import main_bp
     app.register_blueprint(main_bp)
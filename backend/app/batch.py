@@ -0,0 +1,462 @@
+"""
+批量转换命令行工具
+
+遍历输入目录中的PDF，在进程池中并行转换（每个进程一次转换一个文件），输出目录保持与
+输入相同的目录结构。每个文件完成后向清单（manifest，JSON Lines）追加一条记录，包含
+内容的SHA-256和转换参数；中断后重新运行同一命令时，清单中已完成且内容和参数都未变的
+文件直接跳过。运行过程中定期输出吞吐量（文件/秒、页/秒）和预计剩余时间。
+
+用法（在 backend 目录下）:
+    python -m app.batch /data/pdfs -o /data/out
+    python -m app.batch /data/pdfs -o /data/out --formats markdown,word --workers 8
+    python -m app.batch a.pdf b.pdf -o /data/out --formats images --dpi 200 --image-format jpeg
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import contextmanager
+
+from app.cache import CACHE_VERSION, HASH_CHUNK_SIZE
+from app.logs import configure_logging, log_context
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("markdown", "word", "images")
+
+MANIFEST_NAME = "manifest.jsonl"
+
+# 每个工作进程排队的文件数，保证进程空闲时总有下一个文件可取，又不会一次提交全部文件
+QUEUED_PER_WORKER = 2
+
+def _init_worker(log_level):
+    """进程池初始化：配置日志"""
+    configure_logging(log_level)
+
+def find_pdfs(inputs):
+    """
+    展开输入路径：文件直接使用，目录递归查找 .pdf 文件（按路径排序）
+
+    参数:
+        inputs (list): 文件或目录路径
+
+    返回:
+        list: [(PDF路径, 相对路径), ...]，相对路径决定输出位置和清单中的键；
+            给出多个输入时，相对路径以各输入的名称开头，避免互相覆盖
+    """
+    items = []
+    for input_path in inputs:
+        input_path = os.path.abspath(input_path)
+        prefix = os.path.basename(input_path.rstrip(os.sep)) if len(inputs) > 1 else ""
+        if os.path.isfile(input_path):
+            items.append((input_path, os.path.basename(input_path)))
+            continue
+        for dirpath, dirnames, filenames in os.walk(input_path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.lower().endswith(".pdf"):
+                    path = os.path.join(dirpath, filename)
+                    relpath = os.path.relpath(path, input_path)
+                    items.append((path, os.path.join(prefix, relpath) if prefix else relpath))
+    return [(path, relpath.replace(os.sep, "/")) for path, relpath in items]
+
+def load_manifest(manifest_path):
+    """
+    读取清单，同一文件有多条记录时以最后一条为准；
+    中断时可能写了一半的最后一行会被忽略
+
+    返回:
+        dict: 相对路径 -> 记录
+    """
+    records = {}
+    if not os.path.exists(manifest_path):
+        return records
+    with open(manifest_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            records[record["source"]] = record
+    return records
+
+def outputs_exist(record, output_dir):
+    """记录中的输出文件是否都还在"""
+    return all(os.path.exists(os.path.join(output_dir, path)) for path in record.get("outputs", ()))
+
+@contextmanager
+def open_pdf_buffer(pdf_path):
+    """
+    以只读内存映射打开PDF，供哈希和 fitz.open(stream=...) 共用，不复制文件内容
+
+    返回:
+        memoryview 或 bytes: PDF内容，仅在 with 块内有效
+    """
+    with open(pdf_path, "rb") as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件无法映射
+            yield b""
+            return
+    view = memoryview(mapped)
+    try:
+        yield view
+    finally:
+        view.release()
+        mapped.close()
+
+def hash_buffer(data):
+    """分块计算SHA-256"""
+    digest = hashlib.sha256()
+    for offset in range(0, len(data), HASH_CHUNK_SIZE):
+        digest.update(data[offset:offset + HASH_CHUNK_SIZE])
+    return digest.hexdigest()
+
+def _output_paths(relpath, formats):
+    """
+    某个文件的全部输出（相对于输出目录），与 pdf_to_formats 的命名一致
+
+    返回:
+        dict: 格式 -> 输出路径列表
+    """
+    stem = os.path.splitext(relpath)[0]
+    return {
+        "markdown": [f"{stem}.md", f"{stem}_images"],
+        "word": [f"{stem}.docx"],
+        "images": [f"{stem}_cropped_images.zip"]
+    }
+
+def _remove_outputs(output_dir, relpath):
+    """删除某个文件之前（可能不完整）的输出"""
+    for paths in _output_paths(relpath, FORMATS).values():
+        for path in paths:
+            path = os.path.join(output_dir, path)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+
+def _link_markdown_images(markdown_content, images, images_dirname):
+    """Markdown 中的图片引用改为相对于 .md 文件的 <名称>_images/ 路径"""
+    for image in images:
+        filename = image["filename"]
+        markdown_content = markdown_content.replace(f"]({filename})", f"]({images_dirname}/{filename})")
+    return markdown_content
+
+def convert_item(pdf_path, relpath, output_dir, settings, known_hash=None, low_memory=False):
+    """
+    在工作进程中转换一个PDF，输出写入 output_dir 下与 relpath 对应的位置
+
+    参数:
+        pdf_path (str): PDF文件路径
+        relpath (str): 相对路径（清单中的键）
+        output_dir (str): 输出根目录
+        settings (dict): {"formats", "pages", "render_options"}
+        known_hash (str): 清单中该文件上次成功转换时的内容哈希，内容相同时不再转换
+        low_memory (bool): Markdown 逐页写入 .md 文件（见 pdf_to_markdown_stream），
+            内存占用与页数无关，输出不变
+
+    返回:
+        dict: 清单记录，status 为 "done"、"unchanged" 或 "failed"
+    """
+    from app.converter import pdf_to_formats, pdf_to_markdown_stream
+
+    start = time.perf_counter()
+    stat = os.stat(pdf_path)
+    record = {
+        "source": relpath,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "settings": settings,
+        "pages": 0,
+        "outputs": []
+    }
+    outputs = _output_paths(relpath, settings["formats"])
+    images_dirname = os.path.basename(outputs["markdown"][1])
+    formats = settings["formats"]
+    streamed = None
+
+    with log_context(job_id=relpath), open_pdf_buffer(pdf_path) as pdf_data:
+        record["sha256"] = hash_buffer(pdf_data)
+        if record["sha256"] == known_hash:
+            record["status"] = "unchanged"
+            return record
+
+        stem = os.path.splitext(relpath)[0]
+        item_dir = os.path.join(output_dir, os.path.dirname(stem))
+        os.makedirs(item_dir, exist_ok=True)
+        _remove_outputs(output_dir, relpath)
+
+        # 以输出目录中的同名路径作为PDF路径：内容从缓冲区读取，图片和文档写入输出目录
+        target_path = os.path.join(item_dir, os.path.basename(relpath))
+        if low_memory and "markdown" in formats:
+            with open(os.path.join(output_dir, outputs["markdown"][0]), "w", encoding="utf-8") as f:
+                streamed = pdf_to_markdown_stream(target_path, f, pdf_data=pdf_data, pages=settings["pages"],
+                                                  image_link_prefix=f"{images_dirname}/")
+            formats = [output_format for output_format in formats if output_format != "markdown"]
+
+        if streamed is not None and (streamed["status"] != "success" or not formats):
+            result = {"status": streamed["status"], "message": streamed["message"],
+                      "pages_count": streamed.get("page_count")}
+        else:
+            result = pdf_to_formats(target_path, formats, item_dir, workers=1, pdf_data=pdf_data,
+                                    pages=settings["pages"], render_options=settings["render_options"])
+
+    record["seconds"] = round(time.perf_counter() - start, 3)
+    if result.get("status") != "success":
+        record["status"] = "failed"
+        record["message"] = result.get("message")
+        return record
+
+    record["pages"] = result["pages_count"]
+    errors = []
+
+    if streamed is not None:
+        record["outputs"].append(outputs["markdown"][0])
+        if os.path.isdir(os.path.join(output_dir, outputs["markdown"][1])):
+            record["outputs"].append(outputs["markdown"][1])
+    elif "markdown" in formats:
+        markdown = result["markdown"]
+        if markdown.get("error"):
+            errors.append(markdown["markdown_content"])
+        else:
+            with open(os.path.join(output_dir, outputs["markdown"][0]), "w", encoding="utf-8") as f:
+                f.write(_link_markdown_images(markdown["markdown_content"], markdown["images"], images_dirname))
+            record["outputs"].append(outputs["markdown"][0])
+            if os.path.isdir(os.path.join(output_dir, outputs["markdown"][1])):
+                record["outputs"].append(outputs["markdown"][1])
+
+    for output_format in ("word", "images"):
+        if output_format in formats:
+            if result[output_format]["status"] == "success":
+                record["outputs"].extend(outputs[output_format])
+            else:
+                errors.append(result[output_format]["message"])
+
+    if errors:
+        record["status"] = "failed"
+        record["message"] = "; ".join(errors)
+    else:
+        record["status"] = "done"
+    return record
+
+class ThroughputReporter:
+    """统计已处理的文件数和页数，定期输出吞吐量和预计剩余时间"""
+
+    def __init__(self, total, interval, log=print):
+        self.total = total
+        self.interval = interval
+        self.log = log
+        self.started = time.perf_counter()
+        self._last_report = self.started
+        self.converted = 0
+        self.skipped = 0
+        self.failed = 0
+        self.pages = 0
+
+    def add(self, status, pages=0):
+        if status == "done":
+            self.converted += 1
+            self.pages += pages
+        elif status == "failed":
+            self.failed += 1
+        else:
+            self.skipped += 1
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report()
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        processed = self.converted + self.failed
+        remaining = self.total - processed - self.skipped
+        files_per_sec = processed / elapsed if elapsed > 0 else 0.0
+        return {
+            "total": self.total,
+            "converted": self.converted,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "pages": self.pages,
+            "seconds": round(elapsed, 3),
+            "files_per_sec": round(files_per_sec, 3),
+            "pages_per_sec": round(self.pages / elapsed, 3) if elapsed > 0 else 0.0,
+            "eta_seconds": round(remaining / files_per_sec) if files_per_sec > 0 else None
+        }
+
+    def report(self):
+        stats = self.summary()
+        done = stats["converted"] + stats["skipped"] + stats["failed"]
+        eta = stats["eta_seconds"]
+        eta_text = f"{eta // 3600:d}:{eta % 3600 // 60:02d}:{eta % 60:02d}" if eta is not None else "-"
+        self.log(f"[{done}/{stats['total']}] 转换 {stats['converted']}  跳过 {stats['skipped']}  "
+                 f"失败 {stats['failed']}  {stats['files_per_sec']:.2f} 文件/s  "
+                 f"{stats['pages_per_sec']:.1f} 页/s  剩余约 {eta_text}")
+
+def run_batch(inputs, output_dir, formats=("markdown",), workers=None, manifest_path=None, pages=None,
+              render_options=None, force=False, report_interval=10, log_level="WARNING", log=print,
+              low_memory=False):
+    """
+    批量转换，返回统计结果
+
+    参数:
+        inputs (list): PDF文件或目录
+        output_dir (str): 输出根目录
+        formats (list): 输出格式，可包含 "markdown"、"word"、"images"
+        workers (int): 工作进程数，None 时使用CPU核数
+        manifest_path (str): 清单路径，None 时为 output_dir/manifest.jsonl
+        pages (str): 页面选择表达式，对每个文件生效
+        render_options (dict): 裁剪图片的渲染参数（见 normalize_render_options）
+        force (bool): 忽略清单，全部重新转换
+        report_interval (float): 输出吞吐量的间隔（秒）
+        log_level (str): 工作进程中转换日志的级别
+        log: 输出进度的函数
+        low_memory (bool): Markdown 使用低内存的逐页转换（见 convert_item），不影响输出，
+            因此不计入清单中的转换参数
+
+    返回:
+        dict: ThroughputReporter.summary() 的结果
+    """
+    output_dir = os.path.abspath(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = manifest_path or os.path.join(output_dir, MANIFEST_NAME)
+    workers = workers or os.cpu_count() or 1
+
+    # 转换参数和转换逻辑版本都相同时，之前的结果才能复用
+    settings = {
+        "formats": [output_format for output_format in FORMATS if output_format in formats],
+        "pages": pages,
+        "render_options": render_options if "images" in formats else None,
+        "version": CACHE_VERSION
+    }
+    manifest = {} if force else load_manifest(manifest_path)
+    items = find_pdfs(inputs)
+    reporter = ThroughputReporter(len(items), report_interval, log)
+    log(f"共 {len(items)} 个PDF，{workers} 个工作进程，清单: {manifest_path}")
+
+    def reusable(record):
+        return (record is not None and record.get("status") == "done" and record.get("settings") == settings
+                and outputs_exist(record, output_dir))
+
+    with open(manifest_path, "a", encoding="utf-8") as manifest_file, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(log_level,)) as executor:
+
+        def write_record(record):
+            record["finished_at"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+            manifest_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            manifest_file.flush()
+
+        def collect(futures):
+            for future in futures:
+                relpath = pending.pop(future)
+                try:
+                    record = future.result()
+                except Exception as e:
+                    logger.exception("批量转换出错", extra={"source": relpath})
+                    record = {"source": relpath, "status": "failed", "message": str(e), "settings": settings}
+                if record["status"] == "unchanged":
+                    # 内容未变（仅修改时间变了）：沿用上次的输出，更新清单中的修改时间
+                    previous = manifest[relpath]
+                    record.update(status="done", pages=previous.get("pages", 0), outputs=previous["outputs"])
+                    write_record(record)
+                    reporter.add("skipped")
+                    continue
+                write_record(record)
+                if record["status"] == "failed":
+                    log(f"转换失败: {relpath}: {record.get('message')}")
+                reporter.add(record["status"], record.get("pages", 0))
+
+        pending = {}
+        try:
+            for pdf_path, relpath in items:
+                record = manifest.get(relpath)
+                known_hash = None
+                if reusable(record):
+                    stat = os.stat(pdf_path)
+                    if stat.st_size == record.get("size") and stat.st_mtime_ns == record.get("mtime_ns"):
+                        reporter.add("skipped")
+                        continue
+                    # 修改时间变了，由工作进程比较内容哈希决定是否需要重新转换
+                    known_hash = record.get("sha256")
+
+                while len(pending) >= workers * QUEUED_PER_WORKER:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                future = executor.submit(convert_item, pdf_path, relpath, output_dir, settings, known_hash,
+                                         low_memory)
+                pending[future] = relpath
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+        except KeyboardInterrupt:
+            # 已完成的文件都已写入清单，重新运行即可继续
+            log("已中断，正在停止工作进程；重新运行同一命令可从中断处继续")
+            executor.shutdown(wait=True, cancel_futures=True)
+            collect([future for future in pending if future.done() and not future.cancelled()])
+            raise
+
+    reporter.report()
+    return reporter.summary()
+
+def _split_formats(value):
+    items = [item.strip() for item in value.split(",") if item.strip()]
+    unknown = [item for item in items if item not in FORMATS]
+    if not items or unknown:
+        raise argparse.ArgumentTypeError(f"未知的输出格式: {', '.join(unknown)}（可选: {', '.join(FORMATS)}）")
+    return items
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量转换PDF，支持中断后继续")
+    parser.add_argument("inputs", nargs="+", help="PDF文件或目录（递归查找 .pdf）")
+    parser.add_argument("-o", "--output-dir", required=True, help="输出目录，保持输入的目录结构")
+    parser.add_argument("--formats", type=_split_formats, default=["markdown"],
+                        help=f"逗号分隔的输出格式，默认 markdown（可选: {','.join(FORMATS)}）")
+    parser.add_argument("--workers", type=int, help="工作进程数，默认CPU核数")
+    parser.add_argument("--manifest", help=f"清单路径，默认 <输出目录>/{MANIFEST_NAME}")
+    parser.add_argument("--pages", help="页面选择表达式，如 1-10,25,40-")
+    parser.add_argument("--dpi", type=int, help="裁剪图片的渲染分辨率（18-600），默认144")
+    parser.add_argument("--image-format", choices=("png", "jpeg", "webp"), help="裁剪图片格式，默认png")
+    parser.add_argument("--quality", type=int, help="JPEG/WebP 质量（1-100），默认85")
+    parser.add_argument("--force", action="store_true", help="忽略清单，全部重新转换")
+    parser.add_argument("--report-interval", type=float, default=10, help="输出吞吐量的间隔（秒），默认10")
+    parser.add_argument("--log-level", default="WARNING", help="转换日志级别，默认WARNING")
+    parser.add_argument("--low-memory", action="store_true",
+                        help="Markdown 逐页写入文件，内存占用与页数无关（适合上千页的文档）")
+    args = parser.parse_args(argv)
+
+    configure_logging(args.log_level)
+
+    if args.dpi is not None and not 18 <= args.dpi <= 600:
+        parser.error("dpi 必须在 18-600 之间")
+    if args.quality is not None and not 1 <= args.quality <= 100:
+        parser.error("quality 必须在 1-100 之间")
+
+    render_options = None
+    if "images" in args.formats:
+        from app.converter import normalize_render_options
+        render_options = normalize_render_options({
+            "dpi": args.dpi, "format": args.image_format, "quality": args.quality
+        })
+
+    try:
+        summary = run_batch(args.inputs, args.output_dir, args.formats, args.workers, args.manifest, args.pages,
+                            render_options, args.force, args.report_interval, args.log_level,
+                            low_memory=args.low_memory)
+    except KeyboardInterrupt:
+        return 130
+
+    print(f"完成: 转换 {summary['converted']}，跳过 {summary['skipped']}，失败 {summary['failed']}，"
+          f"共 {summary['pages']} 页，用时 {summary['seconds']:.1f} s")
+    return 1 if summary["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+import hashlib
+import json
+import logging
+import os
+import stat
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# 缓存格式版本，转换逻辑变化导致输出不同时递增，使旧缓存自动失效
+CACHE_VERSION = 3
+
+# 读取上传内容计算哈希时的分块大小
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def hash_stream(stream):
+    """
+    计算文件流内容的SHA-256，计算完成后将读取位置重置到开头
+
+    参数:
+        stream: 支持read/seek的文件对象（如werkzeug的FileStorage）
+
+    返回:
+        str: 十六进制摘要
+    """
+    digest = hashlib.sha256()
+    stream.seek(0)
+    while True:
+        chunk = stream.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.hexdigest()
+
+def make_cache_key(content_hash, output_format, options=None):
+    """
+    根据PDF内容哈希、输出格式和转换选项生成缓存键
+
+    参数:
+        content_hash (str): PDF内容的SHA-256
+        output_format (str): 输出格式，如 "markdown"、"word"、"images"
+        options (dict): 影响输出结果的转换选项
+
+    返回:
+        str: 缓存键（十六进制字符串，可直接用作文件名）
+    """
+    options_text = json.dumps(options or {}, sort_keys=True, ensure_ascii=False)
+    raw = f"v{CACHE_VERSION}:{content_hash}:{output_format}:{options_text}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+# 磁盘层由多个进程共用，写入时最多每隔该时间（秒）从目录重建一次索引，按目录的实际占用淘汰
+DISK_RESYNC_INTERVAL = 30
+
+class ConversionCache:
+    """
+    两级转换结果缓存：内存层 + 磁盘层，两层均按总字节数做LRU淘汰
+
+    缓存值统一为bytes。内存层未命中时查找磁盘层，磁盘命中的结果会回填到内存层。
+
+    多个进程（服务进程、进程池中的工作进程）可以共用同一个磁盘目录：命中时更新文件的修改时间，
+    各进程定期按目录内容重建索引，淘汰顺序和容量上限针对整个目录，而不是各进程写入的部分。
+    """
+
+    def __init__(self, cache_dir, memory_limit, disk_limit):
+        """
+        参数:
+            cache_dir (str): 磁盘层目录，为None时禁用磁盘层
+            memory_limit (int): 内存层最大字节数，0 表示禁用内存层
+            disk_limit (int): 磁盘层最大字节数，0 表示禁用磁盘层
+        """
+        self.cache_dir = cache_dir
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit if cache_dir else 0
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> bytes
+        self._memory_size = 0
+        self._disk = OrderedDict()    # key -> 文件大小
+        self._disk_size = 0
+        self._disk_synced_at = time.monotonic()
+
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "memory_evictions": 0,
+            "disk_evictions": 0
+        }
+
+        if self.disk_limit:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._load_disk_index()
+
+    def __reduce__(self):
+        # 传给进程池的工作进程时按同样的配置重新打开（锁和内存层不能也不需要复制）
+        return (ConversionCache, (self.cache_dir, self.memory_limit, self.disk_limit))
+
+    def _load_disk_index(self):
+        """按修改时间从旧到新重建磁盘层索引，使进程重启后仍保留LRU顺序"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".tmp"):
+                continue
+            try:
+                info = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue  # 已被其他进程淘汰
+            if not stat.S_ISREG(info.st_mode):
+                continue
+            entries.append((info.st_mtime, name, info.st_size))
+
+        for _, name, size in sorted(entries):
+            self._disk[name] = size
+            self._disk_size += size
+        self._evict_disk()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def _adopt_disk_entry(self, key):
+        """把其他进程写入磁盘层的条目加入本进程的索引"""
+        try:
+            size = os.stat(self._disk_path(key)).st_size
+        except OSError:
+            return
+        self._disk[key] = size
+        self._disk_size += size
+
+    def get(self, key):
+        """
+        查询缓存
+
+        返回:
+            bytes: 命中时返回缓存内容，未命中返回None
+        """
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return self._memory[key]
+
+            if key not in self._disk and self.disk_limit:
+                # 缓存目录由多个进程（服务进程、进程池中的工作进程）共用，其他进程写入的条目不在本进程的索引中
+                self._adopt_disk_entry(key)
+
+            if key in self._disk:
+                path = self._disk_path(key)
+                try:
+                    with open(path, "rb") as f:
+                        value = f.read()
+                    os.utime(path)
+                except OSError:
+                    # 文件被外部删除，同步索引
+                    self._disk_size -= self._disk.pop(key)
+                else:
+                    self._disk.move_to_end(key)
+                    self._stats["disk_hits"] += 1
+                    self._put_memory(key, value)
+                    return value
+
+            self._stats["misses"] += 1
+            return None
+
+    def put(self, key, value):
+        """
+        写入缓存（同时写入内存层和磁盘层）
+
+        参数:
+            key (str): 缓存键
+            value (bytes): 缓存内容
+        """
+        with self._lock:
+            self._put_memory(key, value)
+            self._put_disk(key, value)
+
+    def invalidate(self, key):
+        """从两级缓存中移除指定键"""
+        with self._lock:
+            if key in self._memory:
+                self._memory_size -= len(self._memory.pop(key))
+            if key in self._disk:
+                self._disk_size -= self._disk.pop(key)
+                try:
+                    os.remove(self._disk_path(key))
+                except OSError:
+                    pass
+
+    def _put_memory(self, key, value):
+        if len(value) > self.memory_limit:
+            return
+        if key in self._memory:
+            self._memory_size -= len(self._memory.pop(key))
+        self._memory[key] = value
+        self._memory_size += len(value)
+        while self._memory_size > self.memory_limit:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+            self._stats["memory_evictions"] += 1
+
+    def _put_disk(self, key, value):
+        if len(value) > self.disk_limit:
+            return
+        path = self._disk_path(key)
+        # 多个服务进程共用缓存目录，临时文件名同时包含进程ID和线程ID
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("写入磁盘缓存失败", extra={"error": str(e)})
+            return
+
+        if key in self._disk:
+            self._disk_size -= self._disk.pop(key)
+        self._disk[key] = len(value)
+        self._disk_size += len(value)
+
+        now = time.monotonic()
+        if now - self._disk_synced_at > DISK_RESYNC_INTERVAL:
+            # 纳入其他进程写入的条目，去掉已被其他进程淘汰的条目，再按整个目录淘汰
+            self._disk_synced_at = now
+            self._disk.clear()
+            self._disk_size = 0
+            self._load_disk_index()
+        else:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        while self._disk_size > self.disk_limit and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self._disk_size -= size
+            self._stats["disk_evictions"] += 1
+            try:
+                os.remove(self._disk_path(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        """
+        返回缓存统计信息
+
+        返回:
+            dict: 命中、未命中、淘汰计数以及两级缓存的当前占用
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["hits"] = stats["memory_hits"] + stats["disk_hits"]
+            stats["memory_entries"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_size
+            stats["memory_limit"] = self.memory_limit
+            stats["disk_entries"] = len(self._disk)
+            stats["disk_bytes"] = self._disk_size
+            stats["disk_limit"] = self.disk_limit
+            return stats
@@ -1,115 +1,1111 @@
-import fitz  # PyMuPDF
 import os
 import json
+import logging
 import re
+import time
 import uuid
 import zipfile
-from PIL import Image
 import io
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from app.lazy import lazy_import, module_available
+from app.metrics import collect_stage_timings, record_stage, replay_stage_timings, stage_timer
+from app.pagecache import PageCache, PageHasher
+from app.spans import SpanTable
+from app.zipstream import compress_type_for
 
-# 尝试导入python-docx，如果失败则使用备用方案
-try:
-    from docx import Document
-    from docx.shared import Inches, Pt
-    from docx.enum.text import WD_ALIGN_PARAGRAPH
-    from docx.oxml.ns import qn
-    DOCX_AVAILABLE = True
-except ImportError:
-    DOCX_AVAILABLE = False
-    print("Warning: python-docx not available. Word conversion will be disabled.")
+# PyMuPDF 在第一次使用时才导入，只处理健康检查和图片下载的进程不需要加载
+fitz = lazy_import("fitz")
+
+logger = logging.getLogger(__name__)
+
+# 检查python-docx是否已安装（不导入），Word转换时才导入
+DOCX_AVAILABLE = module_available("docx")
+if not DOCX_AVAILABLE:
+    logger.warning("python-docx 不可用，Word转换功能已禁用")
+
+# 并行转换的默认进程数，可通过环境变量 PDF2MD_WORKERS 配置（1 表示串行）
+MARKDOWN_WORKERS = int(os.environ.get("PDF2MD_WORKERS", "1"))
+
+# 页数少于该值时始终串行处理，避免进程启动开销大于收益
+PARALLEL_MIN_PAGES = int(os.environ.get("PDF2MD_PARALLEL_MIN_PAGES", "8"))
+
+# 裁剪图片的默认渲染参数：144 DPI（2倍缩放）的PNG
+CROP_RENDER_DEFAULTS = {"dpi": 144, "width": None, "height": None, "format": "png", "quality": 85}
+
+# 裁剪图片支持的输出格式及扩展名
+CROP_IMAGE_FORMATS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+
+# 页面预览输出图片的最大像素数（宽 × 高），可通过 PDF2MD_PREVIEW_MAX_PIXELS 配置
+PREVIEW_MAX_PIXELS = int(os.environ.get("PDF2MD_PREVIEW_MAX_PIXELS", 16 * 1024 * 1024))
+
+# 并行渲染时每个任务包含的页数
+CROP_RENDER_BATCH_PAGES = 4
+
+# Word文档中图片的显示宽度（英寸）和嵌入分辨率，可通过 PDF2MD_WORD_IMAGE_DPI 配置；
+# 宽度超过 显示宽度×DPI 像素的图片先缩小再嵌入
+WORD_IMAGE_WIDTH_INCHES = 6
+WORD_IMAGE_DPI = int(os.environ.get("PDF2MD_WORD_IMAGE_DPI", "150"))
+
+# 缩小后重新编码JPEG图片的质量
+WORD_JPEG_QUALITY = 85
+
+# 图片提取模式：passthrough 直接写出原始编码流（必要时才解码重编码），png 统一重编码为PNG
+IMAGE_EXTRACTION_MODE = os.environ.get("PDF2MD_IMAGE_MODE", "passthrough")
+
+# passthrough 模式下允许原样写出的图片格式（需浏览器和python-docx都能直接使用）
+PASSTHROUGH_FORMATS = set(
+    ext.strip().lower()
+    for ext in os.environ.get("PDF2MD_PASSTHROUGH_FORMATS", "jpeg,png").split(",")
+    if ext.strip()
+)
+
+# 单页内存上限（字节）：逐页处理时累计解码的图片（按 宽×高×4 估算）超过该值后，
+# 在处理下一页之前清空 MuPDF 的缓存（默认最多可缓存256MB解码结果），0 表示不限制
+PAGE_MEMORY_LIMIT = int(os.environ.get("PDF2MD_PAGE_MEMORY_LIMIT", 64 * 1024 * 1024))
+
+# 所选页数达到该值时 pdf_to_markdown 自动使用低内存的两遍转换（见 stream_markdown），
+# 默认 0 表示从不自动切换；调用方明确要求多进程并行（workers > 1）时也不切换
+LOW_MEMORY_PAGES = int(os.environ.get("PDF2MD_LOW_MEMORY_PAGES", "0"))
+
+def text_extraction_flags():
+    """
+    文本提取使用的 TextPage 选项：默认的 dict 选项去掉 TEXT_PRESERVE_IMAGES，
+    只生成文本块。图片由 extract_images_from_page 单独提取，
+    页面字典中不再携带每张图片的完整二进制内容
+    """
+    return fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES
+
+def page_text_dict(page):
+    """
+    提取页面的文本字典：每页只创建一个只含文本的 TextPage，本页的文本都从它读取
+    
+    参数:
+        page: PDF页面对象
+        
+    返回:
+        dict: page.get_text("dict") 的结果，只包含文本块
+    """
+    textpage = page.get_textpage(flags=text_extraction_flags())
+    return page.get_text("dict", textpage=textpage)
+
+class PageMemoryGuard:
+    """
+    逐页处理时限制 MuPDF 缓存中解码图片占用的内存
+    
+    MuPDF 会缓存解码后的图片供后续使用，图片密集的文档逐页处理时缓存会持续增长到
+    默认上限；记录每页解码的图片大小，累计超过 limit 时在页与页之间清空缓存。
+    """
+    
+    def __init__(self, limit=None):
+        """
+        参数:
+            limit (int): 累计解码字节数上限，None 时使用 PAGE_MEMORY_LIMIT，0 表示不限制
+        """
+        self.limit = PAGE_MEMORY_LIMIT if limit is None else limit
+        self.decoded_bytes = 0
+    
+    def add_image(self, width, height):
+        """记录一张解码的图片"""
+        self.decoded_bytes += width * height * 4
+    
+    def add_page_images(self, page):
+        """记录渲染页面时需要解码的全部图片"""
+        for img in page.get_images():
+            self.add_image(img[2], img[3])
+    
+    def page_done(self):
+        """一页处理完毕：超过上限时清空 MuPDF 缓存"""
+        if self.limit and self.decoded_bytes > self.limit:
+            fitz.TOOLS.store_shrink(100)
+            self.decoded_bytes = 0
+
+@stage_timer("open")
+def open_pdf(pdf_path, pdf_data=None):
+    """
+    打开PDF文档：给出 pdf_data 时直接从内存（或内存映射）缓冲区打开，不读写磁盘
+    
+    参数:
+        pdf_path (str): PDF文件的路径；从缓冲区打开时仅用于确定输出文件名和目录
+        pdf_data: PDF内容，bytes、bytearray 或 memoryview，None 时按路径打开
+        
+    返回:
+        fitz.Document: 已打开的文档
+    """
+    if pdf_data is not None:
+        return fitz.open(stream=pdf_data, filetype="pdf")
+    return fitz.open(pdf_path)
+
+def log_open_request(pdf_path, pdf_data=None):
+    """记录即将转换的PDF来源（内存缓冲区或磁盘文件）"""
+    if pdf_data is not None:
+        logger.info("开始转换", extra={"pdf_path": pdf_path, "source": "buffer", "size": len(pdf_data)})
+    else:
+        logger.info("开始转换", extra={"pdf_path": pdf_path, "source": "file",
+                                   "exists": os.path.exists(pdf_path)})
+
+def parse_page_selector(selector):
+    """
+    解析页面选择表达式，如 "1-10,25,40-"（页码从1开始，"40-" 表示第40页到最后一页，"-5" 表示前5页）
+    
+    参数:
+        selector (str): 页面选择表达式
+        
+    返回:
+        list: [(起始页, 结束页或None), ...]，包含两端
+        
+    异常:
+        ValueError: 表达式格式无效
+    """
+    ranges = []
+    for part in selector.replace(" ", "").split(","):
+        if not part:
+            continue
+        match = re.fullmatch(r"(\d*)-(\d*)|(\d+)", part)
+        if match is None or part == "-":
+            raise ValueError(f"无效的页面选择: {part}")
+        if match.group(3) is not None:
+            first = last = int(match.group(3))
+        else:
+            first = int(match.group(1)) if match.group(1) else 1
+            last = int(match.group(2)) if match.group(2) else None
+        if first < 1 or (last is not None and last < first):
+            raise ValueError(f"无效的页面选择: {part}")
+        ranges.append((first, last))
+    if not ranges:
+        raise ValueError("页面选择为空")
+    return ranges
+
+def select_pages(selector, page_count):
+    """
+    根据页面选择表达式得到要处理的页面
+    
+    参数:
+        selector (str): 页面选择表达式（见 parse_page_selector），None 或空字符串表示全部页面
+        page_count (int): 文档总页数
+        
+    返回:
+        list: 按页码升序、不重复的页面索引（从0开始）
+        
+    异常:
+        ValueError: 表达式格式无效，或选中的页面都超出文档范围
+    """
+    if not selector:
+        return list(range(page_count))
+    
+    selected = set()
+    for first, last in parse_page_selector(selector):
+        if last is None or last > page_count:
+            last = page_count
+        selected.update(range(first - 1, last))
+    if not selected:
+        raise ValueError(f"所选页面超出文档范围（共{page_count}页）")
+    return sorted(selected)
+
+def pdf_to_markdown(pdf_path, workers=None, pdf_data=None, pages=None, low_memory=None, page_cache=None):
+    """
+    将PDF文件转换为格式化的Markdown文本，包含图片提取
+    
+    参数:
+        pdf_path (str): PDF文件的路径
+        workers (int): 并行处理的进程数，None 时使用 MARKDOWN_WORKERS，1 表示串行
+        pdf_data: PDF内容缓冲区，给出时不读取 pdf_path（见 open_pdf）
+        pages (str): 页面选择表达式，如 "1-10,25,40-"，None 表示全部页面
+        low_memory (bool): 使用逐页的两遍转换，不保留全文文本元素（忽略 workers）；
+            None 时只有设置了 LOW_MEMORY_PAGES、所选页数达到该值且 workers 未要求并行时才使用。
+            返回值中的 markdown_content 仍是完整的字符串，需要恒定内存时改用 pdf_to_markdown_stream
+        page_cache (ConversionCache): 页级提取结果缓存（见 build_document），给出时结果中
+            包含 pages_reused 和 pages_recomputed
+        
+    返回:
+        dict: 包含markdown内容和图片信息的字典
+    """
+    doc = None
+    try:
+        log_open_request(pdf_path, pdf_data)
+        
+        if pdf_data is None and not os.path.exists(pdf_path):
+            return {
+                "markdown_content": f"文件不存在: {pdf_path}",
+                "images": [],
+                "error": True
+            }
+        
+        # 打开PDF文件
+        doc = open_pdf(pdf_path, pdf_data)
+        
+        if doc.page_count == 0:
+            return {
+                "markdown_content": "未找到内容。PDF文件为空。",
+                "images": []
+            }
+        
+        # 所选页面无效时在创建任何目录之前报错
+        page_numbers = select_pages(pages, doc.page_count)
+        
+        # 创建图片存储目录
+        base_filename = os.path.splitext(os.path.basename(pdf_path))[0]
+        images_dir = os.path.join(os.path.dirname(pdf_path), f"{base_filename}_images")
+        if not os.path.exists(images_dir):
+            os.makedirs(images_dir)
+        
+        # 提取文本块、格式信息和图片，构建文档中间表示
+        if low_memory is None:
+            low_memory = (LOW_MEMORY_PAGES > 0 and len(page_numbers) >= LOW_MEMORY_PAGES
+                          and (workers is None or workers <= 1))
+        
+        if low_memory:
+            output = io.StringIO()
+            result = stream_markdown(doc, page_numbers, images_dir, base_filename, output.write,
+                                     page_cache=page_cache)
+            if not result["images"] and result["font_stats"]["span_count"] == 0:
+                return {
+                    "markdown_content": output.getvalue(),
+                    "images": []
+                }
+            return {
+                "markdown_content": output.getvalue(),
+                "images": result["images"],
+                "deduplicated_images": result["deduplicated_images"],
+                **page_cache_counts(result["page_cache"])
+            }
+        
+        document = build_document(doc, pdf_path, images_dir, workers, pdf_data=pdf_data,
+                                  page_numbers=page_numbers, page_cache=page_cache)
+        
+        return document_to_markdown(document)
+    
+    except Exception as e:
+        # 记录错误并返回错误消息
+        error_msg = f"转换过程中出错: {str(e)}"
+        logger.exception(error_msg)
+        return {
+            "markdown_content": error_msg,
+            "images": [],
+            "error": True
+        }
+    
+    finally:
+        # 出错时同样关闭文档
+        if doc is not None:
+            doc.close()
+
+def page_geometry(doc, page_numbers=None):
+    """
+    获取每一页的尺寸
+    
+    参数:
+        doc: 已打开的PDF文档对象
+        page_numbers (list): 页面索引（从0开始），None 表示全部页面
+        
+    返回:
+        list: [{"page": 页码, "width": 宽度, "height": 高度}, ...]
+    """
+    if page_numbers is None:
+        page_numbers = range(doc.page_count)
+    
+    pages = []
+    for page_num in page_numbers:
+        page_rect = doc[page_num].rect
+        pages.append({
+            "page": page_num + 1,
+            "width": page_rect.width,
+            "height": page_rect.height
+        })
+    return pages
+
+def build_document(doc, pdf_path, images_dir, workers=None, progress_callback=None, pdf_data=None,
+                   page_numbers=None, image_max_width=None, page_cache=None):
+    """
+    构建文档中间表示：只解析一次PDF，Markdown、Word和裁剪图片输出共用同一份结果
+    
+    参数:
+        doc: 已打开的PDF文档对象
+        pdf_path (str): PDF文件的路径（并行模式下各进程据此重新打开）
+        images_dir (str): 图片保存目录
+        workers (int): 并行处理的进程数，None 时使用 MARKDOWN_WORKERS，1 表示串行
+        progress_callback: 进度回调 callback(stage, page, page_count)，仅串行模式下逐页调用
+        pdf_data: PDF内容缓冲区，给出时并行模式下各进程从其副本打开
+        page_numbers (list): 只处理这些页面（select_pages 的结果），None 表示全部页面
+        image_max_width (int): 给出时图片不写入 images_dir，缩小后保存在内存中（只生成Word时使用）
+        page_cache (ConversionCache): 存放页级提取结果的缓存，给出时内容未变的页面不再重新解析
+        
+    返回:
+        dict: 文档中间表示
+            {"base_filename", "page_count": 文档总页数, "pages": 所处理页面的尺寸,
+             "text_elements": 全文文本元素（按列存储的 SpanTable）, "images": 全文图片信息,
+             "font_stats": {"avg_font_size", "max_font_size", "span_count"},
+             "page_cache": {"reused", "recomputed"} 或 None（未使用页级缓存）}
+    """
+    base_filename = os.path.splitext(os.path.basename(pdf_path))[0]
+    page_count = doc.page_count
+    if page_numbers is None:
+        page_numbers = list(range(page_count))
+    
+    if workers is None:
+        workers = MARKDOWN_WORKERS
+    workers = max(1, min(workers, len(page_numbers)))
+    
+    if page_cache is not None:
+        page_cache = PageCache(page_cache, IMAGE_EXTRACTION_MODE, image_max_width)
+    cache_stats = Counter()
+    
+    if workers > 1 and len(page_numbers) >= PARALLEL_MIN_PAGES:
+        # 并行模式：每个进程自行打开PDF，处理一段连续页面
+        text_elements, extracted_images = extract_pages_parallel(
+            pdf_path, page_numbers, images_dir, base_filename, workers, pdf_data, image_max_width,
+            page_cache, cache_stats)
+    else:
+        text_elements, extracted_images = extract_pages(
+            doc, page_numbers, images_dir, base_filename, progress_callback=progress_callback,
+            image_max_width=image_max_width, page_cache=page_cache, cache_stats=cache_stats)
+    
+    # 统计字号，供标题判定使用
+    font_sizes = text_elements.sizes
+    font_stats = {
+        "avg_font_size": sum(font_sizes) / len(font_sizes) if font_sizes else None,
+        "max_font_size": max(font_sizes) if font_sizes else None,
+        "span_count": len(font_sizes)
+    }
+    
+    return {
+        "base_filename": base_filename,
+        "page_count": page_count,
+        "pages": page_geometry(doc, page_numbers),
+        "text_elements": text_elements,
+        "images": extracted_images,
+        "font_stats": font_stats,
+        "page_cache": {
+            "reused": cache_stats["reused"],
+            "recomputed": cache_stats["recomputed"]
+        } if page_cache is not None else None
+    }
+
+def page_cache_counts(page_cache_stats):
+    """
+    页级缓存计数，合并到转换结果中
+
+    参数:
+        page_cache_stats (dict): 文档中间表示的 "page_cache"，None 表示未使用页级缓存
+
+    返回:
+        dict: {"pages_reused", "pages_recomputed"}，未使用页级缓存时为空字典
+    """
+    if page_cache_stats is None:
+        return {}
+    return {
+        "pages_reused": page_cache_stats["reused"],
+        "pages_recomputed": page_cache_stats["recomputed"]
+    }
+
+def document_to_markdown(document):
+    """
+    由文档中间表示生成Markdown
+    
+    参数:
+        document (dict): build_document 返回的中间表示
+        
+    返回:
+        dict: 包含markdown内容和图片信息的字典
+    """
+    text_elements = document["text_elements"]
+    extracted_images = document["images"]
+    
+    if not text_elements and not extracted_images:
+        return {
+            "markdown_content": "未找到文本或图片内容。",
+            "images": []
+        }
+    
+    # 处理文本元素，转换为Markdown
+    markdown_text = convert_elements_to_markdown(
+        text_elements, extracted_images, document["font_stats"]["avg_font_size"])
+    
+    return {
+        "markdown_content": markdown_text,
+        "images": extracted_images,
+        "deduplicated_images": count_deduplicated_images(extracted_images),
+        **page_cache_counts(document.get("page_cache"))
+    }
+
+def extract_page_range(doc, start, end, images_dir, base_filename, image_registry=None,
+                       progress_callback=None):
+    """
+    提取指定页面范围内的文本元素和图片
+    
+    参数:
+        doc: 已打开的PDF文档对象
+        start (int): 起始页（从0开始，包含）
+        end (int): 结束页（不包含）
+        
+    其余参数和返回值同 extract_pages
+    """
+    return extract_pages(doc, range(start, end), images_dir, base_filename, image_registry,
+                         progress_callback)
+
+def extract_pages(doc, page_numbers, images_dir, base_filename, image_registry=None,
+                  progress_callback=None, image_max_width=None, page_cache=None, cache_stats=None):
+    """
+    提取指定页面的文本元素和图片
+    
+    参数:
+        doc: 已打开的PDF文档对象
+        page_numbers: 页面索引（从0开始）的升序序列
+        images_dir (str): 图片保存目录
+        base_filename (str): 基础文件名
+        image_registry (dict): 图片去重登记表，None 时新建一个只覆盖该范围的登记表
+        progress_callback: 进度回调，每处理完一页调用 callback("extract", 页码, 总页数)
+        image_max_width (int): 给出时图片只保存在内存中（见 extract_images_from_page）
+        page_cache (PageCache): 页级缓存，内容未变的页面（按页面内容哈希）直接使用缓存的结果
+        cache_stats (Counter): 使用页级缓存时累计 "reused"（复用）和 "recomputed"（重新提取）的页数
+        
+    返回:
+        tuple: (文本元素表 SpanTable, 图片信息列表)
+    """
+    text_elements = SpanTable()
+    extracted_images = []
+    if image_registry is None:
+        image_registry = {}
+    if cache_stats is None:
+        cache_stats = Counter()
+    memory_guard = PageMemoryGuard()
+    hasher = PageHasher(doc) if page_cache is not None else None
+    
+    for page_num in page_numbers:
+        page = doc[page_num]
+        page_hash = None
+        
+        if page_cache is not None:
+            with stage_timer("page_cache"):
+                try:
+                    page_hash = hasher.page_hash(page)
+                    reused = reuse_cached_page(page, page_num, page_cache.load(page_hash), hasher, page_cache,
+                                               images_dir, base_filename, image_registry, image_max_width)
+                except Exception as e:
+                    logger.warning("读取页面缓存时出错", extra={"page": page_num + 1, "error": str(e)})
+                    page_hash = reused = None
+            
+            if reused is not None:
+                page_spans, page_images = reused
+                for text, size, flags, bbox in page_spans:
+                    text_elements.append(text, size, flags, bbox, page_num + 1)
+                extracted_images.extend(page_images)
+                cache_stats["reused"] += 1
+                if progress_callback is not None:
+                    progress_callback("extract", page_num + 1, doc.page_count)
+                continue
+            cache_stats["recomputed"] += 1
+        
+        # 提取图片（同一xref只保存一次）
+        with stage_timer("image_extraction"):
+            page_images = extract_images_from_page(page, page_num, images_dir, base_filename, image_registry,
+                                                   image_max_width)
+        extracted_images.extend(page_images)
+        for img in page_images:
+            if not img["deduplicated"]:
+                memory_guard.add_image(img["width"], img["height"])
+        
+        with stage_timer("text_extraction"):
+            # 获取文本字典，包含格式信息（只含文本块）
+            text_dict = page_text_dict(page)
+            
+            # 处理每个文本块
+            page_spans = []
+            for block in text_dict["blocks"]:
+                if "lines" in block:  # 文本块
+                    for line in block["lines"]:
+                        for span in line["spans"]:
+                            if span["text"].strip():
+                                text_elements.append(span["text"], span["size"], span["flags"],
+                                                     span["bbox"], page_num + 1)
+                                if page_hash is not None:
+                                    page_spans.append([span["text"], span["size"], span["flags"], span["bbox"]])
+        
+        if page_hash is not None:
+            with stage_timer("page_cache"):
+                try:
+                    store_cached_page(page, page_hash, page_spans, page_images, hasher, page_cache)
+                except Exception as e:
+                    logger.warning("写入页面缓存时出错", extra={"page": page_num + 1, "error": str(e)})
+        
+        memory_guard.page_done()
+        
+        if progress_callback is not None:
+            progress_callback("extract", page_num + 1, doc.page_count)
+    
+    return text_elements, extracted_images
+
+def reuse_cached_page(page, page_num, entry, hasher, page_cache, images_dir, base_filename, image_registry,
+                      image_max_width=None):
+    """
+    由页级缓存记录还原一页的提取结果，与重新提取该页得到的结果相同
+    （图片文件名、去重登记都按当前文档和页码生成）
+    
+    参数:
+        page: PDF页面对象
+        page_num: 页面编号
+        entry (dict): PageCache.load 返回的记录，None 表示未命中
+        hasher (PageHasher): 当前文档的页面哈希计算器
+        page_cache (PageCache): 页级缓存
+        其余参数同 extract_images_from_page
+        
+    返回:
+        tuple: ([[文本, 字号, 标志, 边界框], ...], 图片信息列表)；
+            记录不可用（未命中、图片内容已被淘汰等）时返回None
+    """
+    if entry is None:
+        return None
+    
+    image_list = page.get_images()
+    slots = entry["images"]
+    if len(slots) != len(image_list):
+        return None
+    
+    # 先确认需要保存的图片内容都还在缓存中，之后才修改去重登记表
+    image_data = {}
+    for img, slot in zip(image_list, slots):
+        xref = img[0]
+        if slot is None:
+            continue
+        if slot["hash"] != hasher.object_digest(xref):
+            return None
+        if xref in image_registry or xref in image_data:
+            continue
+        data = page_cache.load_image(slot["hash"])
+        if data is None:
+            return None
+        image_data[xref] = data
+    
+    images = []
+    for img_index, (img, slot) in enumerate(zip(image_list, slots)):
+        xref = img[0]
+        
+        # 该图片已在前面的页面处理过
+        if xref in image_registry:
+            original = image_registry[xref]
+            if original is not None:
+                images.append(deduplicated_image_info(original, page_num, img_index, xref))
+            continue
+        
+        image_registry[xref] = None
+        if slot is None:
+            # 提取时失败或被跳过的图片
+            continue
+        
+        img_filename = f"{base_filename}_page{page_num + 1}_img{img_index + 1}.{slot['ext']}"
+        if image_max_width is not None:
+            img_path = None
+        else:
+            img_path = os.path.join(images_dir, img_filename)
+            with open(img_path, "wb") as f:
+                f.write(image_data[xref])
+        
+        image_info = {
+            "filename": img_filename,
+            "path": img_path,
+            "page": page_num + 1,
+            "index": img_index + 1,
+            "width": slot["width"],
+            "height": slot["height"],
+            "xref": xref,
+            "deduplicated": False
+        }
+        if image_max_width is not None:
+            image_info["data"] = image_data[xref]
+        images.append(image_info)
+        image_registry[xref] = image_info
+    
+    return entry["spans"], images
+
+def store_cached_page(page, page_hash, page_spans, page_images, hasher, page_cache):
+    """
+    把一页的提取结果写入页级缓存：文本片段、每个图片位置的描述，以及本页新保存的图片内容
+    
+    参数:
+        page: PDF页面对象
+        page_hash (str): 页面内容哈希
+        page_spans (list): [[文本, 字号, 标志, 边界框], ...]
+        page_images (list): 本页的图片信息列表（extract_images_from_page 的结果）
+        hasher (PageHasher): 当前文档的页面哈希计算器
+        page_cache (PageCache): 页级缓存
+    """
+    images_by_index = {img["index"]: img for img in page_images}
+    slots = []
+    for img_index, img in enumerate(page.get_images()):
+        image_info = images_by_index.get(img_index + 1)
+        if image_info is None:
+            slots.append(None)
+            continue
+        
+        image_hash = hasher.object_digest(img[0])
+        if not image_info["deduplicated"]:
+            data = image_info.get("data")
+            if data is None:
+                with open(image_info["path"], "rb") as f:
+                    data = f.read()
+            page_cache.store_image(image_hash, data)
+        
+        slots.append({
+            "hash": image_hash,
+            "ext": image_info["filename"].rsplit(".", 1)[1],
+            "width": image_info["width"],
+            "height": image_info["height"]
+        })
+    
+    page_cache.store(page_hash, page_spans, slots)
+
+def _extract_pages_worker(pdf_path, page_numbers, images_dir, base_filename, pdf_data=None,
+                          image_max_width=None, page_cache=None):
+    """
+    进程池中执行的任务：独立打开PDF并提取一组页面
+    
+    返回:
+        tuple: (文本元素表, 图片信息列表, 阶段耗时列表, 页级缓存计数)
+    """
+    cache_stats = Counter()
+    with collect_stage_timings() as timings:
+        doc = open_pdf(pdf_path, pdf_data)
+        try:
+            text_elements, extracted_images = extract_pages(doc, page_numbers, images_dir, base_filename,
+                                                            image_max_width=image_max_width,
+                                                            page_cache=page_cache, cache_stats=cache_stats)
+        finally:
+            doc.close()
+    return text_elements, extracted_images, timings, cache_stats
+
+def split_page_ranges(page_count, parts):
+    """
+    将页面切分为连续且大小尽量均匀的区间
+    
+    参数:
+        page_count (int): 总页数
+        parts (int): 区间数量
+        
+    返回:
+        list: [(start, end), ...] 按页码顺序排列
+    """
+    parts = max(1, min(parts, page_count))
+    base, extra = divmod(page_count, parts)
+    ranges = []
+    start = 0
+    for i in range(parts):
+        end = start + base + (1 if i < extra else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+def extract_pages_parallel(pdf_path, page_numbers, images_dir, base_filename, workers, pdf_data=None,
+                           image_max_width=None, page_cache=None, cache_stats=None):
+    """
+    使用进程池并行提取页面，结果按页码顺序合并，与串行结果完全一致
+    
+    参数:
+        pdf_path (str): PDF文件的路径
+        page_numbers (list): 页面索引（从0开始）的升序列表
+        images_dir (str): 图片保存目录
+        base_filename (str): 基础文件名
+        workers (int): 进程数
+        pdf_data: PDF内容缓冲区，None 时各进程按路径打开
+        image_max_width (int): 给出时图片只保存在内存中（见 extract_images_from_page）
+        page_cache (PageCache): 页级缓存，各进程各自打开同一个缓存目录
+        cache_stats (Counter): 累计复用和重新提取的页数（见 extract_pages）
+        
+    返回:
+        tuple: (文本元素表 SpanTable, 图片信息列表)
+    """
+    text_elements = SpanTable()
+    extracted_images = []
+    
+    # memoryview（如内存映射的上传文件）不能pickle，转为bytes后传给工作进程
+    if pdf_data is not None and not isinstance(pdf_data, bytes):
+        pdf_data = bytes(pdf_data)
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_extract_pages_worker, pdf_path, page_numbers[start:end],
+                            images_dir, base_filename, pdf_data, image_max_width, page_cache)
+            for start, end in split_page_ranges(len(page_numbers), workers)
+        ]
+        # 按提交顺序（即页码顺序）收集结果
+        for future in futures:
+            range_elements, range_images, timings, range_stats = future.result()
+            replay_stage_timings(timings)
+            if cache_stats is not None:
+                cache_stats.update(range_stats)
+            text_elements.extend(range_elements)
+            extracted_images.extend(range_images)
+    
+    # 每个进程只在自己的页面范围内去重，合并后再做一次全文档去重
+    merge_duplicate_images(extracted_images)
+    
+    return text_elements, extracted_images
+
+def merge_duplicate_images(extracted_images):
+    """
+    将按页码排序的图片列表中重复的xref统一指向第一次出现时保存的文件，
+    并删除其他进程重复保存的文件，使结果与串行提取一致
+    
+    参数:
+        extracted_images (list): 图片信息列表，原地修改
+    """
+    canonical = {}
+    for img in extracted_images:
+        xref = img["xref"]
+        if xref not in canonical:
+            canonical[xref] = img
+            continue
+        
+        original = canonical[xref]
+        if img["path"] and img["path"] != original["path"] and os.path.exists(img["path"]):
+            os.remove(img["path"])
+        img["filename"] = original["filename"]
+        img["path"] = original["path"]
+        if "data" in original:
+            img["data"] = original["data"]
+        img["deduplicated"] = True
+
+def count_deduplicated_images(extracted_images):
+    """统计引用了已提取图片（未重复保存）的图片条目数"""
+    return sum(1 for img in extracted_images if img.get("deduplicated"))
+
+@stage_timer("font_scan")
+def scan_font_sizes(doc, page_numbers=None):
+    """
+    第一遍扫描：只统计字号直方图，不保留文本元素，内存占用与页数无关
+    
+    参数:
+        doc: 已打开的PDF文档对象
+        page_numbers: 参与统计的页面索引（从0开始），None 表示全部页面
+        
+    返回:
+        dict: {"histogram": Counter（字号 -> 文本片段数）, "span_count",
+               "avg_font_size", "max_font_size"}，没有文本时后两项为None
+    """
+    histogram = Counter()
+    total_size = 0
+    span_count = 0
+    
+    if page_numbers is None:
+        page_numbers = range(doc.page_count)
+    
+    for page_num in page_numbers:
+        text_dict = page_text_dict(doc[page_num])
+        for block in text_dict["blocks"]:
+            if "lines" in block:  # 文本块
+                for line in block["lines"]:
+                    for span in line["spans"]:
+                        if span["text"].strip():
+                            # 按文档顺序累加，平均值与 build_document 的统计完全一致
+                            total_size += span["size"]
+                            span_count += 1
+                            histogram[span["size"]] += 1
+    
+    return {
+        "histogram": histogram,
+        "span_count": span_count,
+        "avg_font_size": total_size / span_count if span_count else None,
+        "max_font_size": max(histogram) if histogram else None
+    }
+
+def compute_average_font_size(doc, page_numbers=None):
+    """
+    快速统计平均字号（只累计字号，不保留文本元素），供逐页和分段转换使用
+    
+    参数:
+        doc: 已打开的PDF文档对象
+        page_numbers: 参与统计的页面索引（从0开始），None 表示全部页面
+        
+    返回:
+        float: 平均字号，没有文本时返回None
+    """
+    return scan_font_sizes(doc, page_numbers)["avg_font_size"]
+
+def stream_markdown(doc, page_numbers, images_dir, base_filename, write, image_link_prefix="", page_cache=None):
+    """
+    两遍转换：先扫描字号直方图，再逐页提取并把Markdown写出，不保留全文的文本元素
+    
+    参数:
+        doc: 已打开的PDF文档对象
+        page_numbers: 页面索引（从0开始）的升序序列
+        images_dir (str): 图片保存目录
+        base_filename (str): 基础文件名
+        write: 写出函数，如文件或套接字的 write，依次接收Markdown文本片段
+        image_link_prefix (str): 图片链接的前缀（见 MarkdownAssembler）
+        page_cache (ConversionCache): 页级提取结果缓存（见 build_document）
+        
+    返回:
+        dict: {"images": 图片信息列表, "deduplicated_images", "font_stats",
+               "page_cache": {"reused", "recomputed"} 或 None}
+    """
+    font_stats = scan_font_sizes(doc, page_numbers)
+    assembler = MarkdownAssembler(font_stats["avg_font_size"], has_text=font_stats["span_count"] > 0,
+                                  image_link_prefix=image_link_prefix)
+    extracted_images = []
+    image_registry = {}
+    written = False
+    if page_cache is not None:
+        page_cache = PageCache(page_cache, IMAGE_EXTRACTION_MODE)
+    cache_stats = Counter()
+    
+    for page_num in page_numbers:
+        page_elements, page_images = extract_pages(doc, (page_num,), images_dir, base_filename, image_registry,
+                                                   page_cache=page_cache, cache_stats=cache_stats)
+        extracted_images.extend(page_images)
+        with stage_timer("markdown_assembly"):
+            chunk = assembler.add(page_elements, page_images)
+        if chunk:
+            write(chunk)
+            written = True
+    
+    chunk = assembler.finish()
+    if chunk:
+        write(chunk)
+        written = True
+    if not written:
+        write("未找到文本或图片内容。")
+    
+    return {
+        "images": extracted_images,
+        "deduplicated_images": count_deduplicated_images(extracted_images),
+        "font_stats": font_stats,
+        "page_cache": {
+            "reused": cache_stats["reused"],
+            "recomputed": cache_stats["recomputed"]
+        } if page_cache is not None else None
+    }
+
+def pdf_to_markdown_stream(pdf_path, output, pdf_data=None, pages=None, image_link_prefix=""):
+    """
+    低内存模式：把PDF转换为Markdown并逐页写入 output，峰值内存与文档页数基本无关
+    
+    输出与 pdf_to_markdown 的 markdown_content 相同，适合上千页的文档。
+    
+    参数:
+        pdf_path (str): PDF文件的路径，图片保存在同目录的 <文件名>_images 中
+        output: 可写的文本流（文件、io.StringIO 或包装了套接字的文本流）
+        pdf_data: PDF内容缓冲区，给出时不读取 pdf_path（见 open_pdf）
+        pages (str): 页面选择表达式，如 "1-10,25,40-"，None 表示全部页面
+        image_link_prefix (str): 图片链接的前缀，如 "name_images/"
+        
+    返回:
+        dict: {"status", "message", "page_count": 文档总页数, "selected_count": 转换页数,
+               "image_count", "deduplicated_images", "avg_font_size"}
+    """
+    if pdf_data is None and not os.path.exists(pdf_path):
+        return {
+            "status": "error",
+            "message": f"文件不存在: {pdf_path}"
+        }
+    
+    doc = None
+    try:
+        log_open_request(pdf_path, pdf_data)
+        doc = open_pdf(pdf_path, pdf_data)
+        
+        if doc.page_count == 0:
+            return {
+                "status": "error",
+                "message": "PDF文件为空"
+            }
+        
+        page_numbers = select_pages(pages, doc.page_count)
+        
+        base_filename = os.path.splitext(os.path.basename(pdf_path))[0]
+        images_dir = os.path.join(os.path.dirname(pdf_path), f"{base_filename}_images")
+        os.makedirs(images_dir, exist_ok=True)
+        
+        result = stream_markdown(doc, page_numbers, images_dir, base_filename, output.write, image_link_prefix)
+        
+        return {
+            "status": "success",
+            "message": f"已转换{len(page_numbers)}页",
+            "page_count": doc.page_count,
+            "selected_count": len(page_numbers),
+            "image_count": len(result["images"]),
+            "deduplicated_images": result["deduplicated_images"],
+            "avg_font_size": result["font_stats"]["avg_font_size"]
+        }
+    
+    except Exception as e:
+        error_msg = f"转换过程中出错: {str(e)}"
+        logger.exception(error_msg)
+        return {
+            "status": "error",
+            "message": error_msg
+        }
+    
+    finally:
+        if doc is not None:
+            try:
+                doc.close()
+            except:
+                pass  # 忽略关闭时的错误
+
+def iter_pdf_to_markdown(pdf_path, pdf_data=None):
+    """
+    逐页将PDF转换为Markdown的生成器版本，每处理完一页立即产出该页结果
+    
+    先用一次轻量扫描统计全文平均字号，再逐页提取和转换，
+    因此内存占用与文档页数无关。
+    
+    参数:
+        pdf_path (str): PDF文件的路径
+        pdf_data: PDF内容缓冲区，给出时不读取 pdf_path（见 open_pdf）
+        
+    返回:
+        generator: 依次产出字典记录：
+            {"type": "page", "page", "page_count", "markdown", "images", "progress"}，
+            全部完成后产出 {"type": "done", "page_count", "image_count", "deduplicated_images"}，
+            出错时产出 {"type": "error", "message"} 并结束
+    """
+    if pdf_data is None and not os.path.exists(pdf_path):
+        yield {"type": "error", "message": f"文件不存在: {pdf_path}"}
+        return
+    
+    doc = None
+    try:
+        doc = open_pdf(pdf_path, pdf_data)
+        
+        if doc.page_count == 0:
+            yield {"type": "error", "message": "未找到内容。PDF文件为空。"}
+            return
+        
+        # 创建图片存储目录
+        base_filename = os.path.splitext(os.path.basename(pdf_path))[0]
+        images_dir = os.path.join(os.path.dirname(pdf_path), f"{base_filename}_images")
+        os.makedirs(images_dir, exist_ok=True)
+        
+        avg_font_size = compute_average_font_size(doc)
+        page_count = doc.page_count
+        image_count = 0
+        deduplicated_count = 0
+        image_registry = {}
+        
+        for page_num in range(page_count):
+            page_elements, page_images = extract_page_range(
+                doc, page_num, page_num + 1, images_dir, base_filename, image_registry)
+            image_count += len(page_images)
+            deduplicated_count += count_deduplicated_images(page_images)
+            
+            yield {
+                "type": "page",
+                "page": page_num + 1,
+                "page_count": page_count,
+                "markdown": convert_elements_to_markdown(page_elements, page_images, avg_font_size),
+                "images": page_images,
+                "progress": round((page_num + 1) / page_count, 4)
+            }
+        
+        yield {
+            "type": "done",
+            "page_count": page_count,
+            "image_count": image_count,
+            "deduplicated_images": deduplicated_count
+        }
+    
+    except Exception as e:
+        error_msg = f"转换过程中出错: {str(e)}"
+        logger.exception(error_msg)
+        yield {"type": "error", "message": error_msg}
+    
+    finally:
+        if doc is not None:
+            try:
+                doc.close()
+            except:
+                pass  # 忽略关闭时的错误
 
-def pdf_to_markdown(pdf_path):
+def pdf_to_markdown_chunk(pdf_path, start=0, limit=10, pages=None, avg_font_size=None, pdf_data=None):
     """
-    将PDF文件转换为格式化的Markdown文本，包含图片提取
+    分段转换：只转换所选页面中从第 start 个开始的至多 limit 页
+    
+    标题阈值以所选页面（未指定时为全文）的平均字号为基准。首段转换时计算该值并随结果返回，
+    调用方在后续分段中传回，使各段的标题判定与一次性转换所选页面保持一致。
     
     参数:
         pdf_path (str): PDF文件的路径
+        start (int): 在所选页面列表中的起始位置（从0开始）
+        limit (int): 本段最多转换的页数
+        pages (str): 页面选择表达式，如 "1-10,25,40-"，None 表示全部页面
+        avg_font_size (float): 前一段返回的平均字号，None 时重新统计
+        pdf_data: PDF内容缓冲区，给出时不读取 pdf_path（见 open_pdf）
         
     返回:
-        dict: 包含markdown内容和图片信息的字典
+        dict: {"status", "message", "markdown_content", "images", "deduplicated_images",
+               "pages": 本段转换的页码列表, "page_count": 文档总页数, "selected_count": 所选页数,
+               "next_start": 下一段的起始位置（已全部转换时为None）, "avg_font_size"}
     """
+    if pdf_data is None and not os.path.exists(pdf_path):
+        return {
+            "status": "error",
+            "message": f"文件不存在: {pdf_path}"
+        }
+    
+    doc = None
     try:
-        # 验证文件路径
-        print(f"尝试打开PDF文件: {pdf_path}")
-        print(f"文件是否存在: {os.path.exists(pdf_path)}")
-        print(f"当前工作目录: {os.getcwd()}")
+        doc = open_pdf(pdf_path, pdf_data)
         
-        if not os.path.exists(pdf_path):
+        if doc.page_count == 0:
             return {
-                "markdown_content": f"文件不存在: {pdf_path}",
-                "images": []
+                "status": "error",
+                "message": "PDF文件为空"
             }
         
-        # 打开PDF文件
-        doc = fitz.open(pdf_path)
-        
-        if doc.page_count == 0:
+        page_numbers = select_pages(pages, doc.page_count)
+        if start < 0 or start >= len(page_numbers):
             return {
-                "markdown_content": "未找到内容。PDF文件为空。",
-                "images": []
+                "status": "error",
+                "message": f"起始位置超出范围（共选中{len(page_numbers)}页）"
             }
         
-        # 创建图片存储目录
-        base_filename = os.path.splitext(os.path.basename(pdf_path))[0]
-        images_dir = os.path.join(os.path.dirname(pdf_path), f"{base_filename}_images")
-        if not os.path.exists(images_dir):
-            os.makedirs(images_dir)
+        if avg_font_size is None:
+            avg_font_size = compute_average_font_size(doc, page_numbers)
         
-        # 提取文本块和格式信息
-        text_elements = []
-        extracted_images = []
+        chunk = page_numbers[start:start + limit]
+        next_start = start + len(chunk)
         
-        for page_num in range(doc.page_count):
-            page = doc[page_num]
-            
-            # 提取图片
-            page_images = extract_images_from_page(page, page_num, images_dir, base_filename)
-            extracted_images.extend(page_images)
-            
-            # 获取文本字典，包含格式信息
-            text_dict = page.get_text("dict")
-            
-            # 处理每个文本块
-            for block in text_dict["blocks"]:
-                if "lines" in block:  # 文本块
-                    for line in block["lines"]:
-                        for span in line["spans"]:
-                            if span["text"].strip():
-                                text_elements.append({
-                                    "text": span["text"],
-                                    "font_size": span["size"],
-                                    "font_flags": span["flags"],
-                                    "bbox": span["bbox"],
-                                    "page": page_num + 1
-                                })
-        
-        # 关闭文档
-        doc.close()
+        base_filename = os.path.splitext(os.path.basename(pdf_path))[0]
+        images_dir = os.path.join(os.path.dirname(pdf_path), f"{base_filename}_images")
+        os.makedirs(images_dir, exist_ok=True)
         
-        if not text_elements and not extracted_images:
-            return {
-                "markdown_content": "未找到文本或图片内容。",
-                "images": []
-            }
+        text_elements, extracted_images = extract_pages(doc, chunk, images_dir, base_filename)
         
-        # 处理文本元素，转换为Markdown
-        markdown_text = convert_elements_to_markdown(text_elements, extracted_images)
+        if text_elements or extracted_images:
+            markdown_text = convert_elements_to_markdown(text_elements, extracted_images, avg_font_size)
+        else:
+            markdown_text = ""
         
         return {
+            "status": "success",
+            "message": f"已转换{len(chunk)}页",
             "markdown_content": markdown_text,
-            "images": extracted_images
+            "images": extracted_images,
+            "deduplicated_images": count_deduplicated_images(extracted_images),
+            "pages": [page_num + 1 for page_num in chunk],
+            "page_count": doc.page_count,
+            "selected_count": len(page_numbers),
+            "next_start": next_start if next_start < len(page_numbers) else None,
+            "avg_font_size": avg_font_size
         }
     
     except Exception as e:
-        # 记录错误并返回错误消息
         error_msg = f"转换过程中出错: {str(e)}"
-        print(error_msg)
+        logger.exception(error_msg)
         return {
-            "markdown_content": error_msg,
-            "images": []
+            "status": "error",
+            "message": error_msg
         }
+    
+    finally:
+        if doc is not None:
+            try:
+                doc.close()
+            except:
+                pass  # 忽略关闭时的错误
 
-def extract_images_from_page(page, page_num, images_dir, base_filename):
+def extract_images_from_page(page, page_num, images_dir, base_filename, image_registry=None,
+                             image_max_width=None):
     """
     从PDF页面提取图片
     
@@ -118,6 +1114,10 @@ def extract_images_from_page(page, page_num, images_dir, base_filename):
         page_num: 页面编号
         images_dir: 图片保存目录
         base_filename: 基础文件名
+        image_registry (dict): 文档级的 xref -> 图片信息 登记表；传入时同一图片
+            只提取一次，之后的页面直接引用已保存的文件
+        image_max_width (int): 给出时图片不写入磁盘，缩小到不超过该像素宽度后
+            保存在图片信息的 data 字段中（path 为None），用于只生成Word文档的转换
         
     返回:
         list: 提取的图片信息列表
@@ -126,48 +1126,356 @@ def extract_images_from_page(page, page_num, images_dir, base_filename):
     image_list = page.get_images()
     
     for img_index, img in enumerate(image_list):
+        xref = img[0]
+        
+        # 该图片已在前面的页面处理过
+        if image_registry is not None and xref in image_registry:
+            original = image_registry[xref]
+            if original is not None:
+                images.append(deduplicated_image_info(original, page_num, img_index, xref))
+            continue
+        
+        if image_registry is not None:
+            # 先登记为None，提取失败或被跳过的图片在后续页面不再重试
+            image_registry[xref] = None
+        
         try:
-            # 获取图片数据
-            xref = img[0]
-            pix = fitz.Pixmap(page.parent, xref)
-            
-            # 跳过CMYK图片（转换复杂）
-            if pix.n - pix.alpha < 4:
-                # 生成唯一的图片文件名
-                img_filename = f"{base_filename}_page{page_num + 1}_img{img_index + 1}.png"
+            # 生成唯一的图片文件名（扩展名由保存时的实际格式决定）
+            img_stem = f"{base_filename}_page{page_num + 1}_img{img_index + 1}"
+            img_data = None
+            if image_max_width is not None:
+                img_data, ext, width, height = load_image_xref(page.parent, xref, image_max_width)
+                img_filename = f"{img_stem}.{ext}"
+                img_path = None
+            else:
+                img_filename, width, height = save_image_xref(page.parent, xref, images_dir, img_stem)
                 img_path = os.path.join(images_dir, img_filename)
-                
-                # 保存图片
-                if pix.alpha:
-                    pix = fitz.Pixmap(fitz.csRGB, pix)
-                
-                pix.save(img_path)
-                
-                # 记录图片信息
-                images.append({
-                    "filename": img_filename,
-                    "path": img_path,
-                    "page": page_num + 1,
-                    "index": img_index + 1,
-                    "width": pix.width,
-                    "height": pix.height
-                })
-                
-            pix = None  # 释放内存
+            
+            # 记录图片信息
+            image_info = {
+                "filename": img_filename,
+                "path": img_path,
+                "page": page_num + 1,
+                "index": img_index + 1,
+                "width": width,
+                "height": height,
+                "xref": xref,
+                "deduplicated": False
+            }
+            if img_data is not None:
+                image_info["data"] = img_data
+            images.append(image_info)
+            if image_registry is not None:
+                image_registry[xref] = image_info
             
         except Exception as e:
-            print(f"提取第{page_num + 1}页第{img_index + 1}张图片时出错: {str(e)}")
+            logger.warning("提取图片时出错", extra={"page": page_num + 1, "index": img_index + 1,
+                                                  "error": str(e)})
             continue
     
     return images
 
-def convert_elements_to_markdown(text_elements, extracted_images):
+def deduplicated_image_info(original, page_num, img_index, xref):
+    """
+    引用已提取图片的图片信息：文件与首次提取时相同，页码和序号为当前位置
+    
+    参数:
+        original (dict): 首次提取时的图片信息
+        page_num: 页面编号
+        img_index: 图片在页面中的序号（从0开始）
+        xref: 图片的xref编号
+        
+    返回:
+        dict: 图片信息
+    """
+    image_info = {
+        "filename": original["filename"],
+        "path": original["path"],
+        "page": page_num + 1,
+        "index": img_index + 1,
+        "width": original["width"],
+        "height": original["height"],
+        "xref": xref,
+        "deduplicated": True
+    }
+    if "data" in original:
+        image_info["data"] = original["data"]
+    return image_info
+
+def save_image_xref(doc, xref, images_dir, img_stem, image_mode=None):
+    """
+    将PDF中的一张图片保存到磁盘
+    
+    passthrough 模式下，格式在 PASSTHROUGH_FORMATS 中、没有软蒙版且为灰度/RGB的图片
+    直接写出原始编码流，不经过解码和重编码；其余情况回退到 Pixmap 并保存为PNG，
+    CMYK 等色彩空间会先转换为RGB。
+    
+    参数:
+        doc: 已打开的PDF文档对象
+        xref: 图片的xref编号
+        images_dir: 图片保存目录
+        img_stem: 不含扩展名的文件名
+        image_mode: 提取模式，None 时使用 IMAGE_EXTRACTION_MODE
+        
+    返回:
+        tuple: (文件名, 宽度, 高度)
+    """
+    if image_mode is None:
+        image_mode = IMAGE_EXTRACTION_MODE
+    
+    if image_mode == "passthrough":
+        extracted = doc.extract_image(xref)
+        if (extracted
+                and extracted["ext"].lower() in PASSTHROUGH_FORMATS
+                and not extracted.get("smask")
+                and extracted.get("colorspace") in (1, 3)):
+            ext = "jpg" if extracted["ext"].lower() == "jpeg" else extracted["ext"].lower()
+            img_filename = f"{img_stem}.{ext}"
+            with open(os.path.join(images_dir, img_filename), "wb") as f:
+                f.write(extracted["image"])
+            return img_filename, extracted["width"], extracted["height"]
+    
+    # 回退：解码为Pixmap后保存为PNG
+    pix = fitz.Pixmap(doc, xref)
+    
+    # CMYK、Lab 等非灰度/RGB色彩空间先转换为RGB；带透明通道的图片同样转为RGB
+    if pix.alpha or pix.n - pix.alpha not in (1, 3):
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    
+    img_filename = f"{img_stem}.png"
+    pix.save(os.path.join(images_dir, img_filename))
+    width, height = pix.width, pix.height
+    pix = None  # 释放内存
+    
+    return img_filename, width, height
+
+def load_image_xref(doc, xref, max_width, image_mode=None):
+    """
+    将PDF中的一张图片读取到内存，宽度超过 max_width 像素时缩小，不写入磁盘（用于Word嵌入）
+    
+    不需要缩小的JPEG图片直接使用原始编码流；其余图片解码为Pixmap，必要时缩小后
+    只编码一次（原为JPEG的仍编码为JPEG，其余为PNG）。
+    
+    参数:
+        doc: 已打开的PDF文档对象
+        xref: 图片的xref编号
+        max_width (int): 最大像素宽度
+        image_mode: 提取模式，None 时使用 IMAGE_EXTRACTION_MODE
+        
+    返回:
+        tuple: (图片数据, 扩展名, 原始宽度, 原始高度)
+    """
+    if image_mode is None:
+        image_mode = IMAGE_EXTRACTION_MODE
+    
+    is_jpeg = doc.xref_get_key(xref, "Filter")[1] == "/DCTDecode"
+    if is_jpeg and image_mode == "passthrough":
+        extracted = doc.extract_image(xref)
+        if (extracted
+                and extracted["width"] <= max_width
+                and not extracted.get("smask")
+                and extracted.get("colorspace") in (1, 3)):
+            return extracted["image"], "jpg", extracted["width"], extracted["height"]
+    
+    pix = fitz.Pixmap(doc, xref)
+    if pix.alpha or pix.n - pix.alpha not in (1, 3):
+        pix = fitz.Pixmap(fitz.csRGB, pix)
+    width, height = pix.width, pix.height
+    
+    if width > max_width:
+        pix = fitz.Pixmap(pix, max_width, max(1, round(height * max_width / width)), None)
+    
+    if is_jpeg and not pix.alpha:
+        return encode_pixmap(pix, "jpeg", WORD_JPEG_QUALITY), "jpg", width, height
+    return encode_pixmap(pix, "png", None), "png", width, height
+
+class MarkdownAssembler:
+    """
+    把文本片段组装为Markdown，可以分多次（如逐页）输入，输出与一次性转换全文相同
+    
+    组装过程只保留当前页的段落、图片和上一行Markdown，内存占用与文档页数无关；
+    标题判定以构造时给出的全文平均字号为基准。
+    """
+    
+    def __init__(self, avg_font_size, has_text=True, image_link_prefix=""):
+        """
+        参数:
+            avg_font_size (float): 全文平均字号（见 scan_font_sizes）
+            has_text (bool): 全文是否有文本；没有文本时只逐个列出图片
+            image_link_prefix (str): 图片链接的前缀，如 "name_images/"
+        """
+        self.avg_font_size = avg_font_size
+        self.has_text = has_text
+        self.image_link_prefix = image_link_prefix
+        self._current_page = 1
+        self._current_paragraph = []
+        self._last_y = None
+        self._images_by_page = {}
+        self._previous_line = None  # 上一行后处理结果，用于列表前空行和连续空行的判断
+        self._started = False
+    
+    def _image_lines(self, img):
+        return [
+            f"![图片 {img['index']}]({self.image_link_prefix}{img['filename']})",
+            f"*第{img['page']}页 - 图片{img['index']} ({img['width']}x{img['height']})*"
+        ]
+    
+    def _flush_paragraph(self, markdown_lines):
+        if self._current_paragraph:
+            paragraph_text = " ".join(self._current_paragraph).strip()
+            if paragraph_text:
+                markdown_lines.append(paragraph_text)
+            self._current_paragraph = []
+    
+    def _join(self, lines):
+        """把新产生的行拼接为文本片段，与之前输出的内容之间以空行分隔"""
+        if not lines:
+            return ""
+        text = "\n\n".join(lines)
+        if self._started:
+            text = "\n\n" + text
+        self._started = True
+        return text
+    
+    def _post_process(self, markdown_lines):
+        """后处理：跳过空行，列表前（标题之后除外）补一个空行，不输出连续的空行"""
+        final_lines = []
+        for line in markdown_lines:
+            if not line.strip():
+                continue
+            
+            processed = []
+            # 处理列表项：确保列表前有空行
+            if re.match(r'^[\d]+\.', line) or line.startswith('- '):
+                previous = self._previous_line
+                if previous is not None and not previous.startswith(('- ', '1.', '2.', '3.', '4.', '5.', '6.', '7.', '8.', '9.', '0.')):
+                    if not previous.startswith('#'):
+                        processed.append('')  # 在列表前添加空行
+            processed.append(line)
+            
+            for processed_line in processed:
+                # 跳过连续的空行
+                if not (processed_line == '' and self._previous_line == ''):
+                    final_lines.append(processed_line)
+                self._previous_line = processed_line
+        return final_lines
+    
+    def add(self, text_elements, extracted_images):
+        """
+        输入一段文本片段及其所在页面的图片，页码不小于之前输入的页码
+        
+        参数:
+            text_elements (SpanTable): 文本元素表
+            extracted_images (list): 这些页面的图片信息列表
+            
+        返回:
+            str: 新产生的Markdown文本（可能为空）
+        """
+        if not self.has_text:
+            lines = []
+            for img in extracted_images:
+                lines.extend(self._image_lines(img))
+            return self._join(lines)
+        
+        for img in extracted_images:
+            self._images_by_page.setdefault(img['page'], []).append(img)
+        
+        # 对整列字号一次性分类
+        font_sizes = text_elements.sizes
+        heading_levels = classify_heading_levels(font_sizes, self.avg_font_size)
+        font_flags_column = text_elements.flags
+        pages_column = text_elements.pages
+        bboxes = text_elements.bboxes
+        
+        markdown_lines = []
+        
+        for i in range(len(text_elements)):
+            text = text_elements.text(i).strip()
+            font_size = font_sizes[i]
+            page = pages_column[i]
+            
+            if not text:
+                continue
+            
+            # 检查是否切换到新页面，如果是则插入该页面的图片
+            if page != self._current_page:
+                # 完成当前段落
+                self._flush_paragraph(markdown_lines)
+                
+                # 插入前一页的图片（如果有）
+                if self._current_page in self._images_by_page:
+                    markdown_lines.append("")  # 添加空行
+                    for img in self._images_by_page[self._current_page]:
+                        markdown_lines.extend(self._image_lines(img))
+                    markdown_lines.append("")  # 添加空行
+                
+                self._current_page = page
+                self._last_y = None  # 重置Y坐标
+            
+            # 检测换行（基于y坐标变化）
+            current_y = bboxes[4 * i + 1]  # y0坐标
+            line_break = False
+            
+            if self._last_y is not None:
+                y_diff = abs(current_y - self._last_y)
+                if y_diff > font_size * 0.8:  # 行间距大于字体大小的80%
+                    line_break = True
+            
+            # 处理当前段落
+            if line_break:
+                self._flush_paragraph(markdown_lines)
+            
+            # 判断文本类型并格式化
+            formatted_text = format_classified_text(text, heading_levels[i], font_flags_column[i])
+            
+            # 如果是标题，直接添加到结果中
+            if formatted_text.startswith('#'):
+                self._flush_paragraph(markdown_lines)
+                markdown_lines.append(formatted_text)
+            else:
+                # 添加到当前段落
+                self._current_paragraph.append(formatted_text)
+            
+            self._last_y = current_y
+        
+        # 只有当前页的图片还可能被插入，其余页面（没有文本的页面）的图片不再需要
+        current_images = self._images_by_page.get(self._current_page)
+        self._images_by_page = {self._current_page: current_images} if current_images else {}
+        
+        return self._join(self._post_process(markdown_lines))
+    
+    def finish(self):
+        """
+        结束输入，输出最后一个段落和最后一页的图片
+        
+        返回:
+            str: 剩余的Markdown文本（可能为空）
+        """
+        if not self.has_text:
+            return ""
+        
+        markdown_lines = []
+        self._flush_paragraph(markdown_lines)
+        
+        # 插入最后一页的图片（如果有）
+        if self._current_page in self._images_by_page:
+            markdown_lines.append("")  # 添加空行
+            for img in self._images_by_page[self._current_page]:
+                markdown_lines.extend(self._image_lines(img))
+        self._images_by_page = {}
+        
+        return self._join(self._post_process(markdown_lines))
+
+@stage_timer("markdown_assembly")
+def convert_elements_to_markdown(text_elements, extracted_images, avg_font_size=None):
     """
     将文本元素转换为格式化的Markdown，包含图片引用
     
     参数:
-        text_elements (list): 包含格式信息的文本元素列表
+        text_elements (SpanTable): 包含格式信息的文本元素表（也接受旧的字典列表）
         extracted_images (list): 提取的图片信息列表
+        avg_font_size (float): 全文平均字号，None 时根据 text_elements 计算；
+            逐页转换时传入全文统计值，使各页的标题判定保持一致
         
     返回:
         str: 格式化的Markdown文本
@@ -175,136 +1483,86 @@ def convert_elements_to_markdown(text_elements, extracted_images):
     if not text_elements and not extracted_images:
         return ""
     
-    # 如果只有图片没有文本
-    if not text_elements:
-        markdown_lines = []
-        for img in extracted_images:
-            markdown_lines.append(f"![图片 {img['index']}]({img['filename']})")
-            markdown_lines.append(f"*第{img['page']}页 - 图片{img['index']} ({img['width']}x{img['height']})*")
-        return "\n\n".join(markdown_lines)
+    if text_elements and not isinstance(text_elements, SpanTable):
+        text_elements = SpanTable.from_elements(text_elements)
     
-    # 分析字体大小，确定标题级别
-    font_sizes = [elem["font_size"] for elem in text_elements]
-    avg_font_size = sum(font_sizes) / len(font_sizes)
-    max_font_size = max(font_sizes)
+    if text_elements and avg_font_size is None:
+        font_sizes = text_elements.sizes
+        avg_font_size = sum(font_sizes) / len(font_sizes)
+    
+    assembler = MarkdownAssembler(avg_font_size, has_text=bool(text_elements))
+    return assembler.add(text_elements, extracted_images) + assembler.finish()
+
+def classify_heading_levels(font_sizes, avg_font_size):
+    """
+    对整列字号一次性计算标题级别
     
+    参数:
+        font_sizes: 字号序列（如 SpanTable.sizes）
+        avg_font_size (float): 平均字号
+        
+    返回:
+        array: 每个片段的标题级别，1-4 对应 #-####，0 表示正文
+    """
     # 定义标题阈值
     title_threshold = avg_font_size * 1.2
     subtitle_threshold = avg_font_size * 1.1
+    h1_threshold = title_threshold * 1.3
+    h2_threshold = title_threshold * 1.1
     
-    markdown_lines = []
-    current_paragraph = []
-    last_y = None
-    current_page = 1
-    
-    # 按页面组织图片
-    images_by_page = {}
-    for img in extracted_images:
-        page = img['page']
-        if page not in images_by_page:
-            images_by_page[page] = []
-        images_by_page[page].append(img)
-    
-    for i, elem in enumerate(text_elements):
-        text = elem["text"].strip()
-        font_size = elem["font_size"]
-        font_flags = elem["font_flags"]
-        bbox = elem["bbox"]
-        page = elem["page"]
-        
-        if not text:
-            continue
-        
-        # 检查是否切换到新页面，如果是则插入该页面的图片
-        if page != current_page:
-            # 完成当前段落
-            if current_paragraph:
-                paragraph_text = " ".join(current_paragraph).strip()
-                if paragraph_text:
-                    markdown_lines.append(paragraph_text)
-                current_paragraph = []
-            
-            # 插入前一页的图片（如果有）
-            if current_page in images_by_page:
-                markdown_lines.append("")  # 添加空行
-                for img in images_by_page[current_page]:
-                    markdown_lines.append(f"![图片 {img['index']}]({img['filename']})")
-                    markdown_lines.append(f"*第{img['page']}页 - 图片{img['index']} ({img['width']}x{img['height']})*")
-                markdown_lines.append("")  # 添加空行
-            
-            current_page = page
-            last_y = None  # 重置Y坐标
-        
-        # 检测换行（基于y坐标变化）
-        current_y = bbox[1]  # y0坐标
-        line_break = False
-        
-        if last_y is not None:
-            y_diff = abs(current_y - last_y)
-            if y_diff > font_size * 0.8:  # 行间距大于字体大小的80%
-                line_break = True
-        
-        # 处理当前段落
-        if line_break and current_paragraph:
-            # 完成当前段落
-            paragraph_text = " ".join(current_paragraph).strip()
-            if paragraph_text:
-                markdown_lines.append(paragraph_text)
-            current_paragraph = []
-        
-        # 判断文本类型并格式化
-        formatted_text = format_text_element(text, font_size, font_flags, 
-                                           title_threshold, subtitle_threshold, avg_font_size)
-        
-        # 如果是标题，直接添加到结果中
-        if formatted_text.startswith('#'):
-            if current_paragraph:
-                paragraph_text = " ".join(current_paragraph).strip()
-                if paragraph_text:
-                    markdown_lines.append(paragraph_text)
-                current_paragraph = []
-            markdown_lines.append(formatted_text)
-        else:
-            # 添加到当前段落
-            current_paragraph.append(formatted_text)
-        
-        last_y = current_y
+    # 文档中不同的字号通常只有几十种：每种字号判定一次，再按列映射，不对每个片段执行判断
+    levels_by_size = {
+        size: (1 if size >= h1_threshold else
+               2 if size >= h2_threshold else
+               3 if size >= title_threshold else
+               4 if size >= subtitle_threshold else
+               0)
+        for size in set(font_sizes)
+    }
+    return array("b", map(levels_by_size.__getitem__, font_sizes))
+
+def classify_word_heading_levels(font_sizes):
+    """
+    对一页的字号一次性计算Word标题级别
     
-    # 处理最后一个段落
-    if current_paragraph:
-        paragraph_text = " ".join(current_paragraph).strip()
-        if paragraph_text:
-            markdown_lines.append(paragraph_text)
+    达到该页平均字号1.2倍且为该页最大字号的片段为2级标题，达到1.1倍的为3级标题。
     
-    # 插入最后一页的图片（如果有）
-    if current_page in images_by_page:
-        markdown_lines.append("")  # 添加空行
-        for img in images_by_page[current_page]:
-            markdown_lines.append(f"![图片 {img['index']}]({img['filename']})")
-            markdown_lines.append(f"*第{img['page']}页 - 图片{img['index']} ({img['width']}x{img['height']})*")
+    参数:
+        font_sizes: 该页字号序列
+        
+    返回:
+        array: 每个片段的Word标题级别，0 表示正文
+    """
+    avg_font_size = sum(font_sizes) / len(font_sizes)
+    max_font_size = max(font_sizes)
     
-    # 后处理：清理和优化
-    processed_lines = post_process_markdown(markdown_lines)
+    # 定义标题阈值
+    title_threshold = avg_font_size * 1.2
+    subtitle_threshold = avg_font_size * 1.1
     
-    return "\n\n".join(processed_lines)
+    levels_by_size = {
+        size: (2 if size >= title_threshold and size == max_font_size else
+               3 if size >= subtitle_threshold else
+               0)
+        for size in set(font_sizes)
+    }
+    return array("b", map(levels_by_size.__getitem__, font_sizes))
 
-def format_text_element(text, font_size, font_flags, title_threshold, subtitle_threshold, avg_font_size):
+def format_classified_text(text, heading_level, font_flags):
     """
-    根据字体信息格式化文本元素
+    按已确定的标题级别和字体标志格式化文本
+    
+    参数:
+        text (str): 文本
+        heading_level (int): 标题级别，0 表示正文
+        font_flags (int): 字体标志
     """
     # 清理文本
     text = re.sub(r'\s+', ' ', text.strip())
     
-    # 检测标题
-    if font_size >= title_threshold:
-        if font_size >= title_threshold * 1.3:
-            return f"# {text}"
-        elif font_size >= title_threshold * 1.1:
-            return f"## {text}"
-        else:
-            return f"### {text}"
-    elif font_size >= subtitle_threshold:
-        return f"#### {text}"
+    # 标题
+    if heading_level:
+        return f"{'#' * heading_level} {text}"
     
     # 检测粗体 (font_flags & 16 表示粗体)
     if font_flags & 16:
@@ -324,42 +1582,17 @@ def format_text_element(text, font_size, font_flags, title_threshold, subtitle_t
     
     return text
 
-def post_process_markdown(lines):
-    """
-    后处理Markdown文本，优化格式
-    """
-    processed = []
-    
-    for i, line in enumerate(lines):
-        if not line.strip():
-            continue
-        
-        # 处理列表项
-        if re.match(r'^[\d]+\.', line) or line.startswith('- '):
-            # 确保列表项前后有适当的空行
-            if processed and not processed[-1].startswith(('- ', '1.', '2.', '3.', '4.', '5.', '6.', '7.', '8.', '9.', '0.')):
-                if not processed[-1].startswith('#'):
-                    processed.append('')  # 在列表前添加空行
-            processed.append(line)
-        else:
-            processed.append(line)
-    
-    # 移除多余的空行
-    final_lines = []
-    for i, line in enumerate(processed):
-        if line == '' and i > 0 and processed[i-1] == '':
-            continue  # 跳过连续的空行
-        final_lines.append(line)
-    
-    return final_lines
-
-def pdf_to_word(pdf_path, output_path=None):
+def pdf_to_word(pdf_path, output_path=None, workers=None, pdf_data=None, pages=None, page_cache=None):
     """
     将PDF文件转换为Word文档
     
     参数:
         pdf_path (str): PDF文件的路径
         output_path (str): 输出Word文档的路径，如果为None则自动生成
+        workers (int): 并行提取的进程数，None 时使用 MARKDOWN_WORKERS
+        pdf_data: PDF内容缓冲区，给出时不读取 pdf_path（见 open_pdf）
+        pages (str): 页面选择表达式，如 "1-10,25,40-"，None 表示全部页面
+        page_cache (ConversionCache): 页级提取结果缓存（见 build_document）
         
     返回:
         dict: 包含转换结果和文件路径的字典
@@ -373,11 +1606,9 @@ def pdf_to_word(pdf_path, output_path=None):
     
     doc = None
     try:
-        # 验证文件路径
-        print(f"尝试打开PDF文件: {pdf_path}")
-        print(f"文件是否存在: {os.path.exists(pdf_path)}")
+        log_open_request(pdf_path, pdf_data)
         
-        if not os.path.exists(pdf_path):
+        if pdf_data is None and not os.path.exists(pdf_path):
             return {
                 "status": "error",
                 "message": f"文件不存在: {pdf_path}",
@@ -385,7 +1616,7 @@ def pdf_to_word(pdf_path, output_path=None):
             }
         
         # 打开PDF文件
-        doc = fitz.open(pdf_path)
+        doc = open_pdf(pdf_path, pdf_data)
         
         if doc.page_count == 0:
             return {
@@ -394,106 +1625,26 @@ def pdf_to_word(pdf_path, output_path=None):
                 "word_path": None
             }
         
-        # 创建Word文档
-        word_doc = Document()
-        
-        # 设置文档标题
         base_filename = os.path.splitext(os.path.basename(pdf_path))[0]
-        title = word_doc.add_heading(f'{base_filename}', 0)
-        title.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        
-        # 创建图片存储目录
-        images_dir = os.path.join(os.path.dirname(pdf_path), f"{base_filename}_images")
-        if not os.path.exists(images_dir):
-            os.makedirs(images_dir)
         
-        # 提取文本块和格式信息
-        text_elements = []
-        extracted_images = []
-        
-        for page_num in range(doc.page_count):
-            page = doc[page_num]
-            
-            # 添加页面分隔
-            if page_num > 0:
-                word_doc.add_page_break()
-            
-            # 添加页面标题
-            page_heading = word_doc.add_heading(f'第 {page_num + 1} 页', level=1)
-            page_heading.alignment = WD_ALIGN_PARAGRAPH.LEFT
-            
-            # 提取图片
-            page_images = extract_images_from_page(page, page_num, images_dir, base_filename)
-            extracted_images.extend(page_images)
-            
-            # 获取文本字典，包含格式信息
-            text_dict = page.get_text("dict")
-            
-            # 处理每个文本块
-            page_text_elements = []
-            for block in text_dict["blocks"]:
-                if "lines" in block:  # 文本块
-                    for line in block["lines"]:
-                        for span in line["spans"]:
-                            cleaned_text = clean_text_for_xml(span["text"])
-                            if cleaned_text.strip():
-                                page_text_elements.append({
-                                    "text": cleaned_text,
-                                    "font_size": span["size"],
-                                    "font_flags": span["flags"],
-                                    "bbox": span["bbox"],
-                                    "page": page_num + 1
-                                })
-            
-            # 将文本添加到Word文档
-            add_text_to_word_doc(word_doc, page_text_elements)
-            
-            # 添加该页面的图片
-            for img in page_images:
-                try:
-                    # 添加图片到Word文档
-                    img_paragraph = word_doc.add_paragraph()
-                    img_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                    
-                    # 检查图片文件是否存在
-                    if os.path.exists(img['path']):
-                        run = img_paragraph.add_run()
-                        # 设置图片大小，最大宽度为6英寸
-                        max_width = Inches(6)
-                        run.add_picture(img['path'], width=max_width)
-                        
-                        # 添加图片说明
-                        caption = word_doc.add_paragraph(f"图片 {img['index']} ({img['width']}x{img['height']})")
-                        caption.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                        caption_run = caption.runs[0]
-                        caption_run.font.size = Pt(9)
-                        caption_run.font.italic = True
-                        
-                except Exception as e:
-                    print(f"添加图片到Word文档时出错: {str(e)}")
-                    # 如果图片添加失败，添加文本说明
-                    img_text = word_doc.add_paragraph(f"[图片: {img['filename']}]")
-                    img_text.alignment = WD_ALIGN_PARAGRAPH.CENTER
+        # 提取文本块、格式信息和图片，构建文档中间表示；
+        # 图片按Word中的显示尺寸缩小后直接保存在内存中，不写入图片目录
+        page_numbers = select_pages(pages, doc.page_count)
+        document = build_document(doc, pdf_path, None, workers, pdf_data=pdf_data,
+                                  page_numbers=page_numbers,
+                                  image_max_width=WORD_IMAGE_WIDTH_INCHES * WORD_IMAGE_DPI,
+                                  page_cache=page_cache)
         
         # 生成输出路径
         if output_path is None:
             output_path = os.path.join(os.path.dirname(pdf_path), f"{base_filename}.docx")
         
-        # 保存Word文档
-        word_doc.save(output_path)
-        
-        return {
-            "status": "success",
-            "message": "PDF成功转换为Word文档",
-            "word_path": output_path,
-            "images_count": len(extracted_images),
-            "pages_count": doc.page_count if doc else 0
-        }
+        return document_to_word(document, output_path)
     
     except Exception as e:
         # 记录错误并返回错误消息
         error_msg = f"转换过程中出错: {str(e)}"
-        print(error_msg)
+        logger.exception(error_msg)
         return {
             "status": "error",
             "message": error_msg,
@@ -504,9 +1655,104 @@ def pdf_to_word(pdf_path, output_path=None):
         # 确保PDF文档总是被关闭
         if doc is not None:
             try:
-                doc.close()
-            except:
-                pass  # 忽略关闭时的错误
+                doc.close()
+            except:
+                pass  # 忽略关闭时的错误
+
+def document_to_word(document, output_path):
+    """
+    由文档中间表示生成Word文档
+    
+    参数:
+        document (dict): build_document 返回的中间表示
+        output_path (str): 输出Word文档的路径
+        
+    返回:
+        dict: 包含转换结果和文件路径的字典
+    """
+    from docx import Document
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.shared import Inches
+    
+    assembly_start = time.perf_counter()
+    
+    # 按页面组织文本元素和图片
+    spans = document["text_elements"]
+    span_ranges = spans.page_ranges()
+    
+    images_by_page = {}
+    for img in document["images"]:
+        images_by_page.setdefault(img["page"], []).append(img)
+    
+    # 创建Word文档和共用的样式
+    word_doc = Document()
+    styles = create_word_styles(word_doc, body_font_size(spans))
+    max_image_width = WORD_IMAGE_WIDTH_INCHES * WORD_IMAGE_DPI
+    image_data_cache = {}  # 图片路径 -> 嵌入用的图片数据，同一图片在多个页面出现时只读取一次
+    
+    # 设置文档标题
+    title = word_doc.add_heading(f'{document["base_filename"]}', 0)
+    title.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    
+    for position, page_info in enumerate(document["pages"]):
+        page_num = page_info["page"] - 1
+        
+        # 添加页面分隔
+        if position > 0:
+            word_doc.add_page_break()
+        
+        # 添加页面标题
+        page_heading = word_doc.add_heading(f'第 {page_num + 1} 页', level=1)
+        page_heading.alignment = WD_ALIGN_PARAGRAPH.LEFT
+        
+        # 将文本添加到Word文档（直接读取当前页的列，跳过清理后为空的文本）
+        start, end = span_ranges.get(page_num + 1, (0, 0))
+        page_texts = [(i, clean_text_for_xml(spans.text(i)).strip()) for i in range(start, end)]
+        add_text_to_word_doc(word_doc, spans, styles, [(i, text) for i, text in page_texts if text])
+        
+        # 添加该页面的图片
+        for img in images_by_page.get(page_num + 1, []):
+            try:
+                # 添加图片到Word文档
+                img_paragraph = word_doc.add_paragraph(style=styles["image"])
+                
+                # 图片已在内存中（只生成Word时），否则从磁盘读取并按需缩小
+                image_data = img.get("data")
+                if image_data is None and img['path'] and os.path.exists(img['path']):
+                    image_data = image_data_cache.get(img['path'])
+                    if image_data is None:
+                        image_data = prepare_word_image(img, max_image_width)
+                        image_data_cache[img['path']] = image_data
+                
+                if image_data is not None:
+                    run = img_paragraph.add_run()
+                    # 设置图片大小，最大宽度为6英寸
+                    run.add_picture(io.BytesIO(image_data), width=Inches(WORD_IMAGE_WIDTH_INCHES))
+                    
+                    # 添加图片说明
+                    word_doc.add_paragraph(f"图片 {img['index']} ({img['width']}x{img['height']})",
+                                           style=styles["caption"])
+                    
+            except Exception as e:
+                logger.warning("添加图片到Word文档时出错", extra={"image": img['filename'], "error": str(e)})
+                # 如果图片添加失败，添加文本说明
+                word_doc.add_paragraph(f"[图片: {img['filename']}]", style=styles["image"])
+    
+    record_stage("docx_assembly", time.perf_counter() - assembly_start)
+    
+    # 保存Word文档
+    with stage_timer("docx_save"):
+        word_doc.save(output_path)
+    
+    return {
+        "status": "success",
+        "message": "PDF成功转换为Word文档",
+        "word_path": output_path,
+        "images_count": len(document["images"]),
+        "deduplicated_images": count_deduplicated_images(document["images"]),
+        "pages_count": document["page_count"],
+        **page_cache_counts(document.get("page_cache"))
+    }
 
 def clean_text_for_xml(text):
     """
@@ -533,90 +1779,220 @@ def clean_text_for_xml(text):
     
     return cleaned
 
-def add_text_to_word_doc(word_doc, text_elements):
+def word_font_size(font_size):
+    """PDF字号对应的Word字号：限制在9-16磅之间，并取整到Word支持的半磅"""
+    return round(max(9, min(font_size, 16)) * 2) / 2
+
+def get_or_add_word_style(word_doc, name, style_type):
+    """
+    获取Word文档中的样式，不存在时新建
+    
+    返回:
+        tuple: (样式, 是否新建)
+    """
+    try:
+        return word_doc.styles[name], False
+    except KeyError:
+        return word_doc.styles.add_style(name, style_type), True
+
+def body_font_size(text_elements):
+    """
+    正文字号：出现最多的Word字号，作为Normal样式的字号
+    
+    参数:
+        text_elements (SpanTable): 文本元素表
+        
+    返回:
+        float: Word字号（磅），没有文本时返回None
+    """
+    counts = Counter(word_font_size(size) for size in text_elements.sizes)
+    if not counts:
+        return None
+    return counts.most_common(1)[0][0]
+
+def create_word_styles(word_doc, body_size=None):
+    """
+    创建文档共用的段落样式，正文、图片和图片说明的格式只在样式中定义一次，
+    不再逐个run设置字体属性
+    
+    正文字号直接设置在Normal样式上，正文段落和与正文字号相同的run不需要任何格式属性。
+    
+    参数:
+        word_doc: Word文档对象
+        body_size (float): 正文字号（磅，见 body_font_size）；None 时不修改Normal样式
+        
+    返回:
+        dict: {"doc", "body", "image", "caption", "body_size", "runs": 字符样式缓存}
+    """
+    from docx.enum.style import WD_STYLE_TYPE
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    from docx.shared import Pt
+    
+    body = word_doc.styles["Normal"]
+    if body_size is not None:
+        body.font.size = Pt(body_size)
+    
+    image, created = get_or_add_word_style(word_doc, "PDF Image", WD_STYLE_TYPE.PARAGRAPH)
+    if created:
+        image.base_style = body
+        image.paragraph_format.alignment = WD_ALIGN_PARAGRAPH.CENTER
+    
+    caption, created = get_or_add_word_style(word_doc, "PDF Caption", WD_STYLE_TYPE.PARAGRAPH)
+    if created:
+        caption.base_style = image
+        caption.font.size = Pt(9)
+        caption.font.italic = True
+    
+    return {
+        "doc": word_doc,
+        "body": body,
+        "image": image,
+        "caption": caption,
+        "body_size": body.font.size.pt if body.font.size is not None else None,
+        "runs": {}
+    }
+
+def word_run_style(styles, font_size, bold, italic):
+    """
+    返回正文run使用的字符样式，相同字号和字形的run共用一个样式
+    
+    参数:
+        styles (dict): create_word_styles 返回的共用样式
+        font_size (float): Word字号（磅）
+        bold (bool): 是否粗体
+        italic (bool): 是否斜体
+        
+    返回:
+        字符样式，与正文段落样式完全相同时返回None
+    """
+    if font_size == styles["body_size"] and not bold and not italic:
+        return None
+    
+    key = (font_size, bold, italic)
+    style = styles["runs"].get(key)
+    if style is None:
+        from docx.enum.style import WD_STYLE_TYPE
+        from docx.shared import Pt
+        
+        name = f"PDF Text {font_size:g}pt" + (" Bold" if bold else "") + (" Italic" if italic else "")
+        style, created = get_or_add_word_style(styles["doc"], name, WD_STYLE_TYPE.CHARACTER)
+        if created:
+            style.font.size = Pt(font_size)
+            if bold:
+                style.font.bold = True
+            if italic:
+                style.font.italic = True
+        styles["runs"][key] = style
+    return style
+
+def prepare_word_image(img, max_width):
+    """
+    读取要嵌入Word文档的图片数据，宽度超过显示所需的像素数时先缩小
+    
+    参数:
+        img (dict): 提取的图片信息（包含 path、width、height）
+        max_width (int): 显示宽度对应的像素数
+        
+    返回:
+        bytes: 图片数据（JPEG图片缩小后仍为JPEG，其余为PNG）
+    """
+    if not img.get("width") or img["width"] <= max_width:
+        with open(img["path"], "rb") as f:
+            return f.read()
+    
+    pix = fitz.Pixmap(img["path"])
+    height = max(1, round(pix.height * max_width / pix.width))
+    scaled = fitz.Pixmap(pix, max_width, height, None)
+    
+    if img["path"].lower().endswith((".jpg", ".jpeg")):
+        return encode_pixmap(scaled, "jpeg", WORD_JPEG_QUALITY)
+    return encode_pixmap(scaled, "png", None)
+
+def add_text_to_word_doc(word_doc, text_elements, styles=None, page_texts=None):
     """
     将文本元素添加到Word文档中，保持格式
     
     参数:
         word_doc: Word文档对象
-        text_elements: 文本元素列表
+        text_elements (SpanTable): 文本元素表（也接受旧的字典列表）
+        styles (dict): create_word_styles 返回的共用样式，None 时自动创建
+        page_texts (list): 要添加的片段 [(索引, 清理后的文本), ...]，标题级别按这些片段的字号判定；
+            None 时添加 text_elements 中的全部片段
     """
     if not text_elements:
         return
     
-    # 分析字体大小，确定标题级别
-    font_sizes = [elem["font_size"] for elem in text_elements]
-    avg_font_size = sum(font_sizes) / len(font_sizes)
-    max_font_size = max(font_sizes)
+    if not isinstance(text_elements, SpanTable):
+        text_elements = SpanTable.from_elements(text_elements)
     
-    # 定义标题阈值
-    title_threshold = avg_font_size * 1.2
-    subtitle_threshold = avg_font_size * 1.1
+    if page_texts is None:
+        page_texts = [(i, clean_text_for_xml(text_elements.text(i)).strip()) for i in range(len(text_elements))]
+    if not page_texts:
+        return
+    
+    if styles is None:
+        styles = create_word_styles(word_doc)
+    
+    # 对该页字号一次性判定标题级别
+    sizes_column = text_elements.sizes
+    font_flags_column = text_elements.flags
+    bboxes = text_elements.bboxes
+    heading_levels = classify_word_heading_levels([sizes_column[i] for i, _ in page_texts])
     
     current_paragraph = None
     
-    for i, elem in enumerate(text_elements):
-        text = clean_text_for_xml(elem["text"]).strip()
-        font_size = elem["font_size"]
-        font_flags = elem["font_flags"]
+    for position, (i, text) in enumerate(page_texts):
+        font_size = sizes_column[i]
+        font_flags = font_flags_column[i]
         
         if not text:
             continue
         
-        # 判断是否为标题
-        if font_size >= title_threshold and font_size == max_font_size:
-            # 主标题
-            heading = word_doc.add_heading(text, level=2)
-            current_paragraph = None
-        elif font_size >= subtitle_threshold:
-            # 副标题
-            heading = word_doc.add_heading(text, level=3)
+        # 标题
+        if heading_levels[position]:
+            word_doc.add_heading(text, level=heading_levels[position])
             current_paragraph = None
         else:
             # 普通文本
             if current_paragraph is None:
-                current_paragraph = word_doc.add_paragraph()
-            
-            run = current_paragraph.add_run(text)
-            
-            # 设置字体格式
-            if font_flags & 16:  # 粗体
-                run.font.bold = True
-            if font_flags & 2:   # 斜体
-                run.font.italic = True
+                current_paragraph = word_doc.add_paragraph(style=styles["body"])
             
-            # 设置字体大小
-            run.font.size = Pt(max(9, min(font_size, 16)))
+            # 字号和粗体（16）、斜体（2）通过共用的字符样式设置，与正文样式相同时不加样式
+            run_style = word_run_style(styles, word_font_size(font_size), bool(font_flags & 16), bool(font_flags & 2))
+            current_paragraph.add_run(text, style=run_style)
             
             # 检查是否需要换行
-            next_elem = text_elements[i + 1] if i + 1 < len(text_elements) else None
-            if next_elem:
+            if position + 1 < len(page_texts):
                 # 如果下一个元素的Y坐标差异较大，说明需要换行
-                current_y = elem["bbox"][1]
-                next_y = next_elem["bbox"][1]
+                current_y = bboxes[4 * i + 1]
+                next_y = bboxes[4 * page_texts[position + 1][0] + 1]
                 if abs(next_y - current_y) > font_size * 0.5:
                     current_paragraph = None
             else:
                 current_paragraph = None
 
-def pdf_to_cropped_images(pdf_path, output_dir=None):
+def pdf_to_cropped_images(pdf_path, output_dir=None, pdf_data=None, pages=None, render_options=None,
+                          workers=None, rasters=None):
     """
     将PDF文件的每一页裁剪为3:4比例的图片并打包为ZIP文件
     
     参数:
         pdf_path (str): PDF文件的路径
         output_dir (str): 输出目录，如果为None则使用PDF文件所在目录
+        pdf_data: PDF内容缓冲区，给出时不读取 pdf_path（见 open_pdf）
+        pages (str): 页面选择表达式，如 "1-10,25,40-"，None 表示全部页面
+        render_options (dict): 渲染参数（dpi、width、height、format、quality，见 normalize_render_options）
+        workers (int): 并行渲染的进程数，None 时使用 MARKDOWN_WORKERS
+        rasters (RasterCache): 该文档的渲染结果缓存（见 render_cropped_page）
         
     返回:
         dict: 包含转换结果和ZIP文件路径的字典
     """
     doc = None
     try:
-        # 验证文件路径
-        print(f"尝试打开PDF文件进行裁剪: {pdf_path}")
-        print(f"文件是否存在: {os.path.exists(pdf_path)}")
+        log_open_request(pdf_path, pdf_data)
         
-        if not os.path.exists(pdf_path):
+        if pdf_data is None and not os.path.exists(pdf_path):
             return {
                 "status": "error",
                 "message": f"文件不存在: {pdf_path}",
@@ -624,7 +2000,7 @@ def pdf_to_cropped_images(pdf_path, output_dir=None):
             }
         
         # 打开PDF文件
-        doc = fitz.open(pdf_path)
+        doc = open_pdf(pdf_path, pdf_data)
         
         if doc.page_count == 0:
             return {
@@ -638,105 +2014,499 @@ def pdf_to_cropped_images(pdf_path, output_dir=None):
         if output_dir is None:
             output_dir = os.path.dirname(pdf_path)
         
-        # 创建临时目录存储图片
-        temp_dir = os.path.join(output_dir, f"{base_filename}_cropped_images")
-        os.makedirs(temp_dir, exist_ok=True)
+        page_numbers = select_pages(pages, doc.page_count)
+        return render_cropped_pages(doc, page_geometry(doc, page_numbers), base_filename, output_dir,
+                                    render_options=render_options, workers=workers,
+                                    pdf_path=pdf_path, pdf_data=pdf_data, rasters=rasters)
+    
+    except Exception as e:
+        # 记录错误并返回错误消息
+        error_msg = f"裁剪过程中出错: {str(e)}"
+        logger.exception(error_msg)
+        return {
+            "status": "error",
+            "message": error_msg,
+            "zip_path": None
+        }
+    
+    finally:
+        # 确保PDF文档总是被关闭
+        if doc is not None:
+            try:
+                doc.close()
+            except:
+                pass  # 忽略关闭时的错误
+
+def crop_rect_for_page(page_width, page_height, target_ratio=3.0 / 4.0):
+    """
+    计算页面居中的3:4（宽:高）裁剪区域
+    
+    返回:
+        fitz.Rect: 裁剪区域（PDF坐标）
+    """
+    current_ratio = page_width / page_height
+    
+    if current_ratio > target_ratio:
+        # 页面太宽，需要裁剪宽度
+        new_width = page_height * target_ratio
+        x_offset = (page_width - new_width) / 2
+        return fitz.Rect(x_offset, 0, x_offset + new_width, page_height)
+    
+    # 页面太高，需要裁剪高度
+    new_height = page_width / target_ratio
+    y_offset = (page_height - new_height) / 2
+    return fitz.Rect(0, y_offset, page_width, y_offset + new_height)
+
+def normalize_render_options(render_options=None):
+    """
+    补全裁剪图片的渲染参数
+    
+    参数:
+        render_options (dict): 可包含 dpi、width、height（目标像素尺寸，给出时忽略dpi）、
+            format（png、jpeg、webp）和 quality（1-100，仅jpeg和webp使用）
         
-        # 生成ZIP文件路径
-        zip_path = os.path.join(output_dir, f"{base_filename}_cropped_images.zip")
+    返回:
+        dict: 完整的渲染参数
+    """
+    options = dict(CROP_RENDER_DEFAULTS)
+    if render_options:
+        options.update({key: value for key, value in render_options.items() if value is not None})
+    if options["format"] not in CROP_IMAGE_FORMATS:
+        raise ValueError(f"不支持的图片格式: {options['format']}")
+    return options
+
+def crop_pixel_size(crop_rect, options, target_ratio=3.0 / 4.0):
+    """
+    计算裁剪区域输出图片的像素尺寸，宽高比严格为 target_ratio
+    
+    给出 width/height 时输出不超过该尺寸的最大图片，否则按 dpi 换算。
+    
+    返回:
+        tuple: (宽, 高)
+    """
+    width, height = options.get("width"), options.get("height")
+    if width or height:
+        if width and (not height or width / target_ratio <= height):
+            return width, max(1, round(width / target_ratio))
+        return max(1, int(height * target_ratio)), height
+    
+    zoom = options["dpi"] / 72.0
+    pixel_height = (crop_rect * fitz.Matrix(zoom, zoom)).irect.height
+    return max(1, int(pixel_height * target_ratio)), pixel_height
+
+def encode_pixmap(pix, image_format, quality):
+    """
+    将渲染结果直接编码为目标格式（只编码一次，不经过PNG中转）
+    
+    返回:
+        bytes: 编码后的图片数据
+    """
+    if image_format == "png":
+        return pix.tobytes("png")
+    if image_format == "jpeg":
+        try:
+            return pix.tobytes("jpeg", jpg_quality=quality)
+        except (TypeError, ValueError):
+            # 旧版PyMuPDF不支持直接输出JPEG
+            return pix.pil_tobytes(format="JPEG", quality=quality)
+    # MuPDF没有WebP编码器，由Pillow直接编码像素数据
+    return pix.pil_tobytes(format="WEBP", quality=quality)
+
+@stage_timer("page_render")
+def render_region(page, clip, pixel_size, image_format, quality):
+    """
+    把页面的一个区域渲染为指定像素尺寸的图片并编码
+    
+    变换矩阵把区域精确映射到 (0, 0, 宽, 高) 的像素区域，
+    渲染结果即为最终尺寸，不需要再次裁剪。
+    
+    参数:
+        page: PDF页面对象
+        clip (fitz.Rect): 渲染区域（PDF坐标）
+        pixel_size (tuple): 输出图片的像素尺寸 (宽, 高)
+        image_format (str): png、jpeg 或 webp
+        quality (int): JPEG/WebP 质量
         
-        # 处理每一页
-        cropped_images = []
-        for page_num in range(doc.page_count):
-            page = doc[page_num]
-            
-            # 获取页面尺寸
-            page_rect = page.rect
-            page_width = page_rect.width
-            page_height = page_rect.height
-            
-            # 计算3:4比例的裁剪区域
-            target_ratio = 3.0 / 4.0  # 宽:高 = 3:4
-            current_ratio = page_width / page_height
-            
-            if current_ratio > target_ratio:
-                # 页面太宽，需要裁剪宽度
-                new_width = page_height * target_ratio
-                x_offset = (page_width - new_width) / 2
-                crop_rect = fitz.Rect(x_offset, 0, x_offset + new_width, page_height)
-            else:
-                # 页面太高，需要裁剪高度
-                new_height = page_width / target_ratio
-                y_offset = (page_height - new_height) / 2
-                crop_rect = fitz.Rect(0, y_offset, page_width, y_offset + new_height)
-            
-            # 设置渲染参数，提高图片质量
-            mat = fitz.Matrix(2.0, 2.0)  # 2倍缩放提高清晰度
-            
-            # 渲染裁剪后的页面为图片
-            pix = page.get_pixmap(matrix=mat, clip=crop_rect)
-            
-            # 转换为PIL Image
-            img_data = pix.tobytes("png")
-            img = Image.open(io.BytesIO(img_data))
-            
-            # 确保图片比例为3:4
-            img_width, img_height = img.size
-            target_width = int(img_height * target_ratio)
-            if img_width != target_width:
-                # 微调宽度以确保精确的3:4比例
-                left = (img_width - target_width) // 2
-                right = left + target_width
-                img = img.crop((left, 0, right, img_height))
-            
-            # 保存图片
-            img_filename = f"page_{page_num + 1:03d}.png"
-            img_path = os.path.join(temp_dir, img_filename)
-            img.save(img_path, "PNG", quality=95)
+    返回:
+        tuple: (图片数据, (宽, 高))
+    """
+    pixel_width, pixel_height = pixel_size
+    scale_x = pixel_width / clip.width
+    scale_y = pixel_height / clip.height
+    matrix = fitz.Matrix(scale_x, 0, 0, scale_y, -clip.x0 * scale_x, -clip.y0 * scale_y)
+    
+    pix = page.get_pixmap(matrix=matrix, clip=clip, alpha=False)
+    return encode_pixmap(pix, image_format, quality), (pix.width, pix.height)
+
+def render_region_cached(page, clip, pixel_size, image_format, quality, rasters=None):
+    """
+    同 render_region，给出 rasters 时先查找渲染结果缓存，未命中时渲染并写入缓存
+    
+    参数:
+        rasters (RasterCache): 该文档的渲染结果缓存
+        其余参数同 render_region
+        
+    返回:
+        tuple: (图片数据, (宽, 高), 是否命中缓存)
+    """
+    page_number = page.number + 1
+    if rasters is not None:
+        data = rasters.get(page_number, clip, pixel_size, image_format, quality)
+        if data is not None:
+            return data, tuple(pixel_size), True
+    
+    data, size = render_region(page, clip, pixel_size, image_format, quality)
+    if rasters is not None:
+        rasters.put(page_number, clip, pixel_size, image_format, quality, data)
+    return data, size, False
+
+def render_page_preview(pdf_path, page_number, scale=1.0, clip=None, crop=False, image_format="png",
+                        quality=CROP_RENDER_DEFAULTS["quality"], pdf_data=None, rasters=None):
+    """
+    按指定缩放比例渲染单个页面（或页面上的一个区域）的预览图片
+    
+    crop 为 True 时渲染与裁剪图片导出相同的3:4区域，缩放比例 scale 对应导出的 dpi = scale × 72，
+    两者的渲染结果在 rasters 中共用：先预览再导出（或反之）时不会重复渲染。
+    
+    参数:
+        pdf_path (str): PDF文件的路径
+        page_number (int): 页码（从1开始）
+        scale (float): 缩放比例，1 表示 72 DPI
+        clip (tuple): 渲染区域 (x0, y0, x1, y1)（PDF坐标），None 表示整页；crop 为 True 时忽略
+        crop (bool): 渲染裁剪图片导出的3:4区域
+        image_format (str): png、jpeg 或 webp
+        quality (int): JPEG/WebP 质量
+        pdf_data: PDF内容缓冲区，给出时不读取 pdf_path（见 open_pdf）
+        rasters (RasterCache): 该文档的渲染结果缓存
+        
+    返回:
+        dict: {"status", "message", "data", "size", "format", "cached"}，
+            cached 表示图片来自渲染结果缓存
+        
+    异常:
+        ValueError: 参数无效（页码超出范围、区域不在页面内、输出图片过大等）
+    """
+    if image_format not in CROP_IMAGE_FORMATS:
+        raise ValueError(f"不支持的图片格式: {image_format}")
+    if not scale > 0:
+        raise ValueError("缩放比例必须大于0")
+    
+    log_open_request(pdf_path, pdf_data)
+    if pdf_data is None and not os.path.exists(pdf_path):
+        return {
+            "status": "error",
+            "message": f"文件不存在: {pdf_path}"
+        }
+    
+    doc = open_pdf(pdf_path, pdf_data)
+    try:
+        if not 1 <= page_number <= doc.page_count:
+            raise ValueError(f"页码超出文档范围（共{doc.page_count}页）")
+        page = doc[page_number - 1]
+        
+        if crop:
+            region = crop_rect_for_page(page.rect.width, page.rect.height)
+            pixel_size = crop_pixel_size(region, {"dpi": scale * 72})
+        else:
+            region = page.rect if clip is None else fitz.Rect(clip) & page.rect
+            if region.is_empty:
+                raise ValueError("预览区域不在页面内")
+            pixel_rect = (region * fitz.Matrix(scale, scale)).irect
+            pixel_size = (max(1, pixel_rect.width), max(1, pixel_rect.height))
+        
+        if pixel_size[0] * pixel_size[1] > PREVIEW_MAX_PIXELS:
+            raise ValueError(f"预览图片过大（{pixel_size[0]}×{pixel_size[1]}像素），请减小缩放比例或渲染区域")
+        
+        data, size, cached = render_region_cached(page, region, pixel_size, image_format, quality, rasters)
+        return {
+            "status": "success",
+            "message": "页面渲染完成",
+            "data": data,
+            "size": size,
+            "format": image_format,
+            "cached": cached
+        }
+    
+    finally:
+        doc.close()
+
+def render_cropped_page(page, page_info, options, target_ratio=3.0 / 4.0, rasters=None):
+    """
+    渲染单个页面居中的3:4区域并编码
+    
+    参数:
+        page: PDF页面对象
+        page_info (dict): 页面尺寸 {"page", "width", "height"}
+        options (dict): normalize_render_options 返回的渲染参数
+        rasters (RasterCache): 该文档的渲染结果缓存，已渲染过（如预览过）的页面直接复用
+        
+    返回:
+        tuple: (图片数据, (宽, 高))
+    """
+    crop_rect = crop_rect_for_page(page_info["width"], page_info["height"], target_ratio)
+    pixel_size = crop_pixel_size(crop_rect, options, target_ratio)
+    data, size, _ = render_region_cached(page, crop_rect, pixel_size, options["format"], options["quality"],
+                                         rasters)
+    return data, size
+
+def _render_pages_worker(pdf_path, page_infos, options, pdf_data=None, rasters=None):
+    """
+    进程池中执行的任务：独立打开PDF并渲染一组页面
+    
+    返回:
+        tuple: ([(页码, 图片数据, (宽, 高)), ...], 阶段耗时列表)
+    """
+    with collect_stage_timings() as timings:
+        doc = open_pdf(pdf_path, pdf_data)
+        try:
+            results = []
+            memory_guard = PageMemoryGuard()
+            for page_info in page_infos:
+                page = doc[page_info["page"] - 1]
+                memory_guard.add_page_images(page)
+                data, size = render_cropped_page(page, page_info, options, rasters=rasters)
+                results.append((page_info["page"], data, size))
+                memory_guard.page_done()
+        finally:
+            doc.close()
+    return results, timings
+
+def iter_cropped_pages(doc, pages, options, workers=None, pdf_path=None, pdf_data=None, rasters=None):
+    """
+    按页码顺序逐页产出渲染好的裁剪图片，页数较多时在进程池中并行渲染
+    
+    参数:
+        doc: 已打开的PDF文档对象（串行渲染时使用）
+        pages (list): 要渲染的页面尺寸列表
+        options (dict): normalize_render_options 返回的渲染参数
+        workers (int): 并行渲染的进程数，None 时使用 MARKDOWN_WORKERS，1 表示串行
+        pdf_path (str): PDF文件的路径，并行模式下各进程据此重新打开
+        pdf_data: PDF内容缓冲区，给出时并行模式下各进程从其副本打开
+        rasters (RasterCache): 该文档的渲染结果缓存（见 render_cropped_page）
+        
+    返回:
+        generator: 依次产出 (页码, 图片数据, (宽, 高))
+    """
+    if workers is None:
+        workers = MARKDOWN_WORKERS
+    workers = max(1, min(workers, len(pages)))
+    can_reopen = pdf_data is not None or (pdf_path is not None and os.path.exists(pdf_path))
+    
+    if workers == 1 or len(pages) < PARALLEL_MIN_PAGES or not can_reopen:
+        memory_guard = PageMemoryGuard()
+        for page_info in pages:
+            page = doc[page_info["page"] - 1]
+            memory_guard.add_page_images(page)
+            data, size = render_cropped_page(page, page_info, options, rasters=rasters)
+            memory_guard.page_done()
+            yield page_info["page"], data, size
+        return
+    
+    # memoryview（如内存映射的上传文件）不能pickle，转为bytes后传给工作进程
+    if pdf_data is not None and not isinstance(pdf_data, bytes):
+        pdf_data = bytes(pdf_data)
+    
+    # 按小批次提交，先完成的批次可以先输出，不必等整段页面渲染完
+    batches = [pages[i:i + CROP_RENDER_BATCH_PAGES] for i in range(0, len(pages), CROP_RENDER_BATCH_PAGES)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(_render_pages_worker, pdf_path, batch, options, pdf_data, rasters)
+            for batch in batches
+        ]
+        # 按提交顺序（即页码顺序）收集结果
+        for future in futures:
+            results, timings = future.result()
+            replay_stage_timings(timings)
+            for result in results:
+                yield result
+
+def iter_cropped_images(pdf_path, pdf_data=None, pages=None, render_options=None, workers=None, rasters=None):
+    """
+    逐页渲染裁剪图片的生成器，每渲染完一页立即产出，不写任何中间文件
+    
+    参数:
+        pdf_path (str): PDF文件的路径
+        pdf_data: PDF内容缓冲区，给出时不读取 pdf_path（见 open_pdf）
+        pages (str): 页面选择表达式，如 "1-10,25,40-"，None 表示全部页面
+        render_options (dict): 渲染参数（见 normalize_render_options）
+        workers (int): 并行渲染的进程数，None 时使用 MARKDOWN_WORKERS
+        rasters (RasterCache): 该文档的渲染结果缓存（见 render_cropped_page）
+        
+    返回:
+        generator: 依次产出 {"page", "filename", "data", "size"}
+        
+    异常:
+        ValueError: 渲染参数或页面选择无效
+    """
+    options = normalize_render_options(render_options)
+    extension = CROP_IMAGE_FORMATS[options["format"]]
+    
+    doc = open_pdf(pdf_path, pdf_data)
+    try:
+        geometry = page_geometry(doc, select_pages(pages, doc.page_count))
+        for page_number, data, size in iter_cropped_pages(doc, geometry, options, workers, pdf_path, pdf_data,
+                                                          rasters):
+            logger.debug("已渲染页面", extra={"page": page_number, "size": size})
+            yield {
+                "page": page_number,
+                "filename": f"page_{page_number:03d}{extension}",
+                "data": data,
+                "size": size
+            }
+    finally:
+        doc.close()
+
+def render_cropped_pages(doc, pages, base_filename, output_dir, progress_callback=None,
+                         render_options=None, workers=None, pdf_path=None, pdf_data=None, rasters=None):
+    """
+    将页面渲染为3:4比例的图片并打包为ZIP文件
+    
+    参数:
+        doc: 已打开的PDF文档对象
+        pages (list): 要渲染的页面尺寸列表（page_geometry 或文档中间表示中的 pages）
+        base_filename (str): 基础文件名
+        output_dir (str): 输出目录
+        progress_callback: 进度回调，每渲染完一页调用 callback("render", 页码, 总页数)
+        render_options (dict): 渲染参数（见 normalize_render_options）
+        workers (int): 并行渲染的进程数，None 时使用 MARKDOWN_WORKERS
+        pdf_path (str): PDF文件的路径，并行模式下各进程据此重新打开
+        pdf_data: PDF内容缓冲区，给出时并行模式下各进程从其副本打开
+        rasters (RasterCache): 该文档的渲染结果缓存（见 render_cropped_page）
+        
+    返回:
+        dict: 包含转换结果和ZIP文件路径的字典
+    """
+    options = normalize_render_options(render_options)
+    extension = CROP_IMAGE_FORMATS[options["format"]]
+    
+    # 生成ZIP文件路径
+    zip_path = os.path.join(output_dir, f"{base_filename}_cropped_images.zip")
+    
+    # 编码后的图片直接写入ZIP，不再经过临时目录
+    images_count = 0
+    with zipfile.ZipFile(zip_path, 'w') as zipf:
+        for page_number, data, size in iter_cropped_pages(doc, pages, options, workers, pdf_path, pdf_data,
+                                                          rasters):
+            img_filename = f"page_{page_number:03d}{extension}"
+            with stage_timer("zip_build"):
+                zipf.writestr(img_filename, data, compress_type=compress_type_for(img_filename))
+            images_count += 1
             
-            cropped_images.append({
-                "page": page_num + 1,
-                "filename": img_filename,
-                "path": img_path,
-                "size": img.size
-            })
+            logger.debug("已渲染页面", extra={"page": page_number, "size": size})
             
-            print(f"已处理第 {page_num + 1} 页，图片尺寸: {img.size}")
+            if progress_callback is not None:
+                progress_callback("render", page_number, doc.page_count)
+    
+    return {
+        "status": "success",
+        "message": f"PDF成功裁剪为{images_count}张3:4比例图片",
+        "zip_path": zip_path,
+        "images_count": images_count,
+        "pages_count": doc.page_count
+    }
+
+def pdf_to_formats(pdf_path, formats, output_dir=None, workers=None, progress_callback=None,
+                    pdf_data=None, pages=None, render_options=None, page_cache=None, rasters=None):
+    """
+    一次解析PDF，同时生成多种输出格式
+    
+    文本、字体统计和图片只提取一次（文档中间表示），Markdown和Word输出共用；
+    裁剪图片复用同一个已打开的文档和页面尺寸。
+    
+    参数:
+        pdf_path (str): PDF文件的路径
+        formats (list): 需要的输出格式，可包含 "markdown"、"word"、"images"
+        output_dir (str): Word文档和ZIP文件的输出目录，如果为None则使用PDF文件所在目录
+        workers (int): 并行提取的进程数，None 时使用 MARKDOWN_WORKERS
+        progress_callback: 进度回调 callback(stage, page, page_count)，
+            stage 为 "extract"（文本和图片提取）或 "render"（裁剪图片渲染）
+        pdf_data: PDF内容缓冲区，给出时不读取 pdf_path（见 open_pdf）
+        pages (str): 页面选择表达式，如 "1-10,25,40-"，None 表示全部页面
+        render_options (dict): 裁剪图片的渲染参数（见 normalize_render_options）
+        page_cache (ConversionCache): 页级提取结果缓存（见 build_document），给出且需要提取文本时
+            结果中包含 pages_reused 和 pages_recomputed
+        rasters (RasterCache): 该文档的渲染结果缓存（见 render_cropped_page）
+        
+    返回:
+        dict: {"status", "message", "pages_count", 以及各格式的结果}，
+            其中 "markdown" 同 pdf_to_markdown 的返回值，"word" 同 pdf_to_word，
+            "images" 同 pdf_to_cropped_images
+    """
+    doc = None
+    try:
+        log_open_request(pdf_path, pdf_data)
         
-        # 创建ZIP文件
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for img_info in cropped_images:
-                zipf.write(img_info["path"], img_info["filename"])
+        if pdf_data is None and not os.path.exists(pdf_path):
+            return {
+                "status": "error",
+                "message": f"文件不存在: {pdf_path}"
+            }
         
-        # 清理临时文件
-        for img_info in cropped_images:
-            try:
-                os.remove(img_info["path"])
-            except:
-                pass
+        # 打开PDF文件
+        doc = open_pdf(pdf_path, pdf_data)
         
-        # 删除临时目录
-        try:
-            os.rmdir(temp_dir)
-        except:
-            pass
+        if doc.page_count == 0:
+            return {
+                "status": "error",
+                "message": "PDF文件为空"
+            }
         
-        return {
+        base_filename = os.path.splitext(os.path.basename(pdf_path))[0]
+        if output_dir is None:
+            output_dir = os.path.dirname(pdf_path)
+        
+        page_numbers = select_pages(pages, doc.page_count)
+        
+        result = {
             "status": "success",
-            "message": f"PDF成功裁剪为{len(cropped_images)}张3:4比例图片",
-            "zip_path": zip_path,
-            "images_count": len(cropped_images),
+            "message": "PDF转换完成",
             "pages_count": doc.page_count
         }
+        
+        # 只有Markdown和Word需要文本和图片
+        if "markdown" in formats:
+            images_dir = os.path.join(os.path.dirname(pdf_path), f"{base_filename}_images")
+            os.makedirs(images_dir, exist_ok=True)
+            document = build_document(doc, pdf_path, images_dir, workers, progress_callback, pdf_data,
+                                      page_numbers, page_cache=page_cache)
+        elif "word" in formats:
+            # 只生成Word时图片按显示尺寸缩小后保存在内存中
+            document = build_document(doc, pdf_path, None, workers, progress_callback, pdf_data,
+                                      page_numbers, WORD_IMAGE_WIDTH_INCHES * WORD_IMAGE_DPI, page_cache)
+        
+        if "markdown" in formats or "word" in formats:
+            geometry = document["pages"]
+            result.update(page_cache_counts(document["page_cache"]))
+            
+            if "markdown" in formats:
+                result["markdown"] = document_to_markdown(document)
+            
+            if "word" in formats:
+                if DOCX_AVAILABLE:
+                    word_path = os.path.join(output_dir, f"{base_filename}.docx")
+                    result["word"] = document_to_word(document, word_path)
+                else:
+                    result["word"] = {
+                        "status": "error",
+                        "message": "python-docx library is not available. Please install it to use Word conversion feature.",
+                        "word_path": None
+                    }
+        else:
+            geometry = page_geometry(doc, page_numbers)
+        
+        if "images" in formats:
+            result["images"] = render_cropped_pages(doc, geometry, base_filename, output_dir, progress_callback,
+                                                    render_options, workers, pdf_path, pdf_data, rasters)
+        
+        return result
     
     except Exception as e:
         # 记录错误并返回错误消息
-        error_msg = f"裁剪过程中出错: {str(e)}"
-        print(error_msg)
+        error_msg = f"转换过程中出错: {str(e)}"
+        logger.exception(error_msg)
         return {
             "status": "error",
-            "message": error_msg,
-            "zip_path": None
+            "message": error_msg
         }
     
     finally:
@@ -745,4 +2515,4 @@ def pdf_to_cropped_images(pdf_path, output_dir=None):
             try:
                 doc.close()
             except:
-                pass  # 忽略关闭时的错误
\ No newline at end of file
+                pass  # 忽略关闭时的错误
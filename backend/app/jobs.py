@@ -0,0 +1,357 @@
+import json
+import logging
+import math
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+
+from app.logs import configure_logging, log_context, request_id_var
+from app.metrics import collect_stage_timings, replay_stage_timings
+from app.storage import JOB_ID_PATTERN, job_dir
+
+logger = logging.getLogger(__name__)
+
+# 任务目录中保存任务状态和转换结果的文件，供其他服务进程查询
+JOB_STATE_FILENAME = "job.json"
+JOB_RESULT_FILENAME = "job_result.json"
+
+# 工作进程中的进度队列，由进程池初始化函数设置
+_progress_queue = None
+
+def _init_worker(progress_queue):
+    """进程池初始化：保存进度队列供转换任务上报进度，并配置日志"""
+    global _progress_queue
+    _progress_queue = progress_queue
+    configure_logging()
+
+def _run_conversion_job(job_id, pdf_path, formats, output_dir, options=None, request_id=None):
+    """
+    在工作进程中执行转换任务，每处理完一页通过进度队列上报
+
+    返回:
+        tuple: (pdf_to_formats 的返回值, 阶段耗时列表)，阶段耗时由主进程记录到 /metrics
+    """
+    from app.converter import pdf_to_formats
+
+    def report_progress(stage, page, page_count):
+        _progress_queue.put((job_id, stage, page, page_count))
+
+    with log_context(request_id=request_id, job_id=job_id), collect_stage_timings() as timings:
+        logger.info("转换任务开始", extra={"formats": list(formats)})
+        report_progress("start", 0, None)
+
+        # 任务本身已在独立进程中执行，不再嵌套并行
+        result = pdf_to_formats(pdf_path, formats, output_dir, workers=1, progress_callback=report_progress,
+                                **(options or {}))
+        logger.info("转换任务结束", extra={"status": result.get("status")})
+    return result, timings
+
+class JobQueueFull(Exception):
+    """任务队列已满，调用方应在 retry_after 秒后重试"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"任务队列已满，请在{retry_after}秒后重试")
+        self.retry_after = retry_after
+
+class JobManager:
+    """
+    异步转换任务管理：在有界的进程池中执行转换，记录任务状态、逐页进度和结果
+
+    排队和执行中的任务总数达到 max_pending 时拒绝新任务（JobQueueFull）。
+    已结束的任务在 result_ttl 秒后从内存中清除。
+
+    给出 store_root 时，任务状态和结果同时写入任务目录（<store_root>/<前两位>/<任务ID>/），
+    多个服务进程共用该目录时，任何一个进程都能查询其他进程提交的任务。
+    """
+
+    def __init__(self, max_workers, max_pending, result_ttl, store_root=None):
+        """
+        参数:
+            max_workers (int): 工作进程数
+            max_pending (int): 排队和执行中任务数的上限
+            result_ttl (int): 已结束任务的保留时间（秒）
+            store_root (str): 临时文件根目录，任务目录位于其中（见 job_dir）
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.result_ttl = result_ttl
+        self.store_root = store_root
+
+        self._lock = threading.Lock()
+        self._executor_lock = threading.Lock()
+        self._jobs = {}
+        self._pending = 0
+        self._avg_duration = None  # 最近任务的平均耗时（指数移动平均）
+        self._executor = None
+        self._progress_queue = None
+
+    def _ensure_executor(self):
+        """首次提交任务时才创建进程池，避免在导入时启动子进程"""
+        with self._executor_lock:
+            if self._executor is None:
+                self._progress_queue = multiprocessing.Queue()
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    initializer=_init_worker,
+                    initargs=(self._progress_queue,)
+                )
+                listener = threading.Thread(target=self._consume_progress, args=(self._progress_queue,), daemon=True)
+                listener.start()
+            return self._executor
+
+    def _store_path(self, job_id, filename):
+        return os.path.join(job_dir(self.store_root, job_id, create=False), filename)
+
+    def _write_store(self, job_id, filename, data):
+        """原子地写入任务目录中的状态文件"""
+        if self.store_root is None:
+            return
+        path = self._store_path(job_id, filename)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            logger.warning("保存任务状态失败", extra={"job_id": job_id, "error": str(e)})
+
+    def _read_store(self, job_id, filename):
+        """
+        读取其他进程写入的任务状态文件
+
+        返回:
+            dict: 文件内容，不存在或无法解析时返回None
+        """
+        if self.store_root is None or not JOB_ID_PATTERN.match(job_id):
+            return None
+        try:
+            with open(self._store_path(job_id, filename), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_state(self, job):
+        """把任务状态快照写入任务目录（调用方需持有锁，保证写入顺序与状态变化一致）"""
+        self._write_store(job["job_id"], JOB_STATE_FILENAME, self._snapshot(job))
+
+    def _consume_progress(self, progress_queue):
+        """后台线程：读取工作进程上报的进度并更新任务记录"""
+        while True:
+            try:
+                job_id, stage, page, page_count = progress_queue.get()
+            except (EOFError, OSError, queue.Empty):
+                return
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is not None and job["status"] in ("queued", "running"):
+                    job["status"] = "running"
+                    job["progress"] = {"stage": stage, "page": page, "page_count": page_count}
+                    self._save_state(job)
+
+    def submit(self, pdf_path, formats, output_dir, filename, job_id=None, options=None, on_done=None):
+        """
+        提交转换任务，立即返回任务记录
+
+        任务结束后会删除输入的PDF文件。
+
+        参数:
+            pdf_path (str): 待转换的PDF文件路径
+            formats (list): 输出格式
+            output_dir (str): 输出目录
+            filename (str): 原始文件名
+            job_id (str): 任务ID，None 时自动生成
+            options (dict): 传给 pdf_to_formats 的其他参数，如 pages、render_options
+            on_done: 任务结束（成功或失败）后的回调 callback(job_id)
+
+        返回:
+            dict: 任务状态快照
+
+        异常:
+            JobQueueFull: 排队任务数已达上限
+            Exception: 重建进程池后仍无法提交，任务记录已撤销（任务目录中的状态文件由调用方清理）
+        """
+        with self._lock:
+            self._prune_expired()
+            if self._pending >= self.max_pending:
+                raise JobQueueFull(self._estimate_retry_after())
+
+            if job_id is None:
+                job_id = str(uuid.uuid4())
+            job = {
+                "job_id": job_id,
+                "status": "queued",
+                "filename": filename,
+                "formats": list(formats),
+                "progress": {"stage": None, "page": 0, "page_count": None},
+                "created_at": time.time(),
+                "finished_at": None,
+                "result": None,
+                "error": None
+            }
+            self._jobs[job_id] = job
+            self._pending += 1
+            self._save_state(job)
+
+        # 提交任务的请求ID随任务传给工作进程，任务日志可以和请求日志关联
+        request_id = request_id_var.get()
+        try:
+            try:
+                future = self._ensure_executor().submit(_run_conversion_job, job_id, pdf_path, formats,
+                                                        output_dir, options, request_id)
+            except Exception as e:
+                # 进程池已损坏（如工作进程被系统杀死），重建后重试一次
+                logger.warning("提交转换任务失败，重建进程池", extra={"job_id": job_id, "error": str(e)})
+                with self._executor_lock:
+                    self._executor = None
+                future = self._ensure_executor().submit(_run_conversion_job, job_id, pdf_path, formats,
+                                                        output_dir, options, request_id)
+        except Exception:
+            # 重试仍然失败：撤销任务记录并释放排队名额，否则任务永远停在 queued 并占用队列
+            with self._lock:
+                self._jobs.pop(job_id, None)
+                self._pending -= 1
+            logger.error("提交转换任务失败", extra={"job_id": job_id})
+            raise
+
+        future.add_done_callback(lambda f: self._finish(job_id, pdf_path, f, on_done))
+        return self.get(job_id)
+
+    def _finish(self, job_id, pdf_path, future, on_done=None):
+        """任务结束回调：记录结果或错误，删除输入的PDF，再调用 on_done"""
+        try:
+            result, timings = future.result()
+            replay_stage_timings(timings)
+            error = None if result.get("status") == "success" else result.get("message")
+        except CancelledError:
+            result = None
+            error = "服务停止，排队中的任务已取消"
+        except Exception as e:
+            result = None
+            error = f"转换过程中出错: {str(e)}"
+            logger.error("转换任务失败", extra={"job_id": job_id, "error": error})
+
+        try:
+            if os.path.exists(pdf_path):
+                os.remove(pdf_path)
+        except OSError as e:
+            logger.warning("删除临时PDF文件时出错", extra={"job_id": job_id, "error": str(e)})
+
+        if result is not None and not error:
+            # 先写结果再写状态：其他进程看到 done 时结果文件已经存在
+            self._write_store(job_id, JOB_RESULT_FILENAME, result)
+
+        with self._lock:
+            job = self._jobs.get(job_id)
+            self._pending -= 1
+            if job is not None:
+                job["finished_at"] = time.time()
+                job["status"] = "failed" if error else "done"
+                job["result"] = result
+                job["error"] = error
+                self._save_state(job)
+
+                duration = job["finished_at"] - job["created_at"]
+                if self._avg_duration is None:
+                    self._avg_duration = duration
+                else:
+                    self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+
+        if on_done is not None:
+            on_done(job_id)
+
+    def _estimate_retry_after(self):
+        """根据最近任务的平均耗时估算需要等待的秒数"""
+        if self._avg_duration is None:
+            return 5
+        waves = math.ceil(self._pending / self.max_workers)
+        return max(1, int(math.ceil(self._avg_duration * waves)))
+
+    def _prune_expired(self):
+        """清除超过保留时间的已结束任务（调用方需持有锁）"""
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["finished_at"] is not None and now - job["finished_at"] > self.result_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    @staticmethod
+    def _snapshot(job):
+        """任务状态快照（不含结果）"""
+        return {
+            "job_id": job["job_id"],
+            "status": job["status"],
+            "filename": job["filename"],
+            "formats": job["formats"],
+            "progress": dict(job["progress"]),
+            "created_at": job["created_at"],
+            "finished_at": job["finished_at"],
+            "error": job["error"]
+        }
+
+    def _stored_job(self, job_id):
+        """其他进程提交的任务：从任务目录读取状态，已超过保留时间的视为不存在"""
+        job = self._read_store(job_id, JOB_STATE_FILENAME)
+        if job is None:
+            return None
+        if job.get("finished_at") is not None and time.time() - job["finished_at"] > self.result_ttl:
+            return None
+        return job
+
+    def get(self, job_id):
+        """
+        查询任务状态（包括同一存储目录下其他进程提交的任务）
+
+        返回:
+            dict: 任务状态快照（不含结果），任务不存在时返回None
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return self._snapshot(job)
+        return self._stored_job(job_id)
+
+    def result(self, job_id):
+        """
+        获取已完成任务的转换结果
+
+        返回:
+            dict: pdf_to_formats 的返回值，任务不存在或未完成时返回None
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job["result"] if job["status"] == "done" else None
+
+        job = self._stored_job(job_id)
+        if job is None or job["status"] != "done":
+            return None
+        return self._read_store(job_id, JOB_RESULT_FILENAME)
+
+    def shutdown(self, wait=True):
+        """
+        停止进程池（服务进程退出时调用）：取消排队中的任务，
+        wait 为 True 时等待执行中的任务结束
+        """
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def stats(self):
+        """返回任务队列统计信息"""
+        with self._lock:
+            counts = {"queued": 0, "running": 0, "done": 0, "failed": 0}
+            for job in self._jobs.values():
+                counts[job["status"]] += 1
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "pending": self._pending,
+                "jobs": counts
+            }
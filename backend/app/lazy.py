@@ -0,0 +1,64 @@
+import importlib
+import importlib.util
+import threading
+
+class LazyModule:
+    """
+    延迟导入的模块代理：首次访问属性时才导入真正的模块
+
+    导入后把模块的属性复制到代理对象上，之后的属性访问不再经过 __getattr__，
+    与直接使用模块没有差别。fitz 的导入耗时较长，只处理 /health、/api/images 的
+    服务进程不需要加载它。
+    """
+
+    def __init__(self, name):
+        self._lazy_name = name
+        self._lazy_lock = threading.Lock()
+        self._lazy_module = None
+
+    def _load(self):
+        with self._lazy_lock:
+            if self._lazy_module is None:
+                module = importlib.import_module(self._lazy_name)
+                self.__dict__.update(
+                    (key, value) for key, value in vars(module).items() if not key.startswith("_lazy_")
+                )
+                self._lazy_module = module
+        return self._lazy_module
+
+    def __getattr__(self, attr):
+        # 只有代理对象上还没有的属性才会进入这里
+        if attr.startswith("__") and attr.endswith("__"):
+            raise AttributeError(attr)
+        return getattr(self._load(), attr)
+
+    def __repr__(self):
+        state = "loaded" if self._lazy_module is not None else "not loaded"
+        return f"<lazy module {self._lazy_name!r} ({state})>"
+
+def lazy_import(name):
+    """
+    返回模块的延迟导入代理，用法与 import 后的模块相同：
+
+        fitz = lazy_import("fitz")
+        doc = fitz.open(path)   # 此时才导入 fitz
+
+    参数:
+        name (str): 模块名
+
+    返回:
+        LazyModule: 模块代理
+    """
+    return LazyModule(name)
+
+def module_available(name):
+    """
+    检查模块能否导入，而不实际导入它
+
+    返回:
+        bool: 模块已安装时为True
+    """
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
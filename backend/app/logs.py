@@ -0,0 +1,136 @@
+import contextvars
+import json
+import logging
+import os
+import re
+import sys
+import uuid
+from contextlib import contextmanager
+
+# 日志级别，可通过环境变量 PDF2MD_LOG_LEVEL 配置（DEBUG 时输出逐页、逐阶段的日志）
+LOG_LEVEL = os.environ.get("PDF2MD_LOG_LEVEL", "INFO").upper()
+
+# 日志格式：json 每行一个JSON对象，text 为便于阅读的单行文本
+LOG_FORMAT = os.environ.get("PDF2MD_LOG_FORMAT", "json").lower()
+
+# 当前请求和转换任务的ID，由请求钩子和任务进程设置，自动附加到每条日志
+request_id_var = contextvars.ContextVar("request_id", default=None)
+job_id_var = contextvars.ContextVar("job_id", default=None)
+
+# 客户端传入的 X-Request-ID 只接受这些字符，避免日志注入
+REQUEST_ID_PATTERN = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+# LogRecord 的标准属性，其余属性视为通过 extra 传入的结构化字段
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class ContextFilter(logging.Filter):
+    """把当前的请求ID和任务ID附加到日志记录上"""
+
+    def filter(self, record):
+        # 通过 extra 显式传入的ID优先
+        if getattr(record, "request_id", None) is None:
+            record.request_id = request_id_var.get()
+        if getattr(record, "job_id", None) is None:
+            record.job_id = job_id_var.get()
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """
+    每条日志输出为一行JSON：时间、级别、logger、消息、请求ID、任务ID，
+    以及通过 extra 传入的字段
+    """
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        if getattr(record, "job_id", None):
+            entry["job_id"] = record.job_id
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and key not in ("request_id", "job_id") and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """单行文本格式，结构化字段以 key=value 追加在消息后"""
+
+    def format(self, record):
+        ids = " ".join(
+            f"{name}={value}" for name, value in
+            (("request_id", getattr(record, "request_id", None)), ("job_id", getattr(record, "job_id", None)))
+            if value
+        )
+        fields = " ".join(
+            f"{key}={value}" for key, value in record.__dict__.items()
+            if key not in _RECORD_ATTRS and key not in ("request_id", "job_id") and not key.startswith("_")
+        )
+        line = f"{self.formatTime(record)} {record.levelname} {record.name} {record.getMessage()}"
+        for part in (fields, ids):
+            if part:
+                line += f" {part}"
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+def configure_logging(level=None, log_format=None):
+    """
+    配置 app 下所有模块的日志输出（stderr），重复调用时替换原有配置
+
+    参数:
+        level (str): 日志级别，None 时使用 LOG_LEVEL
+        log_format (str): "json" 或 "text"，None 时使用 LOG_FORMAT
+    """
+    logger = logging.getLogger("app")
+    for handler in list(logger.handlers):
+        if getattr(handler, "_pdf2md_handler", False):
+            logger.removeHandler(handler)
+
+    handler = logging.StreamHandler(sys.stderr)
+    handler._pdf2md_handler = True
+    handler.addFilter(ContextFilter())
+    handler.setFormatter(TextFormatter() if (log_format or LOG_FORMAT) == "text" else JsonFormatter())
+
+    logger.addHandler(handler)
+    logger.setLevel(level or LOG_LEVEL)
+    logger.propagate = False
+
+def new_request_id(header_value=None):
+    """
+    确定请求ID：沿用客户端传入的合法 X-Request-ID，否则生成一个新的
+
+    返回:
+        str: 请求ID
+    """
+    if header_value and REQUEST_ID_PATTERN.match(header_value):
+        return header_value
+    return uuid.uuid4().hex
+
+@contextmanager
+def log_context(request_id=None, job_id=None):
+    """
+    在 with 块内为日志设置请求ID和/或任务ID，退出时恢复原值
+    """
+    tokens = []
+    if request_id is not None:
+        tokens.append((request_id_var, request_id_var.set(request_id)))
+    if job_id is not None:
+        tokens.append((job_id_var, job_id_var.set(job_id)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+def iter_in_log_context(iterable, request_id=None, job_id=None):
+    """
+    迭代流式响应时恢复请求ID：流式内容在请求上下文结束之后才生成
+    """
+    with log_context(request_id=request_id, job_id=job_id):
+        yield from iterable
@@ -0,0 +1,282 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from app.logs import iter_in_log_context, new_request_id, request_id_var
+
+logger = logging.getLogger(__name__)
+
+# 直方图的默认分桶上界（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Histogram:
+    """
+    带标签的直方图，按 Prometheus 文本格式输出 _bucket、_sum 和 _count
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {}  # 标签值元组 -> [各分桶计数, 总和, 次数]
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        """返回 Prometheus 文本格式的各行"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {key: (list(counts), total, count) for key, (counts, total, count) in self._series.items()}
+        for key in sorted(snapshot):
+            counts, total, count = snapshot[key]
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(pairs)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(pairs)} {count}")
+        return lines
+
+class Gauge:
+    """带标签的数值，可增减或直接设置"""
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def collect(self):
+        """返回 Prometheus 文本格式的各行"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            snapshot = dict(self._values)
+        for key in sorted(snapshot):
+            lines.append(f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {_format_value(snapshot[key])}")
+        return lines
+
+REQUEST_SECONDS = Histogram(
+    "pdf2md_request_duration_seconds",
+    "HTTP请求处理耗时（秒），流式响应计到响应结束",
+    ("endpoint", "method", "status"))
+
+STAGE_SECONDS = Histogram(
+    "pdf2md_stage_duration_seconds",
+    "转换各阶段耗时（秒）：text_extraction、image_extraction、page_cache、page_render、zip_build 按页，其余按次",
+    ("stage",))
+
+CONVERSIONS_IN_FLIGHT = Gauge(
+    "pdf2md_conversions_in_flight",
+    "正在进行的同步转换请求数",
+    ("endpoint",))
+
+JOBS = Gauge(
+    "pdf2md_jobs",
+    "异步转换任务数（按状态）",
+    ("status",))
+
+STORAGE_BYTES = Gauge(
+    "pdf2md_storage_bytes",
+    "临时文件目录中已登记的任务目录总大小（字节）")
+
+STORAGE_JOBS = Gauge(
+    "pdf2md_storage_jobs",
+    "临时文件目录中已登记的任务目录数")
+
+REGISTRY = [REQUEST_SECONDS, STAGE_SECONDS, CONVERSIONS_IN_FLIGHT, JOBS, STORAGE_BYTES, STORAGE_JOBS]
+
+# 工作进程中收集阶段耗时的列表（见 collect_stage_timings），为None时直接记录到直方图
+_stage_collector = None
+
+def record_stage(stage, seconds):
+    """记录一次阶段耗时"""
+    if _stage_collector is not None:
+        _stage_collector.append((stage, seconds))
+    else:
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    logger.debug("阶段完成", extra={"stage": stage, "duration_ms": round(seconds * 1000, 3)})
+
+@contextmanager
+def stage_timer(stage):
+    """
+    统计一个转换阶段的耗时，可用作 with 语句或函数装饰器
+
+    参数:
+        stage (str): 阶段名，如 open、text_extraction、image_extraction、page_cache、
+            markdown_assembly、docx_assembly、docx_save、page_render、zip_build
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+@contextmanager
+def collect_stage_timings():
+    """
+    在进程池的工作进程中收集阶段耗时，而不是记录到本进程的直方图（主进程看不到）；
+    调用方把收集到的列表随结果返回，由主进程用 replay_stage_timings 记录
+
+    返回:
+        list: [(阶段名, 秒数), ...]，with 块结束后完整
+    """
+    global _stage_collector
+    previous = _stage_collector
+    _stage_collector = timings = []
+    try:
+        yield timings
+    finally:
+        _stage_collector = previous
+
+def replay_stage_timings(timings):
+    """记录工作进程返回的阶段耗时"""
+    for stage, seconds in timings or ():
+        if _stage_collector is not None:
+            _stage_collector.append((stage, seconds))
+        else:
+            STAGE_SECONDS.observe(seconds, stage=stage)
+
+def counts_in_flight(view):
+    """标记执行转换的路由，处理期间计入 pdf2md_conversions_in_flight"""
+    view.counts_in_flight = True
+    return view
+
+def render_metrics():
+    """
+    以 Prometheus 文本格式输出全部指标
+
+    返回:
+        str: 指标文本
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+def init_app(app):
+    """
+    注册请求钩子：分配请求ID（响应头 X-Request-ID）、记录请求耗时和访问日志、
+    统计进行中的转换请求
+
+    耗时和进行中计数在响应关闭时结束，流式响应计到最后一块数据发送完毕；
+    send_file 返回的文件响应计到开始发送为止。
+    """
+    from flask import g, request
+
+    def finish(state, status):
+        duration = time.perf_counter() - state["started"]
+        REQUEST_SECONDS.observe(duration, endpoint=state["endpoint"], method=state["method"], status=status)
+        if state["in_flight"]:
+            CONVERSIONS_IN_FLIGHT.dec(endpoint=state["endpoint"])
+        logger.info("请求完成", extra={
+            "request_id": state["request_id"],
+            "method": state["method"],
+            "path": state["path"],
+            "endpoint": state["endpoint"],
+            "status": status,
+            "duration_ms": round(duration * 1000, 3)
+        })
+
+    @app.before_request
+    def _start_request():
+        request_id = new_request_id(request.headers.get("X-Request-ID"))
+        g.request_id = request_id
+        g.request_id_token = request_id_var.set(request_id)
+
+        view = app.view_functions.get(request.endpoint)
+        in_flight = getattr(view, "counts_in_flight", False)
+        if in_flight:
+            CONVERSIONS_IN_FLIGHT.inc(endpoint=request.endpoint)
+
+        g.request_state = {
+            "started": time.perf_counter(),
+            "request_id": request_id,
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint or "unmatched",
+            "in_flight": in_flight
+        }
+
+    @app.after_request
+    def _tag_response(response):
+        state = g.pop("request_state", None)
+        if state is None:
+            return response
+
+        response.headers["X-Request-ID"] = state["request_id"]
+        status = response.status_code
+        if response.direct_passthrough:
+            # send_file 等直通响应的文件由服务器直接发送，不会触发 close 回调，在这里结束统计
+            finish(state, status)
+            return response
+
+        response.call_on_close(lambda: finish(state, status))
+        if response.is_streamed:
+            # 流式内容在请求上下文结束后才生成，迭代时恢复请求ID
+            response.response = iter_in_log_context(response.response, request_id=state["request_id"])
+        return response
+
+    @app.teardown_request
+    def _end_request(exc):
+        # after_request 未执行（如其中抛出异常）时在这里结束统计
+        state = g.pop("request_state", None)
+        if state is not None:
+            finish(state, 500)
+
+        token = g.pop("request_id_token", None)
+        if token is not None:
+            try:
+                request_id_var.reset(token)
+            except ValueError:
+                pass
@@ -0,0 +1,191 @@
+import hashlib
+import json
+import logging
+import re
+
+from app.cache import make_cache_key
+
+logger = logging.getLogger(__name__)
+
+# PDF对象定义中的间接引用，如 "12 0 R"
+REFERENCE_PATTERN = re.compile(r"\b(\d+) (\d+) R\b")
+
+# 资源字典中的 "/名称 对象引用" 条目
+RESOURCE_ENTRY_PATTERN = re.compile(r"/([^\s/<>\[\]()%{}]+)\s*(\d+ \d+ R)")
+
+# 按内容流中实际使用的名称筛选条目的资源类别
+RESOURCE_CATEGORIES = ("Font", "XObject", "ExtGState", "ColorSpace", "Pattern", "Shading", "Properties")
+
+# 查找继承的 /Resources 时向上追溯页面树的最大层数
+MAX_INHERITANCE_DEPTH = 32
+
+class PageHasher:
+    """
+    计算页面内容哈希：内容流 + 内容流引用的资源（字体、表单等）+ 页面上的图片 + 页面尺寸和旋转
+
+    对象定义中的间接引用被替换为被引用对象的哈希，因此哈希与对象编号无关：
+    重新生成的PDF中内容未变的页面得到相同的哈希。多个页面共用一个资源字典时，
+    只计入本页内容流中出现的名称，其他页面新增的字体不会使本页失效。
+    同一文档中共享的对象（如字体）只计算一次。
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        self._xref_count = doc.xref_length()
+        self._digests = {}     # xref -> 十六进制摘要
+        self._visiting = set()  # 正在计算的对象，用于打断循环引用
+
+    def _resolve(self, text):
+        """把对象定义中的间接引用替换为被引用对象的哈希"""
+        def replace(match):
+            xref = int(match.group(1))
+            if not 0 < xref < self._xref_count:
+                return match.group(0)
+            return f"<{self.object_digest(xref)}>"
+        return REFERENCE_PATTERN.sub(replace, text)
+
+    def object_digest(self, xref):
+        """
+        计算一个对象及其递归引用的全部对象的哈希
+
+        参数:
+            xref (int): 对象编号
+
+        返回:
+            str: 十六进制摘要
+        """
+        digest = self._digests.get(xref)
+        if digest is not None:
+            return digest
+        if xref in self._visiting:
+            return "cycle"
+
+        self._visiting.add(xref)
+        try:
+            hasher = hashlib.sha256()
+            hasher.update(self._resolve(self.doc.xref_object(xref, compressed=True)).encode("utf-8"))
+            if self.doc.xref_is_stream(xref):
+                hasher.update(self.doc.xref_stream_raw(xref) or b"")
+            digest = hasher.hexdigest()
+        finally:
+            self._visiting.discard(xref)
+        self._digests[xref] = digest
+        return digest
+
+    def _resources_holder(self, page):
+        """定义页面 /Resources 的对象（页面本身或继承自的页面树节点），没有时返回None"""
+        xref = page.xref
+        for _ in range(MAX_INHERITANCE_DEPTH):
+            kind, _ = self.doc.xref_get_key(xref, "Resources")
+            if kind != "null":
+                return xref
+            kind, parent = self.doc.xref_get_key(xref, "Parent")
+            if kind != "xref":
+                break
+            xref = int(parent.split()[0])
+        return None
+
+    def _referenced_resources(self, page, content):
+        """
+        内容流中使用的资源条目（不含其他页面共用资源字典时新增的条目）
+
+        参数:
+            page: PDF页面对象
+            content (bytes): 页面的全部内容流
+
+        返回:
+            str: 引用已替换为对象哈希的资源描述
+        """
+        holder = self._resources_holder(page)
+        if holder is None:
+            return ""
+
+        parts = []
+        for category in RESOURCE_CATEGORIES:
+            kind, value = self.doc.xref_get_key(holder, f"Resources/{category}")
+            if kind == "null":
+                continue
+            if kind == "xref":
+                value = self.doc.xref_object(int(value.split()[0]), compressed=True)
+            entries = RESOURCE_ENTRY_PATTERN.findall(value)
+            if RESOURCE_ENTRY_PATTERN.sub("", value).strip() not in ("<<>>", ""):
+                # 含有直接对象等无法逐项筛选的条目，整体计入
+                parts.append(f"/{category}{self._resolve(value)}")
+                continue
+            for name, reference in sorted(entries):
+                if f"/{name}".encode("latin-1", "replace") in content:
+                    parts.append(f"/{category}/{name}{self._resolve(reference)}")
+        return "".join(parts)
+
+    def page_hash(self, page):
+        """
+        计算页面内容哈希
+
+        参数:
+            page: PDF页面对象
+
+        返回:
+            str: 十六进制摘要
+        """
+        content = b"".join(self.doc.xref_stream(xref) or b"" for xref in page.get_contents())
+        hasher = hashlib.sha256()
+        hasher.update(f"{tuple(page.mediabox)}|{tuple(page.cropbox)}|{page.rotation}|".encode("utf-8"))
+        hasher.update(content)
+        hasher.update(self._referenced_resources(page, content).encode("utf-8"))
+        # 图片提取处理资源中列出的全部图片（包括内容流未使用的），完整计入
+        for img in page.get_images():
+            hasher.update(f"|{img[7]}:{self.object_digest(img[0])}".encode("utf-8"))
+        return hasher.hexdigest()
+
+class PageCache:
+    """
+    页级提取结果缓存，存放在转换缓存（ConversionCache）中
+
+    每页一条记录：页面上的文本片段（不含页码）和每个图片位置的描述（图片哈希、格式、尺寸），
+    图片内容按图片哈希单独存放，多个页面和多个版本共用。
+    """
+
+    def __init__(self, cache, image_mode, image_max_width=None):
+        """
+        参数:
+            cache (ConversionCache): 存放缓存条目的转换缓存
+            image_mode (str): 图片提取模式，不同模式保存的图片不同
+            image_max_width (int): 只保存在内存中的图片的最大宽度（见 extract_images_from_page）
+        """
+        self.cache = cache
+        self.options = {"image_mode": image_mode, "image_max_width": image_max_width}
+
+    def load(self, page_hash):
+        """
+        读取页面记录
+
+        返回:
+            dict: {"spans": [[文本, 字号, 标志, [x0, y0, x1, y1]], ...],
+                   "images": [{"hash", "ext", "width", "height"} 或 None, ...]}，未命中返回None
+        """
+        cached = self.cache.get(make_cache_key(page_hash, "page", self.options))
+        if cached is None:
+            return None
+        try:
+            return json.loads(cached.decode("utf-8"))
+        except ValueError:
+            logger.warning("页面缓存条目损坏", extra={"page_hash": page_hash})
+            return None
+
+    def store(self, page_hash, spans, images):
+        """写入页面记录，参数含义同 load 的返回值"""
+        entry = json.dumps({"spans": spans, "images": images}, ensure_ascii=False)
+        self.cache.put(make_cache_key(page_hash, "page", self.options), entry.encode("utf-8"))
+
+    def load_image(self, image_hash):
+        """
+        读取图片内容
+
+        返回:
+            bytes: 未命中返回None
+        """
+        return self.cache.get(make_cache_key(image_hash, "page_image", self.options))
+
+    def store_image(self, image_hash, data):
+        """写入图片内容"""
+        self.cache.put(make_cache_key(image_hash, "page_image", self.options), data)
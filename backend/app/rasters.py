@@ -0,0 +1,53 @@
+from app.cache import make_cache_key
+
+class RasterCache:
+    """
+    一份PDF的页面渲染结果缓存，条目存放在转换缓存（ConversionCache，内存 + 磁盘两级LRU）中
+
+    键由文档内容哈希、页码、渲染区域（PDF坐标）、输出像素尺寸（即缩放比例）、图片格式和质量组成。
+    页面预览和裁剪图片导出使用同一套键，渲染过的图片在两者之间复用。
+    """
+
+    def __init__(self, cache, doc_hash):
+        """
+        参数:
+            cache (ConversionCache): 存放渲染结果的缓存
+            doc_hash (str): PDF内容的SHA-256
+        """
+        self.cache = cache
+        self.doc_hash = doc_hash
+
+    def key(self, page_number, clip, size, image_format, quality):
+        """
+        生成缓存键
+
+        参数:
+            page_number (int): 页码（从1开始）
+            clip: 渲染区域（fitz.Rect 或 (x0, y0, x1, y1)）
+            size (tuple): 输出图片的像素尺寸 (宽, 高)
+            image_format (str): png、jpeg 或 webp
+            quality (int): JPEG/WebP 质量，PNG 忽略
+
+        返回:
+            str: 缓存键
+        """
+        return make_cache_key(self.doc_hash, "raster", {
+            "page": page_number,
+            "clip": [round(value, 2) for value in tuple(clip)],
+            "size": list(size),
+            "format": image_format,
+            "quality": None if image_format == "png" else quality
+        })
+
+    def get(self, page_number, clip, size, image_format, quality):
+        """
+        读取渲染结果
+
+        返回:
+            bytes: 编码后的图片，未命中返回None
+        """
+        return self.cache.get(self.key(page_number, clip, size, image_format, quality))
+
+    def put(self, page_number, clip, size, image_format, quality, data):
+        """写入渲染结果"""
+        self.cache.put(self.key(page_number, clip, size, image_format, quality), data)
@@ -1,10 +1,30 @@
-from flask import Blueprint, jsonify, request, current_app, send_file
+from flask import Blueprint, jsonify, request, current_app, send_file, Response
 import os
+import shutil
 import uuid
-import zipfile
 import io
+import json
+import base64
+import logging
+import unicodedata
+from urllib.parse import quote
+from werkzeug.datastructures import Headers
 from werkzeug.utils import secure_filename
-from app.converter import pdf_to_markdown, pdf_to_word, pdf_to_cropped_images
+from app.converter import (
+    pdf_to_markdown, pdf_to_word, iter_pdf_to_markdown, pdf_to_formats,
+    pdf_to_markdown_chunk, iter_cropped_images, open_pdf, select_pages,
+    parse_page_selector, normalize_render_options, render_page_preview,
+    IMAGE_EXTRACTION_MODE, CROP_IMAGE_FORMATS
+)
+from app.cache import ConversionCache, hash_stream, make_cache_key
+from app.rasters import RasterCache
+from app.storage import ImageIndex, StorageManager, job_dir, JOB_ID_PATTERN
+from app.zipstream import iter_zip_stream
+from app.jobs import JobManager, JobQueueFull
+from app.uploads import UPLOAD_MEMORY_LIMIT, open_upload_buffer, upload_size, detach_upload
+from app.metrics import counts_in_flight, render_metrics, JOBS, STORAGE_BYTES, STORAGE_JOBS
+
+logger = logging.getLogger(__name__)
 
 main_bp = Blueprint('main', __name__)
 
@@ -16,7 +36,7 @@ def ensure_temp_dir_exists():
     """确保临时目录存在"""
     if not os.path.exists(TEMP_UPLOAD_FOLDER):
         os.makedirs(TEMP_UPLOAD_FOLDER)
-        print(f"已创建临时目录: {TEMP_UPLOAD_FOLDER}")
+        logger.info("已创建临时目录", extra={"path": TEMP_UPLOAD_FOLDER})
     return TEMP_UPLOAD_FOLDER
 
 # 初始化创建临时目录
@@ -25,58 +45,219 @@ ensure_temp_dir_exists()
 # 文件大小限制 (50MB)
 MAX_CONTENT_LENGTH = 50 * 1024 * 1024
 
-@main_bp.route('/health', methods=['GET'])
-def health_check():
-    """健康检查端点，返回200 OK状态和简单的JSON响应"""
-    return jsonify({
-        "status": "ok",
-        "message": "后端正在运行"
-    }), 200
+# /api/convert_pdf 和 /api/jobs 支持的输出格式
+SUPPORTED_FORMATS = ("markdown", "word", "images")
 
-@main_bp.route('/api/upload_pdf', methods=['POST'])
-def upload_pdf():
-    """PDF上传和验证端点"""
+# 裁剪图片渲染参数的取值范围：DPI以及目标宽高（像素）
+RENDER_DPI_RANGE = (18, 600)
+RENDER_MAX_PIXELS = 10000
+
+# 分段Markdown接口每次默认转换的页数，可通过 PDF2MD_CHUNK_PAGES 配置；limit 参数不能超过上限
+CHUNK_PAGES = int(os.environ.get("PDF2MD_CHUNK_PAGES", "10"))
+CHUNK_MAX_PAGES = 100
+
+# 异步转换任务：工作进程数、排队上限（含执行中）以及结果保留时间（秒）
+JOB_WORKERS = int(os.environ.get("PDF2MD_JOB_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+JOB_QUEUE_SIZE = int(os.environ.get("PDF2MD_JOB_QUEUE_SIZE", JOB_WORKERS * 4))
+JOB_RESULT_TTL = int(os.environ.get("PDF2MD_JOB_RESULT_TTL", 3600))
+
+# 服务进程数（gunicorn.conf.py 设置，开发服务器为1）：每个服务进程各有一个任务进程池，
+# 进程数和排队上限按服务进程数平分，总数不随服务进程数成倍增加
+SERVER_PROCESSES = max(1, int(os.environ.get("PDF2MD_SERVER_WORKERS", "1")))
+
+# 任务状态和结果写入任务目录，任何服务进程都能查询
+job_manager = JobManager(max(1, JOB_WORKERS // SERVER_PROCESSES), max(1, JOB_QUEUE_SIZE // SERVER_PROCESSES),
+                         JOB_RESULT_TTL, TEMP_UPLOAD_FOLDER)
+
+# 转换结果缓存配置：内存层和磁盘层的容量上限（字节）
+CACHE_FOLDER = os.path.abspath(os.environ.get("PDF2MD_CACHE_DIR", "conversion_cache"))
+CACHE_MEMORY_LIMIT = int(os.environ.get("PDF2MD_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+CACHE_DISK_LIMIT = int(os.environ.get("PDF2MD_CACHE_DISK_BYTES", 1024 * 1024 * 1024))
+
+conversion_cache = ConversionCache(CACHE_FOLDER, CACHE_MEMORY_LIMIT, CACHE_DISK_LIMIT)
+
+# 页级缓存：修订版PDF中内容未变的页面复用之前提取的文本和图片。默认关闭，开启后每次转换都要
+# 计算各页哈希；使用单独的目录和容量上限，页级条目不挤占整份文档的转换结果
+PAGE_CACHE_ENABLED = os.environ.get("PDF2MD_PAGE_CACHE", "0") != "0"
+PAGE_CACHE_FOLDER = os.path.abspath(os.environ.get("PDF2MD_PAGE_CACHE_DIR", "page_cache"))
+PAGE_CACHE_MEMORY_LIMIT = int(os.environ.get("PDF2MD_PAGE_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+PAGE_CACHE_DISK_LIMIT = int(os.environ.get("PDF2MD_PAGE_CACHE_DISK_BYTES", 1024 * 1024 * 1024))
+
+page_cache = (ConversionCache(PAGE_CACHE_FOLDER, PAGE_CACHE_MEMORY_LIMIT, PAGE_CACHE_DISK_LIMIT)
+              if PAGE_CACHE_ENABLED else None)
+
+# 页面渲染结果缓存：页面预览和裁剪图片导出共用，单独的目录和容量上限，不挤占转换结果缓存
+RASTER_CACHE_FOLDER = os.path.abspath(os.environ.get("PDF2MD_RASTER_CACHE_DIR", "raster_cache"))
+RASTER_CACHE_MEMORY_LIMIT = int(os.environ.get("PDF2MD_RASTER_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+RASTER_CACHE_DISK_LIMIT = int(os.environ.get("PDF2MD_RASTER_CACHE_DISK_BYTES", 1024 * 1024 * 1024))
+
+raster_cache = ConversionCache(RASTER_CACHE_FOLDER, RASTER_CACHE_MEMORY_LIMIT, RASTER_CACHE_DISK_LIMIT)
+
+# 页面预览缩放比例的取值范围（1 表示 72 DPI）
+PREVIEW_SCALE_RANGE = (0.1, 8.0)
+
+# 流式生成的裁剪图片ZIP不超过该大小（字节）时才写入缓存，避免为缓存在内存中攒下整个大文件
+STREAM_CACHE_MAX_BYTES = int(os.environ.get("PDF2MD_STREAM_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+
+# 图片响应的浏览器缓存时间（秒）；图片文件名含任务ID，内容不会变化
+IMAGE_CACHE_MAX_AGE = int(os.environ.get("PDF2MD_IMAGE_CACHE_MAX_AGE", 7 * 24 * 3600))
+
+# 文件名 -> 路径 的图片索引，替代每次请求遍历临时目录
+image_index = ImageIndex(TEMP_UPLOAD_FOLDER)
+
+# 临时文件生命周期：任务目录自最近访问起的保留时间（秒）、总大小上限（字节）和后台清理间隔（秒）
+STORAGE_TTL = int(os.environ.get("PDF2MD_STORAGE_TTL", 24 * 3600))
+STORAGE_QUOTA_BYTES = int(os.environ.get("PDF2MD_STORAGE_QUOTA_BYTES", 5 * 1024 * 1024 * 1024))
+STORAGE_REAP_INTERVAL = int(os.environ.get("PDF2MD_STORAGE_REAP_INTERVAL", 60))
+
+storage_manager = StorageManager(TEMP_UPLOAD_FOLDER, STORAGE_TTL, STORAGE_QUOTA_BYTES, STORAGE_REAP_INTERVAL,
+                                 on_remove=image_index.forget_job)
+
+def page_counts(result):
+    """转换结果中的页级缓存计数（pages_reused、pages_recomputed），未使用页级缓存时为空字典"""
+    return {key: result[key] for key in ("pages_reused", "pages_recomputed") if key in result}
+
+def cached_page_counts(cached_result):
+    """整份文档命中转换缓存时，所有页面都算作复用"""
+    counts = page_counts(cached_result)
+    if counts:
+        counts = {"pages_reused": counts["pages_reused"] + counts["pages_recomputed"], "pages_recomputed": 0}
+    return counts
+
+def uploaded_pdf_hash(pdf_path):
+    """
+    已上传PDF的内容哈希：上传时写入同目录的 .sha256 文件，缺失时重新计算并写入
+    
+    返回:
+        str: 十六进制摘要
+    """
+    hash_path = f"{pdf_path}.sha256"
+    try:
+        with open(hash_path, "r", encoding="ascii") as f:
+            content_hash = f.read().strip()
+        if len(content_hash) == 64:
+            return content_hash
+    except (OSError, UnicodeDecodeError):
+        pass
+    
+    with open(pdf_path, "rb") as f:
+        content_hash = hash_stream(f)
+    with open(hash_path, "w", encoding="ascii") as f:
+        f.write(content_hash)
+    return content_hash
+
+def get_cached_markdown(cache_key):
+    """
+    读取缓存的Markdown转换结果，若引用的图片文件已不存在则视为未命中
+    
+    图片仍存放在首次转换的任务目录中，命中时先记录一次访问，
+    避免这些目录在客户端取回图片之前被清理。
+    """
+    cached = conversion_cache.get(cache_key)
+    if cached is None:
+        return None
+    
+    result = json.loads(cached.decode("utf-8"))
+    for job_id in {img.get("filename", "")[:36] for img in result.get("images", [])}:
+        storage_manager.touch(job_id)
+    for img in result.get("images", []):
+        if not os.path.exists(img.get("path", "")):
+            conversion_cache.invalidate(cache_key)
+            return None
+    return result
+
+def validate_pdf_upload():
+    """
+    校验请求中上传的PDF：file 字段存在、文件名非空、类型为PDF、大小不超过 MAX_CONTENT_LENGTH
     
-    # 检查是否有文件在请求中
+    返回:
+        tuple: (上传文件, 错误响应)，校验通过时错误响应为None
+    """
     if 'file' not in request.files:
-        return jsonify({
+        return None, (jsonify({
             "status": "error",
             "message": "未找到文件。请确保使用'file'字段上传PDF文件。"
-        }), 400
+        }), 400)
     
     file = request.files['file']
     
-    # 检查文件名是否为空
     if file.filename == '':
-        return jsonify({
+        return None, (jsonify({
             "status": "error",
             "message": "未选择文件。"
-        }), 400
+        }), 400)
     
-    # 检查文件类型
     if not file.filename.lower().endswith('.pdf') or file.mimetype != 'application/pdf':
-        return jsonify({
+        return None, (jsonify({
             "status": "error",
             "message": "无效的文件类型。只接受PDF文件。"
-        }), 415
+        }), 415)
     
-    # 检查文件大小
     content_length = request.content_length
     if content_length and content_length > MAX_CONTENT_LENGTH:
-        return jsonify({
+        return None, (jsonify({
             "status": "error",
-            "message": f"文件大小超过50MB限制。"
-        }), 413
+            "message": f"文件大小超过{MAX_CONTENT_LENGTH // (1024 * 1024)}MB限制。"
+        }), 413)
     
-    # 确保临时目录存在
-    temp_dir = ensure_temp_dir_exists()
+    return file, None
+
+@main_bp.route('/health', methods=['GET'])
+def health_check():
+    """健康检查端点，返回200 OK状态和简单的JSON响应"""
+    return jsonify({
+        "status": "ok",
+        "message": "后端正在运行"
+    }), 200
+
+@main_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus 格式的指标：各端点和各转换阶段的耗时直方图、进行中的转换数和任务数"""
+    for status, count in job_manager.stats()["jobs"].items():
+        JOBS.set(count, status=status)
+    storage = storage_manager.stats()
+    STORAGE_BYTES.set(storage["bytes"])
+    STORAGE_JOBS.set(storage["jobs"])
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@main_bp.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    """返回转换结果缓存、页级缓存（开启时）和页面渲染结果缓存的命中、未命中和淘汰统计"""
+    return jsonify({
+        "status": "ok",
+        "cache": conversion_cache.stats(),
+        "pages": page_cache.stats() if page_cache is not None else None,
+        "rasters": raster_cache.stats()
+    }), 200
+
+@main_bp.route('/api/storage/stats', methods=['GET'])
+def storage_stats():
+    """返回临时文件的当前占用、配额和清理统计"""
+    return jsonify({
+        "status": "ok",
+        "storage": storage_manager.stats()
+    }), 200
+
+@main_bp.route('/api/upload_pdf', methods=['POST'])
+def upload_pdf():
+    """PDF上传和验证端点"""
     
-    # 生成安全的文件名并保存文件
+    file, upload_error = validate_pdf_upload()
+    if upload_error:
+        return upload_error
+    
+    # 生成安全的文件名并保存到任务目录
     filename = secure_filename(file.filename)
     temp_file_id = str(uuid.uuid4())
+    temp_dir = job_dir(ensure_temp_dir_exists(), temp_file_id)
     temp_filepath = os.path.join(temp_dir, f"{temp_file_id}_{filename}")
     
+    # 内容哈希供页面预览查找渲染结果缓存，上传时顺便算好
+    content_hash = hash_stream(file.stream)
     file.save(temp_filepath)
+    with open(f"{temp_filepath}.sha256", "w", encoding="ascii") as f:
+        f.write(content_hash)
+    storage_manager.track(temp_file_id)
     
     return jsonify({
         "status": "success",
@@ -87,73 +268,72 @@ def upload_pdf():
     }), 201
 
 @main_bp.route('/api/convert_pdf_to_md', methods=['POST'])
+@counts_in_flight
 def convert_pdf_to_md():
     """PDF到Markdown转换端点"""
     
-    # 使用与upload_pdf相同的验证逻辑
-    if 'file' not in request.files:
-        return jsonify({
-            "status": "error",
-            "message": "未找到文件。请确保使用'file'字段上传PDF文件。"
-        }), 400
-    
-    file = request.files['file']
+    file, upload_error = validate_pdf_upload()
+    if upload_error:
+        return upload_error
     
-    if file.filename == '':
+    pages, pages_error = parse_pages(request.form.get('pages'))
+    if pages_error:
         return jsonify({
             "status": "error",
-            "message": "未选择文件。"
+            "message": pages_error
         }), 400
     
-    if not file.filename.lower().endswith('.pdf') or file.mimetype != 'application/pdf':
-        return jsonify({
-            "status": "error",
-            "message": "无效的文件类型。只接受PDF文件。"
-        }), 415
-    
-    content_length = request.content_length
-    if content_length and content_length > MAX_CONTENT_LENGTH:
-        return jsonify({
-            "status": "error",
-            "message": f"文件大小超过50MB限制。"
-        }), 413
+    page_error = check_page_selection(file, pages)
+    if page_error:
+        return page_error
     
     try:
-        # 确保临时目录存在
-        temp_dir = ensure_temp_dir_exists()
-        
-        # 保存上传的文件到临时目录
         filename = secure_filename(file.filename)
-        temp_file_id = str(uuid.uuid4())
-        temp_filepath = os.path.join(temp_dir, f"{temp_file_id}_{filename}")
-        
-        print(f"保存文件到: {temp_filepath}")
-        print(f"TEMP_UPLOAD_FOLDER: {TEMP_UPLOAD_FOLDER}")
-        print(f"当前工作目录: {os.getcwd()}")
-        
-        file.save(temp_filepath)
         
-        # 验证文件是否成功保存
-        if not os.path.exists(temp_filepath):
-            raise FileNotFoundError(f"文件保存失败: {temp_filepath}")
+        # 相同内容、相同文件名的PDF直接返回缓存结果（图片文件名中包含上传的文件名）
+        cache_options = {"image_mode": IMAGE_EXTRACTION_MODE, "filename": filename}
+        if pages:
+            cache_options["pages"] = pages
+        cache_key = make_cache_key(hash_stream(file.stream), "markdown", cache_options)
+        cached_result = get_cached_markdown(cache_key)
+        if cached_result is not None:
+            extracted_images = cached_result.get("images", [])
+            image_index.register_images(extracted_images)
+            return jsonify({
+                "status": "success",
+                "message": "PDF成功转换为Markdown。",
+                "filename": filename,
+                "markdown_content": cached_result.get("markdown_content", ""),
+                "images": extracted_images,
+                "image_count": len(extracted_images),
+                "deduplicated_images": cached_result.get("deduplicated_images", 0),
+                **cached_page_counts(cached_result),
+                "cached": True
+            }), 200
         
-        print(f"文件保存成功，大小: {os.path.getsize(temp_filepath)} bytes")
+        # 图片提取到该任务的临时目录；PDF本身直接从上传缓冲区打开，不写入磁盘
+        temp_file_id = str(uuid.uuid4())
+        temp_dir = job_dir(ensure_temp_dir_exists(), temp_file_id)
+        temp_filepath = os.path.join(temp_dir, f"{temp_file_id}_{filename}")
         
         # 转换PDF到Markdown（包含图片提取）
-        # 使用绝对路径确保路径正确
-        abs_temp_filepath = os.path.abspath(temp_filepath)
-        print(f"转换文件绝对路径: {abs_temp_filepath}")
-        conversion_result = pdf_to_markdown(abs_temp_filepath)
-        
-        # 转换完成后删除临时PDF文件（但保留提取的图片）
-        if os.path.exists(abs_temp_filepath):
-            os.remove(abs_temp_filepath)
-            print(f"已删除临时文件: {abs_temp_filepath}")
+        with storage_manager.using(temp_file_id), open_upload_buffer(file) as pdf_data:
+            conversion_result = pdf_to_markdown(temp_filepath, pdf_data=pdf_data, pages=pages,
+                                                page_cache=page_cache)
         
         # 检查转换结果格式
+        if isinstance(conversion_result, dict) and conversion_result.get("error"):
+            # 出错时 pdf_to_markdown 把错误信息放在 markdown_content 中，不作为文档返回
+            return jsonify({
+                "status": "error",
+                "message": conversion_result.get("markdown_content", "转换过程中出错")
+            }), 500
+        
         if isinstance(conversion_result, dict):
             markdown_content = conversion_result.get("markdown_content", "")
             extracted_images = conversion_result.get("images", [])
+            image_index.register_images(extracted_images)
+            conversion_cache.put(cache_key, json.dumps(conversion_result, ensure_ascii=False).encode("utf-8"))
             
             return jsonify({
                 "status": "success",
@@ -161,7 +341,10 @@ def convert_pdf_to_md():
                 "filename": filename,
                 "markdown_content": markdown_content,
                 "images": extracted_images,
-                "image_count": len(extracted_images)
+                "image_count": len(extracted_images),
+                "deduplicated_images": conversion_result.get("deduplicated_images", 0),
+                **page_counts(conversion_result),
+                "cached": False
             }), 200
         else:
             # 兼容旧格式（如果返回的是字符串）
@@ -175,32 +358,331 @@ def convert_pdf_to_md():
             }), 200
         
     except Exception as e:
-        # 确保即使在出错时也删除临时文件
-        if 'abs_temp_filepath' in locals() and os.path.exists(abs_temp_filepath):
-            os.remove(abs_temp_filepath)
-            print(f"错误时删除临时文件: {abs_temp_filepath}")
-        elif 'temp_filepath' in locals() and os.path.exists(temp_filepath):
-            os.remove(temp_filepath)
-            print(f"错误时删除临时文件: {temp_filepath}")
-        
-        print(f"转换错误详情: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("转换过程中出错")
         
         return jsonify({
             "status": "error",
             "message": f"转换过程中出错：{str(e)}"
         }), 500
 
+def stream_markdown_records(pdf_path, stream_format, pdf_data=None, file_id=None):
+    """
+    将逐页转换记录编码为NDJSON或SSE文本，转换结束后删除临时PDF文件（如有）
+    """
+    try:
+        with storage_manager.using(file_id):
+            for record in iter_pdf_to_markdown(pdf_path, pdf_data):
+                if record["type"] == "page":
+                    image_index.register_images(record["images"])
+                payload = json.dumps(record, ensure_ascii=False)
+                if stream_format == "sse":
+                    yield f"event: {record['type']}\ndata: {payload}\n\n"
+                else:
+                    yield payload + "\n"
+    finally:
+        if os.path.exists(pdf_path):
+            os.remove(pdf_path)
+            logger.debug("已删除临时文件", extra={"path": pdf_path})
+
+@main_bp.route('/api/convert_pdf_to_md/stream', methods=['POST'])
+@counts_in_flight
+def convert_pdf_to_md_stream():
+    """
+    PDF到Markdown的流式转换端点，每转换完一页立即返回该页记录
+    
+    通过表单字段 format=sse 或请求头 Accept: text/event-stream 选择SSE格式，
+    默认返回NDJSON（每行一个JSON对象）。
+    """
+    
+    file, upload_error = validate_pdf_upload()
+    if upload_error:
+        return upload_error
+    
+    stream_format = request.form.get('format', 'ndjson').lower()
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        stream_format = 'sse'
+    
+    # 上传内容必须在开始流式响应之前取出，之后请求体将不可再读；
+    # 不超过内存阈值时复制到内存，否则保存到任务目录
+    filename = secure_filename(file.filename)
+    temp_file_id = str(uuid.uuid4())
+    temp_dir = job_dir(ensure_temp_dir_exists(), temp_file_id)
+    temp_filepath = os.path.join(temp_dir, f"{temp_file_id}_{filename}")
+    pdf_data = None
+    if upload_size(file) <= UPLOAD_MEMORY_LIMIT:
+        pdf_data = file.read()
+    else:
+        file.save(temp_filepath)
+    # 先登记任务目录，即使客户端在开始接收前断开，目录也会被按期清理
+    storage_manager.track(temp_file_id)
+    
+    if stream_format == 'sse':
+        mimetype = 'text/event-stream'
+    else:
+        mimetype = 'application/x-ndjson'
+    
+    response = Response(stream_markdown_records(temp_filepath, stream_format, pdf_data, temp_file_id),
+                        mimetype=mimetype)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # 禁止Nginx缓冲，确保逐页到达客户端
+    return response
+
+def find_uploaded_pdf(file_id):
+    """
+    根据 /api/upload_pdf 返回的 file_id 查找已上传的PDF文件
+    
+    返回:
+        str: 文件路径，未找到返回None
+    """
+    if not JOB_ID_PATTERN.match(file_id):
+        return None
+    directory = job_dir(TEMP_UPLOAD_FOLDER, file_id, create=False)
+    if not os.path.isdir(directory):
+        return None
+    for name in os.listdir(directory):
+        if name.startswith(f"{file_id}_") and name.lower().endswith('.pdf'):
+            return os.path.join(directory, name)
+    return None
+
+def encode_cursor(state):
+    """将分段转换的状态编码为不透明的游标字符串"""
+    raw = json.dumps(state, separators=(',', ':')).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor):
+    """
+    解码游标
+    
+    返回:
+        dict: 游标状态，游标无效时返回None
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        state = json.loads(raw.decode("utf-8"))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(state, dict) or not isinstance(state.get("start"), int):
+        return None
+    return state
+
+@main_bp.route('/api/files/<file_id>/markdown', methods=['GET'])
+@counts_in_flight
+def paginated_markdown(file_id):
+    """
+    分段转换已上传PDF（见 /api/upload_pdf）的Markdown端点，每次只转换接下来的 limit 页
+    
+    查询参数:
+        pages: 页面选择表达式，如 "1-10,25,40-"，仅在首次请求时使用
+        limit: 本次转换的页数
+        cursor: 上一次响应中的 next_cursor，游标中保存了下一段位置、页面选择和标题判定基准
+    """
+    pdf_path = find_uploaded_pdf(file_id)
+    if pdf_path is None:
+        return jsonify({
+            "status": "error",
+            "message": "文件不存在或已过期。请先通过 /api/upload_pdf 上传。"
+        }), 404
+    
+    try:
+        limit = int(request.args.get('limit', CHUNK_PAGES))
+    except ValueError:
+        limit = 0
+    if limit < 1 or limit > CHUNK_MAX_PAGES:
+        return jsonify({
+            "status": "error",
+            "message": f"limit 必须在 1 到 {CHUNK_MAX_PAGES} 之间。"
+        }), 400
+    
+    cursor = request.args.get('cursor')
+    if cursor:
+        state = decode_cursor(cursor)
+        if state is None or state.get("file_id") != file_id:
+            return jsonify({
+                "status": "error",
+                "message": "无效的游标。"
+            }), 400
+    else:
+        pages, pages_error = parse_pages(request.args.get('pages'))
+        if pages_error:
+            return jsonify({
+                "status": "error",
+                "message": pages_error
+            }), 400
+        state = {"file_id": file_id, "start": 0, "pages": pages, "avg_font_size": None}
+    
+    with storage_manager.using(file_id):
+        result = pdf_to_markdown_chunk(pdf_path, state["start"], limit, state.get("pages"),
+                                       state.get("avg_font_size"))
+    if result["status"] != "success":
+        return jsonify({
+            "status": "error",
+            "message": result["message"]
+        }), 400
+    
+    image_index.register_images(result["images"])
+    
+    next_cursor = None
+    if result["next_start"] is not None:
+        next_cursor = encode_cursor({
+            "file_id": file_id,
+            "start": result["next_start"],
+            "pages": state.get("pages"),
+            "avg_font_size": result["avg_font_size"]
+        })
+    
+    return jsonify({
+        "status": "success",
+        "message": result["message"],
+        "file_id": file_id,
+        "pages": result["pages"],
+        "page_count": result["page_count"],
+        "selected_count": result["selected_count"],
+        "markdown_content": result["markdown_content"],
+        "images": result["images"],
+        "image_count": len(result["images"]),
+        "deduplicated_images": result["deduplicated_images"],
+        "next_cursor": next_cursor,
+        "has_more": next_cursor is not None
+    }), 200
+
+def parse_preview_options(args):
+    """
+    校验页面预览的查询参数：scale、clip（"x0,y0,x1,y1"，PDF坐标）、crop、format 和 quality
+    
+    返回:
+        tuple: (预览参数字典, 错误信息)，参数有效时错误信息为None
+    """
+    low, high = PREVIEW_SCALE_RANGE
+    try:
+        scale = float(args.get('scale', 1))
+    except ValueError:
+        return None, "scale 必须是数字。"
+    if not low <= scale <= high:
+        return None, f"scale 必须在 {low} 到 {high} 之间。"
+    
+    clip = None
+    clip_text = args.get('clip')
+    if clip_text:
+        try:
+            clip = tuple(float(value) for value in clip_text.split(','))
+        except ValueError:
+            clip = ()
+        if len(clip) != 4 or clip[0] >= clip[2] or clip[1] >= clip[3]:
+            return None, "clip 必须是 x0,y0,x1,y1 形式的矩形（x0 < x1，y0 < y1）。"
+    
+    image_format = args.get('format', 'png').strip().lower()
+    if image_format == 'jpg':
+        image_format = 'jpeg'
+    if image_format not in CROP_IMAGE_FORMATS:
+        return None, f"不支持的图片格式: {image_format}。可选: {', '.join(CROP_IMAGE_FORMATS)}"
+    
+    quality = normalize_render_options()["quality"]
+    if args.get('quality'):
+        try:
+            quality = int(args['quality'])
+        except ValueError:
+            return None, "quality 必须是整数。"
+        if not 1 <= quality <= 100:
+            return None, "quality 必须在 1 到 100 之间。"
+    
+    return {
+        "scale": scale,
+        "clip": clip,
+        "crop": args.get('crop', '').lower() in ('1', 'true', 'yes'),
+        "image_format": image_format,
+        "quality": quality
+    }, None
+
+@main_bp.route('/api/files/<file_id>/pages/<int:page>/preview', methods=['GET'])
+@counts_in_flight
+def page_preview(file_id, page):
+    """
+    渲染已上传PDF（见 /api/upload_pdf）单个页面或页面区域的预览图片
+    
+    查询参数:
+        scale: 缩放比例，1 表示 72 DPI，默认 1
+        clip: 渲染区域 "x0,y0,x1,y1"（PDF坐标），默认整页
+        crop: 为 1 时渲染裁剪图片导出的3:4区域（忽略 clip），scale 对应导出的 dpi = scale × 72
+        format: png（默认）、jpeg 或 webp
+        quality: JPEG/WebP 质量（1-100）
+    
+    渲染结果存入页面渲染结果缓存，重复预览和之后的裁剪图片导出直接复用；
+    响应头 X-Raster-Cache 为 hit 或 miss。同一文件同一参数的图片不会变化，支持条件请求（304）。
+    """
+    pdf_path = find_uploaded_pdf(file_id)
+    if pdf_path is None:
+        return jsonify({
+            "status": "error",
+            "message": "文件不存在或已过期。请先通过 /api/upload_pdf 上传。"
+        }), 404
+    
+    options, options_error = parse_preview_options(request.args)
+    if options_error:
+        return jsonify({
+            "status": "error",
+            "message": options_error
+        }), 400
+    
+    try:
+        with storage_manager.using(file_id):
+            content_hash = uploaded_pdf_hash(pdf_path)
+            etag = make_cache_key(content_hash, "preview", {"page": page, **options})
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                result = render_page_preview(pdf_path, page, rasters=RasterCache(raster_cache, content_hash),
+                                             **options)
+                if result["status"] != "success":
+                    return jsonify({
+                        "status": "error",
+                        "message": result["message"]
+                    }), 500
+                response = Response(result["data"], mimetype=f"image/{result['format']}")
+                response.headers['X-Raster-Cache'] = 'hit' if result["cached"] else 'miss'
+    
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+    
+    except Exception as e:
+        error_msg = f"渲染预览时出错: {str(e)}"
+        logger.exception(error_msg)
+        return jsonify({
+            "status": "error",
+            "message": error_msg
+        }), 500
+    
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = IMAGE_CACHE_MAX_AGE
+    return response
+
 @main_bp.route('/api/images/<path:filename>', methods=['GET'])
 def serve_image(filename):
-    """提供提取的图片文件"""
+    """
+    提供提取的图片文件
+    
+    通过图片索引直接定位文件；响应带强ETag和Cache-Control，
+    支持条件请求（304）和Range请求（206），启用 USE_X_SENDFILE 时由前端服务器发送文件。
+    """
     try:
         # 查找图片文件
-        for root, dirs, files in os.walk(TEMP_UPLOAD_FOLDER):
-            if filename in files:
-                file_path = os.path.join(root, filename)
-                return send_file(file_path, as_attachment=False)
+        file_path = image_index.lookup(filename)
+        if file_path is not None:
+            # 文件名以任务ID开头，访问时延后该任务目录的过期时间
+            storage_manager.touch(filename[:36])
+            response = send_file(
+                file_path,
+                as_attachment=False,
+                etag=image_index.etag(file_path),
+                conditional=True,
+                max_age=IMAGE_CACHE_MAX_AGE
+            )
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+            return response
         
         return jsonify({
             "status": "error",
@@ -213,9 +695,80 @@ def serve_image(filename):
             "message": f"获取图片时出错：{str(e)}"
         }), 500
 
+def attachment_headers(download_name):
+    """
+    生成附件下载的Content-Disposition响应头，非ASCII文件名按RFC 5987编码
+    （与 send_file 的处理方式一致，用于不经过 send_file 的流式响应）
+    """
+    headers = Headers()
+    try:
+        download_name.encode("ascii")
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize("NFKD", download_name).encode("ascii", "ignore").decode("ascii")
+        quoted = quote(download_name, safe="!#$&+^`|~")
+        headers.set("Content-Disposition", "attachment", filename=simple, **{"filename*": f"UTF-8''{quoted}"})
+    else:
+        headers.set("Content-Disposition", "attachment", filename=download_name)
+    return headers
+
+def resolve_package_image(img):
+    """
+    定位要打包的图片文件：优先使用图片索引，其次使用请求中给出的路径
+    （仅限临时目录内的路径）
+    """
+    path = image_index.lookup(img['filename'])
+    if path is not None:
+        return path
+    
+    client_path = img.get('path')
+    if client_path:
+        real_path = os.path.realpath(client_path)
+        if real_path.startswith(TEMP_UPLOAD_FOLDER + os.sep) and os.path.isfile(real_path):
+            return real_path
+    return None
+
+def iter_package_entries(md_filename, markdown_content, images):
+    """
+    按顺序产出ZIP包条目：Markdown文件、各图片文件，以及未找到图片的说明文件
+    """
+    yield {"arcname": md_filename, "data": markdown_content}
+    
+    image_count = 0
+    missing_images = []
+    added_filenames = set()
+    
+    for img in images:
+        # 去重后的图片条目引用同一个文件，只需打包一次
+        if img['filename'] in added_filenames:
+            continue
+        added_filenames.add(img['filename'])
+        
+        img_path = resolve_package_image(img)
+        if img_path is None:
+            missing_images.append(img['filename'])
+            logger.warning("未找到图片", extra={"image": img['filename']})
+            continue
+        
+        image_count += 1
+        yield {"arcname": img['filename'], "path": img_path}
+    
+    # 如果有未找到的图片，添加一个说明文件
+    if missing_images:
+        missing_text = "以下图片未能在系统中找到，可能需要重新转换PDF：\n\n"
+        for img_name in missing_images:
+            missing_text += f"- {img_name}\n"
+        yield {"arcname": "missing_images.txt", "data": missing_text}
+    
+    logger.info("ZIP包已创建", extra={"image_count": image_count, "missing_images": len(missing_images)})
+
 @main_bp.route('/api/create_package', methods=['POST'])
 def create_package():
-    """创建包含Markdown和图片的ZIP包"""
+    """
+    创建包含Markdown和图片的ZIP包
+    
+    ZIP内容边生成边发送给客户端，已压缩的图片直接存储不再deflate，
+    峰值内存与包大小无关。
+    """
     try:
         # 从请求中获取markdown内容和图片信息
         data = request.json
@@ -229,69 +782,18 @@ def create_package():
         images = data['images']
         filename = data.get('filename', 'converted')
         
-        # 确保临时目录存在
-        temp_dir = ensure_temp_dir_exists()
-        
-        # 创建内存中的ZIP文件
-        memory_file = io.BytesIO()
-        with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-            # 添加Markdown文件
-            md_filename = f"{filename.replace('.pdf', '')}.md"
-            zf.writestr(md_filename, markdown_content)
-            
-            # 添加图片文件
-            image_count = 0
-            missing_images = []
-            
-            for img in images:
-                found = False
-                
-                # 尝试直接使用图片路径（如果存在）
-                if 'path' in img and os.path.exists(img['path']):
-                    zf.write(img['path'], arcname=img['filename'])
-                    found = True
-                    image_count += 1
-                    print(f"已添加图片(直接路径): {img['path']} -> {img['filename']}")
-                    continue
-                
-                # 在临时目录中查找图片
-                for root, dirs, files in os.walk(temp_dir):
-                    if img['filename'] in files:
-                        img_path = os.path.join(root, img['filename'])
-                        zf.write(img_path, arcname=img['filename'])
-                        found = True
-                        image_count += 1
-                        print(f"已添加图片(查找): {img_path} -> {img['filename']}")
-                        break
-                
-                if not found:
-                    missing_images.append(img['filename'])
-                    print(f"未找到图片: {img['filename']}")
-            
-            # 如果有未找到的图片，添加一个说明文件
-            if missing_images:
-                missing_text = "以下图片未能在系统中找到，可能需要重新转换PDF：\n\n"
-                for img_name in missing_images:
-                    missing_text += f"- {img_name}\n"
-                zf.writestr("missing_images.txt", missing_text)
-        
-        # 准备响应
-        memory_file.seek(0)
+        md_filename = f"{filename.replace('.pdf', '')}.md"
         package_filename = f"{filename.replace('.pdf', '')}_package.zip"
         
-        print(f"ZIP包已创建，总计 {image_count} 张图片，{len(missing_images)} 张图片未找到")
-        
-        return send_file(
-            memory_file,
+        entries = iter_package_entries(md_filename, markdown_content, images)
+        return Response(
+            iter_zip_stream(entries),
             mimetype='application/zip',
-            as_attachment=True,
-            download_name=package_filename
+            headers=attachment_headers(package_filename)
         )
         
     except Exception as e:
-        print(f"创建ZIP包时出错: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("创建ZIP包时出错")
         
         return jsonify({
             "status": "error",
@@ -299,68 +801,75 @@ def create_package():
         }), 500
 
 @main_bp.route('/api/convert_pdf_to_word', methods=['POST'])
+@counts_in_flight
 def convert_pdf_to_word():
     """PDF到Word转换端点"""
     
-    # 使用与convert_pdf_to_md相同的验证逻辑
-    if 'file' not in request.files:
-        return jsonify({
-            "status": "error",
-            "message": "未找到文件。请确保使用'file'字段上传PDF文件。"
-        }), 400
-    
-    file = request.files['file']
+    file, upload_error = validate_pdf_upload()
+    if upload_error:
+        return upload_error
     
-    # 检查文件名是否为空
-    if file.filename == '':
+    pages, pages_error = parse_pages(request.form.get('pages'))
+    if pages_error:
         return jsonify({
             "status": "error",
-            "message": "未选择文件。"
+            "message": pages_error
         }), 400
     
-    # 检查文件类型
-    if not file.filename.lower().endswith('.pdf') or file.mimetype != 'application/pdf':
-        return jsonify({
-            "status": "error",
-            "message": "无效的文件类型。只接受PDF文件。"
-        }), 415
-    
-    # 检查文件大小
-    content_length = request.content_length
-    if content_length and content_length > MAX_CONTENT_LENGTH:
-        return jsonify({
-            "status": "error",
-            "message": f"文件大小超过50MB限制。"
-        }), 413
-    
-    # 确保临时目录存在
-    temp_dir = ensure_temp_dir_exists()
+    page_error = check_page_selection(file, pages)
+    if page_error:
+        return page_error
     
-    # 生成安全的文件名并保存文件
+    # 生成安全的文件名，文件保存在该任务的临时目录中
     filename = secure_filename(file.filename)
+    base_filename = os.path.splitext(filename)[0]
     temp_file_id = str(uuid.uuid4())
+    temp_dir = job_dir(ensure_temp_dir_exists(), temp_file_id, create=False)
     temp_filepath = os.path.join(temp_dir, f"{temp_file_id}_{filename}")
     
     try:
-        # 保存上传的文件
-        file.save(temp_filepath)
+        # 相同内容、相同文件名的PDF直接返回缓存的Word文档（文档标题为上传的文件名）
+        cache_options = {"image_mode": IMAGE_EXTRACTION_MODE, "filename": filename}
+        if pages:
+            cache_options["pages"] = pages
+        cache_key = make_cache_key(hash_stream(file.stream), "word", cache_options)
+        cached_word = get_cached_word(cache_key)
+        if cached_word is not None:
+            word_stats, cached_docx = cached_word
+            response = send_file(
+                io.BytesIO(cached_docx),
+                mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+                as_attachment=True,
+                download_name=f"{base_filename}.docx"
+            )
+            set_word_headers(response, {**word_stats, **cached_page_counts(word_stats)})
+            return response
+        
+        # PDF直接从上传缓冲区打开，任务目录只存放提取的图片和生成的文档
+        os.makedirs(temp_dir, exist_ok=True)
         
         # 生成Word文档输出路径
-        base_filename = os.path.splitext(filename)[0]
         word_filename = f"{temp_file_id}_{base_filename}.docx"
         word_filepath = os.path.join(temp_dir, word_filename)
         
         # 调用转换函数
-        result = pdf_to_word(temp_filepath, word_filepath)
+        with storage_manager.using(temp_file_id), open_upload_buffer(file) as pdf_data:
+            result = pdf_to_word(temp_filepath, word_filepath, pdf_data=pdf_data, pages=pages,
+                                 page_cache=page_cache)
         
         if result["status"] == "success":
+            with open(result["word_path"], "rb") as f:
+                put_cached_word(cache_key, result, f.read())
+            
             # 转换成功，返回文件下载
-            return send_file(
+            response = send_file(
                 result["word_path"],
                 mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
                 as_attachment=True,
                 download_name=f"{base_filename}.docx"
             )
+            set_word_headers(response, result)
+            return response
         else:
             # 转换失败
             return jsonify({
@@ -371,116 +880,509 @@ def convert_pdf_to_word():
     except Exception as e:
         # 处理异常
         error_msg = f"转换过程中出错: {str(e)}"
-        print(error_msg)
+        logger.exception(error_msg)
         
         return jsonify({
             "status": "error",
             "message": error_msg
         }), 500
+
+def put_cached_word(cache_key, result, docx):
+    """
+    缓存Word文档：第一行为响应头所需的统计（JSON），其后为文档内容
     
-    finally:
-        # 清理临时文件
-        try:
-            if os.path.exists(temp_filepath):
-                os.remove(temp_filepath)
-                print(f"已删除临时PDF文件: {temp_filepath}")
-        except Exception as e:
-            print(f"删除临时PDF文件时出错: {str(e)}")
+    参数:
+        result (dict): pdf_to_word 的返回值
+        docx (bytes): 文档内容
+    """
+    word_stats = {"deduplicated_images": result.get("deduplicated_images", 0), **page_counts(result)}
+    conversion_cache.put(cache_key, json.dumps(word_stats).encode("utf-8") + b"\n" + docx)
+
+def get_cached_word(cache_key):
+    """
+    读取 put_cached_word 缓存的Word文档
+    
+    返回:
+        tuple: (统计字典, 文档内容)，未命中或缓存条目格式无效时返回None
+    """
+    cached = conversion_cache.get(cache_key)
+    if cached is None:
+        return None
+    header, _, docx = cached.partition(b"\n")
+    try:
+        word_stats = json.loads(header.decode("utf-8"))
+    except ValueError:
+        conversion_cache.invalidate(cache_key)
+        return None
+    return word_stats, docx
+
+def set_word_headers(response, word_stats):
+    """设置Word响应的统计头：X-Deduplicated-Images，使用页级缓存时还有 X-Pages-Reused 和 X-Pages-Recomputed"""
+    response.headers['X-Deduplicated-Images'] = str(word_stats.get("deduplicated_images", 0))
+    if "pages_reused" in word_stats:
+        response.headers['X-Pages-Reused'] = str(word_stats["pages_reused"])
+        response.headers['X-Pages-Recomputed'] = str(word_stats["pages_recomputed"])
 
 @main_bp.route('/api/convert_pdf_to_images', methods=['POST'])
+@counts_in_flight
 def convert_pdf_to_images():
     """PDF转裁剪图片端点"""
     
-    # 检查是否有文件在请求中
-    if 'file' not in request.files:
+    file, upload_error = validate_pdf_upload()
+    if upload_error:
+        return upload_error
+    
+    pages, pages_error = parse_pages(request.form.get('pages'))
+    if pages_error:
         return jsonify({
             "status": "error",
-            "message": "未找到文件。请确保使用'file'字段上传PDF文件。"
+            "message": pages_error
         }), 400
     
-    file = request.files['file']
+    render_options, render_error = parse_render_options(request.form)
+    if render_error:
+        return jsonify({
+            "status": "error",
+            "message": render_error
+        }), 400
     
-    # 检查文件名是否为空
-    if file.filename == '':
+    original_filename = secure_filename(file.filename)
+    base_filename = os.path.splitext(original_filename)[0]
+    download_name = f"{base_filename}_cropped_images.zip"
+    
+    try:
+        # 相同内容的PDF直接返回缓存的ZIP包
+        content_hash = hash_stream(file.stream)
+        cache_key = make_cache_key(content_hash, "images",
+                                   {"pages": pages, "render": normalize_render_options(render_options)})
+        cached_zip = conversion_cache.get(cache_key)
+        if cached_zip is not None:
+            return send_file(
+                io.BytesIO(cached_zip),
+                mimetype='application/zip',
+                as_attachment=True,
+                download_name=download_name
+            )
+        
+        # 开始流式响应前先检查PDF能否打开、所选页面是否有效，出错时仍可返回错误状态码
+        with open_upload_buffer(file) as pdf_data:
+            doc = open_pdf(None, pdf_data)
+            try:
+                if doc.page_count == 0:
+                    raise ValueError("PDF文件为空")
+                select_pages(pages, doc.page_count)
+            finally:
+                doc.close()
+    
+    except ValueError as e:
         return jsonify({
             "status": "error",
-            "message": "未选择文件。"
+            "message": str(e)
+        }), 400
+    
+    except Exception as e:
+        # 处理异常
+        error_msg = f"裁剪过程中出错: {str(e)}"
+        logger.exception(error_msg)
+        
+        return jsonify({
+            "status": "error",
+            "message": error_msg
+        }), 500
+    
+    # 每渲染完一页立即写入ZIP并发送，不生成中间目录和完整的ZIP文件
+    return Response(
+        stream_cropped_images_zip(detach_upload(file), pages, render_options, cache_key,
+                                  RasterCache(raster_cache, content_hash)),
+        mimetype='application/zip',
+        headers=attachment_headers(download_name)
+    )
+
+def stream_cropped_images_zip(file, pages, render_options, cache_key, rasters=None):
+    """
+    边渲染边输出裁剪图片ZIP；ZIP总大小不超过 STREAM_CACHE_MAX_BYTES 时同时写入转换缓存
+    
+    给出 rasters（该文档的渲染结果缓存）时，已预览或导出过的页面不再重新渲染。
+    
+    参数 file 须是 detach_upload 分离出的上传文件，输出结束（或客户端断开）后关闭。
+    """
+    cache_chunks = []
+    cache_size = 0
+    
+    try:
+        with open_upload_buffer(file) as pdf_data:
+            entries = (
+                {"arcname": image["filename"], "data": image["data"]}
+                for image in iter_cropped_images(None, pdf_data, pages, render_options, rasters=rasters)
+            )
+            for chunk in iter_zip_stream(entries):
+                if cache_chunks is not None:
+                    cache_size += len(chunk)
+                    if cache_size <= STREAM_CACHE_MAX_BYTES:
+                        cache_chunks.append(chunk)
+                    else:
+                        cache_chunks = None
+                yield chunk
+    finally:
+        file.close()
+    
+    if cache_chunks is not None:
+        conversion_cache.put(cache_key, b"".join(cache_chunks))
+
+def parse_formats(formats_text):
+    """
+    解析逗号分隔的输出格式列表
+    
+    返回:
+        tuple: (格式列表, 错误信息)，格式有效时错误信息为None
+    """
+    formats = [f.strip().lower() for f in formats_text.split(',') if f.strip()]
+    unsupported = [f for f in formats if f not in SUPPORTED_FORMATS]
+    if not formats or unsupported:
+        return formats, f"不支持的输出格式: {', '.join(unsupported) or '(空)'}。可选: {', '.join(SUPPORTED_FORMATS)}"
+    return formats, None
+
+def parse_pages(pages_text):
+    """
+    校验页面选择参数（如 "1-10,25,40-"）
+    
+    返回:
+        tuple: (去除空格后的表达式或None, 错误信息)，参数有效或未提供时错误信息为None
+    """
+    if pages_text is None or not pages_text.strip():
+        return None, None
+    pages = pages_text.replace(" ", "")
+    try:
+        parse_page_selector(pages)
+    except ValueError as e:
+        return None, str(e)
+    return pages, None
+
+def check_page_selection(file, pages):
+    """
+    按上传PDF的实际页数校验页面选择，所选页面全部超出文档范围时返回400
+
+    参数:
+        file: Flask 上传文件对象（FileStorage）
+        pages (str): parse_pages 校验过的页面选择表达式，None 时不打开PDF
+
+    返回:
+        tuple 或 None: 页面选择无效时为 (错误响应, 400)，否则为None；
+            PDF无法打开时同样返回None，由后续的转换报告该错误
+    """
+    if not pages:
+        return None
+    try:
+        with open_upload_buffer(file) as pdf_data:
+            doc = open_pdf(None, pdf_data)
+            try:
+                select_pages(pages, doc.page_count)
+            finally:
+                doc.close()
+    except ValueError as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 400
+    except Exception:
+        logger.debug("校验页面选择时无法打开PDF", exc_info=True)
+    finally:
+        # 无法映射的流会被读到末尾，复位后再交给转换或保存
+        file.stream.seek(0)
+    return None
+
+def parse_render_options(form):
+    """
+    校验裁剪图片的渲染参数：dpi、width、height（目标像素尺寸）、image_format（png、jpeg、webp）和 quality
+    
+    返回:
+        tuple: (渲染参数字典, 错误信息)，参数有效时错误信息为None
+    """
+    limits = (
+        ("dpi",) + RENDER_DPI_RANGE,
+        ("width", 1, RENDER_MAX_PIXELS),
+        ("height", 1, RENDER_MAX_PIXELS),
+        ("quality", 1, 100)
+    )
+    options = {}
+    for field, low, high in limits:
+        value = form.get(field)
+        if value is None or not value.strip():
+            continue
+        try:
+            number = int(value)
+        except ValueError:
+            return None, f"{field} 必须是整数。"
+        if not low <= number <= high:
+            return None, f"{field} 必须在 {low} 到 {high} 之间。"
+        options[field] = number
+    
+    image_format = form.get('image_format', 'png').strip().lower()
+    if image_format == 'jpg':
+        image_format = 'jpeg'
+    if image_format not in CROP_IMAGE_FORMATS:
+        return None, f"不支持的图片格式: {image_format}。可选: {', '.join(CROP_IMAGE_FORMATS)}"
+    options["format"] = image_format
+    return options, None
+
+def build_formats_response(result, filename):
+    """
+    将 pdf_to_formats 的结果转换为API响应：Markdown直接返回，
+    Word文档和ZIP文件登记到索引并返回下载地址
+    """
+    response = {
+        "status": "success",
+        "message": "PDF转换完成。",
+        "filename": filename,
+        "pages_count": result["pages_count"],
+        **page_counts(result)
+    }
+    
+    if "markdown" in result:
+        extracted_images = result["markdown"].get("images", [])
+        image_index.register_images(extracted_images)
+        response["markdown"] = {
+            "markdown_content": result["markdown"].get("markdown_content", ""),
+            "images": extracted_images,
+            "image_count": len(extracted_images),
+            "deduplicated_images": result["markdown"].get("deduplicated_images", 0)
+        }
+    
+    for fmt, path_key in (("word", "word_path"), ("images", "zip_path")):
+        if fmt not in result:
+            continue
+        fmt_result = result[fmt]
+        if fmt_result["status"] != "success":
+            response[fmt] = {"status": "error", "message": fmt_result["message"]}
+            continue
+        artifact_name = os.path.basename(fmt_result[path_key])
+        image_index.register(artifact_name, fmt_result[path_key])
+        response[fmt] = {
+            "status": "success",
+            "download_url": f"/api/downloads/{artifact_name}",
+            "images_count": fmt_result.get("images_count", 0)
+        }
+    
+    return response
+
+@main_bp.route('/api/convert_pdf', methods=['POST'])
+@counts_in_flight
+def convert_pdf():
+    """
+    PDF多格式转换端点：只解析一次PDF，同时生成多种输出
+    
+    表单字段 formats 为逗号分隔的格式列表（markdown、word、images），默认 markdown,word。
+    Markdown结果直接包含在响应中，Word文档和裁剪图片ZIP通过返回的下载地址获取。
+    """
+    
+    file, upload_error = validate_pdf_upload()
+    if upload_error:
+        return upload_error
+    
+    formats, format_error = parse_formats(request.form.get('formats', 'markdown,word'))
+    if format_error:
+        return jsonify({
+            "status": "error",
+            "message": format_error
         }), 400
     
-    # 检查文件类型
-    if not file.filename.lower().endswith('.pdf'):
+    pages, pages_error = parse_pages(request.form.get('pages'))
+    if pages_error:
         return jsonify({
             "status": "error",
-            "message": "只支持PDF文件。"
+            "message": pages_error
         }), 400
     
-    # 检查文件大小
-    file.seek(0, 2)  # 移动到文件末尾
-    file_size = file.tell()
-    file.seek(0)  # 重置文件指针
+    page_error = check_page_selection(file, pages)
+    if page_error:
+        return page_error
     
-    if file_size > MAX_CONTENT_LENGTH:
+    render_options, render_error = parse_render_options(request.form)
+    if render_error:
         return jsonify({
             "status": "error",
-            "message": f"文件太大。最大支持 {MAX_CONTENT_LENGTH // (1024*1024)} MB。"
-        }), 413
+            "message": render_error
+        }), 400
+    
+    filename = secure_filename(file.filename)
+    temp_file_id = str(uuid.uuid4())
+    temp_dir = job_dir(ensure_temp_dir_exists(), temp_file_id)
+    temp_filepath = os.path.join(temp_dir, f"{temp_file_id}_{filename}")
     
     try:
-        # 确保临时目录存在
-        temp_dir = ensure_temp_dir_exists()
-        
-        # 生成唯一的文件名
-        unique_id = str(uuid.uuid4())
-        original_filename = secure_filename(file.filename)
-        base_filename = os.path.splitext(original_filename)[0]
-        temp_filename = f"{unique_id}_{original_filename}"
-        temp_filepath = os.path.join(temp_dir, temp_filename)
-        
-        # 保存上传的文件
-        file.save(temp_filepath)
-        print(f"已保存临时PDF文件: {temp_filepath}")
-        
-        # 调用裁剪转换函数
-        result = pdf_to_cropped_images(temp_filepath, temp_dir)
-        
-        if result["status"] == "success":
-            # 转换成功，返回ZIP文件下载
-            return send_file(
-                result["zip_path"],
-                mimetype='application/zip',
-                as_attachment=True,
-                download_name=f"{base_filename}_cropped_images.zip"
-            )
-        else:
-            # 转换失败
+        rasters = RasterCache(raster_cache, hash_stream(file.stream)) if "images" in formats else None
+        with storage_manager.using(temp_file_id), open_upload_buffer(file) as pdf_data:
+            result = pdf_to_formats(temp_filepath, formats, temp_dir, pdf_data=pdf_data, pages=pages,
+                                    render_options=render_options, page_cache=page_cache, rasters=rasters)
+        if result["status"] != "success":
             return jsonify({
                 "status": "error",
                 "message": result["message"]
             }), 500
+        
+        return jsonify(build_formats_response(result, filename)), 200
     
     except Exception as e:
-        # 处理异常
-        error_msg = f"裁剪过程中出错: {str(e)}"
-        print(error_msg)
+        error_msg = f"转换过程中出错: {str(e)}"
+        logger.exception(error_msg)
         
         return jsonify({
             "status": "error",
             "message": error_msg
         }), 500
+
+@main_bp.route('/api/downloads/<path:filename>', methods=['GET'])
+def download_artifact(filename):
+    """下载多格式转换生成的Word文档或ZIP文件"""
+    file_path = image_index.lookup(filename)
+    if file_path is None:
+        return jsonify({
+            "status": "error",
+            "message": "文件未找到"
+        }), 404
     
-    finally:
-        # 清理临时文件
-        try:
-            if os.path.exists(temp_filepath):
-                os.remove(temp_filepath)
-                print(f"已删除临时PDF文件: {temp_filepath}")
-        except Exception as e:
-            print(f"删除临时PDF文件时出错: {str(e)}")
-        
-        # 清理生成的ZIP文件（在发送后）
-        try:
-            if 'result' in locals() and result.get("zip_path") and os.path.exists(result["zip_path"]):
-                os.remove(result["zip_path"])
-                print(f"已删除临时ZIP文件: {result['zip_path']}")
-        except Exception as e:
-            print(f"删除临时ZIP文件时出错: {str(e)}")
\ No newline at end of file
+    storage_manager.touch(filename[:36])
+    
+    # 下载文件名去掉任务ID前缀
+    download_name = filename[37:] if len(filename) > 37 and filename[36] == '_' else filename
+    return send_file(file_path, as_attachment=True, download_name=download_name)
+
+@main_bp.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """
+    提交异步转换任务，立即返回任务ID
+    
+    参数与 /api/convert_pdf 相同。任务在有界的进程池中执行，
+    队列已满时返回429并在 Retry-After 头中给出建议的重试等待秒数。
+    """
+    
+    file, upload_error = validate_pdf_upload()
+    if upload_error:
+        return upload_error
+    
+    formats, format_error = parse_formats(request.form.get('formats', 'markdown'))
+    if format_error:
+        return jsonify({
+            "status": "error",
+            "message": format_error
+        }), 400
+    
+    pages, pages_error = parse_pages(request.form.get('pages'))
+    if pages_error:
+        return jsonify({
+            "status": "error",
+            "message": pages_error
+        }), 400
+    
+    page_error = check_page_selection(file, pages)
+    if page_error:
+        return page_error
+    
+    render_options, render_error = parse_render_options(request.form)
+    if render_error:
+        return jsonify({
+            "status": "error",
+            "message": render_error
+        }), 400
+    
+    filename = secure_filename(file.filename)
+    temp_file_id = str(uuid.uuid4())
+    temp_dir = job_dir(ensure_temp_dir_exists(), temp_file_id)
+    temp_filepath = os.path.join(temp_dir, f"{temp_file_id}_{filename}")
+    rasters = RasterCache(raster_cache, hash_stream(file.stream)) if "images" in formats else None
+    # 任务在其他进程中执行，上传内容需要落盘
+    file.save(temp_filepath)
+    
+    # 任务结束前任务目录不会被清理
+    storage_manager.acquire(temp_file_id)
+    try:
+        job = job_manager.submit(temp_filepath, formats, temp_dir, filename, job_id=temp_file_id,
+                                 options={"pages": pages, "render_options": render_options,
+                                          "page_cache": page_cache, "rasters": rasters},
+                                 on_done=storage_manager.release)
+    except JobQueueFull as e:
+        storage_manager.forget(temp_file_id)
+        os.remove(temp_filepath)
+        os.rmdir(temp_dir)
+        response = jsonify({
+            "status": "error",
+            "message": str(e)
+        })
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response, 429
+    except Exception as e:
+        # 进程池无法提交任务，任务记录已撤销，同时删除任务目录（其中已写入任务状态文件）
+        storage_manager.forget(temp_file_id)
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        logger.exception("提交转换任务失败")
+        return jsonify({
+            "status": "error",
+            "message": f"提交转换任务失败：{str(e)}"
+        }), 500
+    
+    status_url = f"/api/jobs/{job['job_id']}"
+    response = jsonify({
+        "status": "accepted",
+        "job": job,
+        "status_url": status_url,
+        "result_url": f"{status_url}/result"
+    })
+    response.headers['Location'] = status_url
+    return response, 202
+
+@main_bp.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """查询转换任务的状态和逐页进度"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({
+            "status": "error",
+            "message": "任务不存在或已过期"
+        }), 404
+    
+    return jsonify({
+        "status": "ok",
+        "job": job
+    }), 200
+
+@main_bp.route('/api/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """获取已完成任务的转换结果，格式与 /api/convert_pdf 的响应相同"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({
+            "status": "error",
+            "message": "任务不存在或已过期"
+        }), 404
+    
+    if job["status"] == "failed":
+        return jsonify({
+            "status": "error",
+            "message": job["error"]
+        }), 500
+    
+    if job["status"] != "done":
+        response = jsonify({
+            "status": job["status"],
+            "message": "任务尚未完成",
+            "job": job
+        })
+        response.headers['Retry-After'] = '1'
+        return response, 202
+    
+    result = job_manager.result(job_id)
+    if result is None:
+        return jsonify({
+            "status": "error",
+            "message": "任务不存在或已过期"
+        }), 404
+    
+    return jsonify(build_formats_response(result, job["filename"])), 200
+
+@main_bp.route('/api/jobs/stats', methods=['GET'])
+def job_stats():
+    """返回任务队列统计信息"""
+    return jsonify({
+        "status": "ok",
+        "jobs": job_manager.stats()
+    }), 200
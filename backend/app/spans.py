@@ -0,0 +1,127 @@
+from array import array
+
+class SpanTable:
+    """
+    按列存储的文本片段（span）表，替代每个span一个字典的存储方式
+
+    所有片段的文本拼接为一个字符串，按偏移量切片读取；字号、字体标志、
+    边界框和页码分别存放在紧凑的 array 中。大文档下内存占用约为字典方式的几分之一，
+    并且在进程间传递（pickle）时开销很小。
+
+    片段按追加顺序（页码、阅读顺序）排列。为兼容按字典处理的旧代码，
+    索引和迭代会临时生成 {"text", "font_size", "font_flags", "bbox", "page"} 字典。
+    """
+
+    def __init__(self):
+        self.sizes = array("d")       # 字号
+        self.flags = array("l")       # 字体标志（粗体16、斜体2等）
+        self.bboxes = array("d")      # 边界框，每个片段4个值 x0, y0, x1, y1
+        self.pages = array("l")       # 页码（从1开始）
+        self.offsets = array("q", [0])  # 文本偏移，第i个片段为 offsets[i]:offsets[i+1]
+        self._text_parts = []
+        self._text = ""
+
+    @classmethod
+    def from_elements(cls, text_elements):
+        """由旧的字典列表构建"""
+        table = cls()
+        for elem in text_elements:
+            table.append(elem["text"], elem["font_size"], elem["font_flags"], elem["bbox"], elem["page"])
+        return table
+
+    def append(self, text, font_size, font_flags, bbox, page):
+        """追加一个片段"""
+        self._text_parts.append(text)
+        self.offsets.append(self.offsets[-1] + len(text))
+        self.sizes.append(font_size)
+        self.flags.append(font_flags)
+        self.bboxes.extend(bbox)
+        self.pages.append(page)
+
+    def extend(self, other):
+        """将另一个表的片段追加到末尾（用于合并并行提取的结果）"""
+        base = self.offsets[-1]
+        self._text_parts.append(other.text_buffer)
+        self.offsets.extend(offset + base for offset in other.offsets[1:])
+        self.sizes.extend(other.sizes)
+        self.flags.extend(other.flags)
+        self.bboxes.extend(other.bboxes)
+        self.pages.extend(other.pages)
+
+    @property
+    def text_buffer(self):
+        """所有片段拼接后的文本"""
+        if self._text_parts:
+            self._text = self._text + "".join(self._text_parts)
+            self._text_parts = []
+        return self._text
+
+    def text(self, i):
+        """第i个片段的文本"""
+        return self.text_buffer[self.offsets[i]:self.offsets[i + 1]]
+
+    def bbox(self, i):
+        """第i个片段的边界框"""
+        return tuple(self.bboxes[4 * i:4 * i + 4])
+
+    def element(self, i):
+        """以字典形式返回第i个片段"""
+        return {
+            "text": self.text(i),
+            "font_size": self.sizes[i],
+            "font_flags": self.flags[i],
+            "bbox": self.bbox(i),
+            "page": self.pages[i]
+        }
+
+    def page_ranges(self):
+        """
+        各页片段的索引范围
+
+        返回:
+            dict: 页码 -> (起始索引, 结束索引)
+        """
+        ranges = {}
+        start = 0
+        count = len(self.pages)
+        while start < count:
+            page = self.pages[start]
+            end = start
+            while end < count and self.pages[end] == page:
+                end += 1
+            ranges[page] = (start, end)
+            start = end
+        return ranges
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("span index out of range")
+        return self.element(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.element(i)
+
+    def __getstate__(self):
+        return {
+            "sizes": self.sizes,
+            "flags": self.flags,
+            "bboxes": self.bboxes,
+            "pages": self.pages,
+            "offsets": self.offsets,
+            "text": self.text_buffer
+        }
+
+    def __setstate__(self, state):
+        self.sizes = state["sizes"]
+        self.flags = state["flags"]
+        self.bboxes = state["bboxes"]
+        self.pages = state["pages"]
+        self.offsets = state["offsets"]
+        self._text_parts = []
+        self._text = state["text"]
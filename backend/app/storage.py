@@ -0,0 +1,544 @@
+import hashlib
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有POSIX文件锁，每个进程各自清理
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 任务ID为uuid4字符串，上传文件及其派生文件均以 "<任务ID>_" 开头
+JOB_ID_PATTERN = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+# 计算ETag时读取文件的分块大小
+ETAG_CHUNK_SIZE = 1024 * 1024
+
+# 任务目录中的使用标记文件 "<前缀><进程ID>"：进程使用该目录期间存在，其他进程据此不删除该目录
+IN_USE_MARKER_PREFIX = ".in-use-"
+
+# 比较目录修改时间与记录的最近访问时间时允许的误差（秒）
+ACCESS_TIME_TOLERANCE = 1.0
+
+# 根目录下的清理锁文件：多个进程共用根目录时，只有持有该锁的进程执行后台清理
+REAPER_LOCK_FILENAME = ".reaper.lock"
+
+def job_dir(root, job_id, create=True):
+    """
+    返回任务的专属目录：<root>/<任务ID前两位>/<任务ID>/
+
+    按ID前缀分片，避免单个目录下堆积大量子目录；同一任务的PDF、
+    提取的图片和生成的文档都放在该目录中。
+
+    参数:
+        root (str): 临时文件根目录
+        job_id (str): 任务ID
+        create (bool): 目录不存在时是否创建
+
+    返回:
+        str: 任务目录的绝对路径
+    """
+    path = os.path.join(root, job_id[:2], job_id)
+    if create:
+        os.makedirs(path, exist_ok=True)
+    return path
+
+class ImageIndex:
+    """
+    文件名 -> 路径 的图片索引，使图片查找不再需要遍历整个临时目录
+
+    转换完成后登记提取出的图片；索引未命中时（如进程重启或多进程部署），
+    根据文件名中的任务ID只在对应的任务目录中查找。
+    """
+
+    def __init__(self, root):
+        """
+        参数:
+            root (str): 临时文件根目录
+        """
+        self.root = root
+        self._lock = threading.Lock()
+        self._paths = {}  # 文件名 -> 路径
+        self._etags = {}  # 路径 -> (大小, 修改时间, ETag)
+
+    def register(self, filename, path):
+        """登记一个图片文件"""
+        with self._lock:
+            self._paths[filename] = path
+
+    def register_images(self, images):
+        """
+        批量登记转换结果中的图片
+
+        参数:
+            images (list): 包含 filename 和 path 的图片信息列表
+        """
+        with self._lock:
+            for img in images:
+                if img.get("filename") and img.get("path"):
+                    self._paths[img["filename"]] = img["path"]
+
+    def forget(self, filename):
+        """移除索引中的图片（文件被删除时调用）"""
+        with self._lock:
+            path = self._paths.pop(filename, None)
+            if path is not None:
+                self._etags.pop(path, None)
+
+    def forget_job(self, job_id):
+        """移除某个任务的全部图片和文件（任务目录被删除时调用）"""
+        prefix = f"{job_id}_"
+        with self._lock:
+            for filename in [name for name in self._paths if name.startswith(prefix)]:
+                self._etags.pop(self._paths.pop(filename), None)
+
+    def lookup(self, filename):
+        """
+        查找图片文件路径
+
+        参数:
+            filename (str): 图片文件名（不含目录）
+
+        返回:
+            str: 文件路径，未找到返回None
+        """
+        with self._lock:
+            path = self._paths.get(filename)
+        if path is not None:
+            if os.path.isfile(path):
+                return path
+            self.forget(filename)
+
+        path = self._find_in_job_dir(filename)
+        if path is not None:
+            self.register(filename, path)
+        return path
+
+    def _find_in_job_dir(self, filename):
+        """根据文件名前缀的任务ID，只在该任务目录内查找"""
+        if os.sep in filename or "/" in filename:
+            return None
+        job_id = filename[:36]
+        if not JOB_ID_PATTERN.match(job_id):
+            return None
+
+        directory = job_dir(self.root, job_id, create=False)
+        for current_root, _, files in os.walk(directory):
+            if filename in files:
+                return os.path.join(current_root, filename)
+        return None
+
+    def etag(self, path):
+        """
+        返回文件内容的强ETag（SHA-256前缀），按文件大小和修改时间缓存计算结果
+
+        参数:
+            path (str): 文件路径
+
+        返回:
+            str: ETag值（不含引号）
+        """
+        stat = os.stat(path)
+        with self._lock:
+            cached = self._etags.get(path)
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(ETAG_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+        etag = digest.hexdigest()[:32]
+
+        with self._lock:
+            self._etags[path] = (stat.st_size, stat.st_mtime_ns, etag)
+        return etag
+
+def _process_alive(pid):
+    """判断进程是否仍在运行（同一主机）"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # 进程存在，但属于其他用户
+    except OSError:
+        return False
+    return True
+
+def _measure_dir(path):
+    """
+    统计目录的总大小和最近修改时间
+
+    返回:
+        tuple: (字节数, 最近修改时间戳)，目录不存在时返回 (0, None)
+    """
+    total = 0
+    latest = None
+    for current_root, _, files in os.walk(path):
+        try:
+            mtime = os.stat(current_root).st_mtime
+        except OSError:
+            continue
+        latest = mtime if latest is None else max(latest, mtime)
+        for name in files:
+            try:
+                stat = os.stat(os.path.join(current_root, name))
+            except OSError:
+                continue
+            total += stat.st_size
+            latest = max(latest, stat.st_mtime)
+    return total, latest
+
+class StorageManager:
+    """
+    临时文件生命周期管理：按任务目录记录转换产物（上传的PDF、提取的图片、生成的文档），
+    由后台线程定期清理
+
+    - 最近访问超过 ttl 秒的任务目录被删除；
+    - 总占用超过 quota_bytes 时按最近访问时间（LRU）淘汰；
+    - 正在使用的目录（acquire/using 期间）不会被删除。
+
+    首次清理时扫描根目录，把之前运行遗留的任务目录（以及多进程部署中其他进程创建的目录）
+    按其最近修改时间纳入管理。多个进程共用根目录时，访问和使用状态通过目录本身共享：
+    touch、track、acquire 和 release 更新目录的修改时间，使用期间目录中存在该进程的使用标记文件。
+    删除之前按这两项重新核对，其他进程最近访问过或正在使用的目录不会被删除。
+    后台清理只在持有根目录清理锁的一个进程中执行，其他进程只移除已被删除的目录的记录。
+    """
+
+    def __init__(self, root, ttl, quota_bytes, reap_interval=60, on_remove=None):
+        """
+        参数:
+            root (str): 临时文件根目录
+            ttl (int): 任务目录自最近访问起的保留时间（秒）
+            quota_bytes (int): 所有任务目录的总大小上限（字节）
+            reap_interval (int): 后台清理的间隔（秒）
+            on_remove: 删除任务目录后的回调 callback(job_id)
+        """
+        self.root = root
+        self.ttl = ttl
+        self.quota_bytes = quota_bytes
+        self.reap_interval = reap_interval
+        self.on_remove = on_remove
+
+        self._lock = threading.Lock()
+        self._entries = {}  # 任务ID -> {"bytes", "last_access"}
+        self._active = {}   # 任务ID -> 使用计数
+        self._total_bytes = 0
+        self._expired = 0
+        self._evicted = 0
+        self._reaper = None
+        self._reaper_lock = None  # 持有清理锁时为锁文件的描述符
+        self._stop = threading.Event()
+
+    def _ensure_reaper(self):
+        """首次登记任务时才启动后台清理线程，避免在导入时启动线程"""
+        if self._reaper is not None:
+            return
+        with self._lock:
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap_loop, name="storage-reaper", daemon=True)
+                self._reaper.start()
+
+    def _reap_loop(self):
+        while not self._stop.wait(self.reap_interval):
+            try:
+                if self._hold_reaper_lock():
+                    self.reap()
+                else:
+                    self._prune_vanished()
+            except Exception:
+                logger.exception("清理临时文件时出错")
+
+    def _hold_reaper_lock(self):
+        """
+        尝试取得根目录的清理锁，取得后一直持有到进程退出或 stop()
+
+        使用 lockf（POSIX记录锁）：锁属于进程，fork 出的子进程不继承，
+        持有锁的进程退出后由其他进程在下一次清理时接替。
+
+        返回:
+            bool: 本进程是否负责清理
+        """
+        if fcntl is None or self._reaper_lock is not None:
+            return True
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            fd = os.open(os.path.join(self.root, REAPER_LOCK_FILENAME), os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            logger.warning("无法打开清理锁文件，本进程自行清理", extra={"error": str(e)})
+            return True
+        try:
+            fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._reaper_lock = fd
+        logger.info("本进程负责清理临时文件", extra={"root": self.root})
+        return True
+
+    def _prune_vanished(self):
+        """移除已被其他进程删除的任务目录的记录"""
+        with self._lock:
+            job_ids = [job_id for job_id in self._entries if job_id not in self._active]
+        vanished = [job_id for job_id in job_ids if not os.path.isdir(job_dir(self.root, job_id, create=False))]
+        with self._lock:
+            for job_id in vanished:
+                if job_id in self._active:
+                    continue
+                entry = self._entries.pop(job_id, None)
+                if entry is not None:
+                    self._total_bytes -= entry["bytes"]
+        if self.on_remove is not None:
+            for job_id in vanished:
+                self.on_remove(job_id)
+
+    def stop(self):
+        """停止后台清理线程，并释放清理锁"""
+        self._stop.set()
+        if self._reaper_lock is not None:
+            os.close(self._reaper_lock)
+            self._reaper_lock = None
+
+    def _update(self, job_id, size, last_access):
+        """更新任务记录（调用方需持有锁）"""
+        entry = self._entries.get(job_id)
+        if entry is None:
+            entry = self._entries[job_id] = {"bytes": 0, "last_access": last_access}
+        self._total_bytes += size - entry["bytes"]
+        entry["bytes"] = size
+        entry["last_access"] = max(entry["last_access"], last_access)
+
+    def _marker_path(self, job_id):
+        return os.path.join(job_dir(self.root, job_id, create=False), f"{IN_USE_MARKER_PREFIX}{os.getpid()}")
+
+    def _mark_accessed(self, job_id):
+        """更新任务目录的修改时间，其他进程据此得知该目录刚被访问"""
+        try:
+            os.utime(job_dir(self.root, job_id, create=False))
+        except OSError:
+            pass  # 目录尚未创建或已被删除
+
+    def track(self, job_id):
+        """
+        登记任务目录或重新统计其大小，并记为刚刚访问（转换完成后调用）
+
+        参数:
+            job_id (str): 任务ID
+        """
+        self._mark_accessed(job_id)
+        size, _ = _measure_dir(job_dir(self.root, job_id, create=False))
+        with self._lock:
+            self._update(job_id, size, time.time())
+        self._ensure_reaper()
+
+    def touch(self, job_id):
+        """记录一次访问（如下载图片或文档），任务目录延后过期（包括其他进程登记的目录）"""
+        if not JOB_ID_PATTERN.match(job_id):
+            return
+        self._mark_accessed(job_id)
+        with self._lock:
+            entry = self._entries.get(job_id)
+            if entry is not None:
+                entry["last_access"] = time.time()
+
+    def acquire(self, job_id):
+        """标记任务目录正在使用，在 release 之前不会被删除（本进程和其他进程都不会删除）"""
+        with self._lock:
+            count = self._active.get(job_id, 0) + 1
+            self._active[job_id] = count
+            if job_id not in self._entries:
+                self._update(job_id, 0, time.time())
+            if count == 1:
+                job_dir(self.root, job_id)
+                try:
+                    open(self._marker_path(job_id), "w").close()
+                except OSError as e:
+                    logger.warning("创建使用标记失败", extra={"job_id": job_id, "error": str(e)})
+        self._ensure_reaper()
+
+    def _unmark_in_use(self, job_id):
+        """删除本进程的使用标记（调用方需持有锁）"""
+        try:
+            os.remove(self._marker_path(job_id))
+        except OSError:
+            pass
+
+    def release(self, job_id):
+        """结束使用任务目录，并重新统计其大小"""
+        with self._lock:
+            count = self._active.get(job_id, 0) - 1
+            if count > 0:
+                self._active[job_id] = count
+            else:
+                self._active.pop(job_id, None)
+                self._unmark_in_use(job_id)
+        self.track(job_id)
+
+    @contextmanager
+    def using(self, job_id):
+        """在 with 块内标记任务目录正在使用，结束后重新统计大小"""
+        self.acquire(job_id)
+        try:
+            yield
+        finally:
+            self.release(job_id)
+
+    def forget(self, job_id):
+        """不再管理某个任务目录（调用方随后自行删除该目录时使用）"""
+        with self._lock:
+            if self._active.pop(job_id, None) is not None:
+                self._unmark_in_use(job_id)
+            entry = self._entries.pop(job_id, None)
+            if entry is not None:
+                self._total_bytes -= entry["bytes"]
+
+    def _scan(self):
+        """把根目录中尚未登记的任务目录按最近修改时间纳入管理"""
+        try:
+            shards = os.listdir(self.root)
+        except OSError:
+            return
+        for shard in shards:
+            shard_path = os.path.join(self.root, shard)
+            if len(shard) != 2 or not os.path.isdir(shard_path):
+                continue
+            try:
+                job_ids = os.listdir(shard_path)
+            except OSError:
+                continue
+            for job_id in job_ids:
+                if not JOB_ID_PATTERN.match(job_id):
+                    continue
+                with self._lock:
+                    if job_id in self._entries:
+                        continue
+                size, latest = _measure_dir(os.path.join(shard_path, job_id))
+                if latest is None:
+                    continue
+                with self._lock:
+                    if job_id not in self._entries:
+                        self._update(job_id, size, latest)
+
+    def _shared_state(self, job_id):
+        """
+        任务目录在所有进程中的最近访问时间和使用状态
+
+        返回:
+            tuple: (目录修改时间, 是否有其他存活进程正在使用)，目录不存在时修改时间为None
+        """
+        path = job_dir(self.root, job_id, create=False)
+        try:
+            mtime = os.stat(path).st_mtime
+            names = os.listdir(path)
+        except OSError:
+            return None, False
+
+        own_marker = f"{IN_USE_MARKER_PREFIX}{os.getpid()}"
+        for name in names:
+            if name.startswith(IN_USE_MARKER_PREFIX) and name != own_marker:
+                pid = name[len(IN_USE_MARKER_PREFIX):]
+                if pid.isdigit() and _process_alive(int(pid)):
+                    return mtime, True
+        return mtime, False
+
+    def _remove(self, job_id):
+        """删除任务目录，分片目录为空时一并删除"""
+        path = job_dir(self.root, job_id, create=False)
+        shutil.rmtree(path, ignore_errors=True)
+        try:
+            os.rmdir(os.path.dirname(path))
+        except OSError:
+            pass  # 分片目录中还有其他任务
+        if self.on_remove is not None:
+            self.on_remove(job_id)
+
+    def reap(self, now=None):
+        """
+        扫描遗留目录，删除过期的任务目录，再按LRU淘汰直到总占用不超过配额
+
+        参数:
+            now (float): 当前时间戳，None 时使用 time.time()
+
+        返回:
+            int: 删除的任务目录数
+        """
+        if now is None:
+            now = time.time()
+        self._scan()
+
+        with self._lock:
+            remaining = self._total_bytes
+            candidates = sorted(
+                (entry["last_access"], job_id, entry["bytes"]) for job_id, entry in self._entries.items()
+                if job_id not in self._active
+            )
+
+        # 从最久未访问的目录开始：先删除过期的，再按LRU淘汰直到不超过配额
+        expired = []
+        evicted = []
+        vanished = []
+        for last_access, job_id, size in candidates:
+            is_expired = now - last_access > self.ttl
+            if not is_expired and remaining <= self.quota_bytes:
+                break
+
+            # 其他进程可能刚访问过或正在使用该目录
+            mtime, in_use = self._shared_state(job_id)
+            if mtime is None:
+                vanished.append(job_id)
+                remaining -= size
+                continue
+            if in_use or mtime > last_access + ACCESS_TIME_TOLERANCE:
+                with self._lock:
+                    entry = self._entries.get(job_id)
+                    if entry is not None:
+                        entry["last_access"] = max(entry["last_access"], now if in_use else mtime)
+                continue
+
+            (expired if is_expired else evicted).append(job_id)
+            remaining -= size
+
+        with self._lock:
+            # 核对期间本进程可能重新开始使用其中的目录
+            expired = [job_id for job_id in expired if job_id not in self._active]
+            evicted = [job_id for job_id in evicted if job_id not in self._active]
+            for job_id in expired + evicted + vanished:
+                entry = self._entries.pop(job_id, None)
+                if entry is not None:
+                    self._total_bytes -= entry["bytes"]
+            self._expired += len(expired)
+            self._evicted += len(evicted)
+
+        for job_id in expired + evicted:
+            self._remove(job_id)
+        if self.on_remove is not None:
+            for job_id in vanished:
+                self.on_remove(job_id)  # 已被其他进程删除
+
+        if expired or evicted:
+            logger.info("已清理临时文件", extra={"expired": len(expired), "evicted": len(evicted),
+                                              "bytes": self._total_bytes})
+        return len(expired) + len(evicted)
+
+    def stats(self):
+        """返回当前占用和清理统计"""
+        with self._lock:
+            return {
+                "jobs": len(self._entries),
+                "active": len(self._active),
+                "bytes": self._total_bytes,
+                "quota_bytes": self.quota_bytes,
+                "ttl": self.ttl,
+                "expired": self._expired,
+                "evicted": self._evicted
+            }
@@ -0,0 +1,100 @@
+import io
+import mmap
+import os
+from contextlib import contextmanager
+from tempfile import TemporaryFile
+
+from flask import Request
+from werkzeug.datastructures import FileStorage
+
+# 请求体不超过该大小（字节）时上传文件保存在内存中直接转换，超过或大小未知时写入一个临时文件，
+# 可通过环境变量 PDF2MD_UPLOAD_MEMORY_LIMIT 配置
+UPLOAD_MEMORY_LIMIT = int(os.environ.get("PDF2MD_UPLOAD_MEMORY_LIMIT", str(20 * 1024 * 1024)))
+
+class UploadRequest(Request):
+    """
+    上传文件在 UPLOAD_MEMORY_LIMIT 以内时保存在内存中
+
+    Werkzeug 默认超过500KB就把上传文件写入临时文件，这里把阈值提高到可配置的大小，
+    中小型PDF的整个转换过程都不会写磁盘。与Werkzeug的默认做法相同，按请求体大小
+    预先选择 BytesIO 或临时文件，open_upload_buffer 只需使用这两种类型的公开接口。
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if total_content_length is not None and total_content_length <= UPLOAD_MEMORY_LIMIT:
+            return io.BytesIO()
+        return TemporaryFile("wb+")
+
+@contextmanager
+def open_upload_buffer(file):
+    """
+    以零拷贝方式获取上传文件的内容，供 fitz.open(stream=...) 直接打开
+
+    内存中的上传文件（BytesIO）返回其缓冲区的视图；写入临时文件的上传文件
+    以只读方式内存映射，不再复制到 temp_uploads。
+
+    参数:
+        file: Flask 上传文件对象（FileStorage）
+
+    返回:
+        memoryview 或 bytes: PDF内容，仅在 with 块内有效
+    """
+    stream = file.stream
+
+    if isinstance(stream, io.BytesIO):
+        view = stream.getbuffer()
+        try:
+            yield view
+        finally:
+            view.release()
+        return
+
+    try:
+        stream.flush()
+        mapped = mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        # 无法映射的流（或空文件）退回到一次性读取
+        stream.seek(0)
+        yield stream.read()
+        return
+
+    view = memoryview(mapped)
+    try:
+        yield view
+    finally:
+        view.release()
+        mapped.close()
+
+def upload_size(file):
+    """
+    返回上传文件的大小（字节），读取位置复位到开头
+
+    参数:
+        file: Flask 上传文件对象（FileStorage）
+
+    返回:
+        int: 文件大小
+    """
+    stream = file.stream
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+def detach_upload(file):
+    """
+    将上传文件从请求中分离，供流式响应在请求结束后继续读取
+
+    请求结束时Werkzeug会关闭 request.files 中的所有文件；分离后请求只关闭一个空的替身，
+    返回的文件对象由调用方在使用完毕后关闭。
+
+    参数:
+        file: Flask 上传文件对象（FileStorage）
+
+    返回:
+        FileStorage: 持有原上传内容的新文件对象
+    """
+    detached = FileStorage(stream=file.stream, filename=file.filename, name=file.name,
+                           headers=file.headers)
+    file.stream = io.BytesIO()
+    return detached
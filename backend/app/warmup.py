@@ -0,0 +1,71 @@
+import logging
+import shutil
+import tempfile
+import time
+
+from app.metrics import collect_stage_timings
+
+logger = logging.getLogger(__name__)
+
+def load_dependencies():
+    """
+    导入转换依赖（fitz、python-docx）。app 在导入时不加载它们，
+    在 fork 工作进程之前于主进程中调用，工作进程共享已加载的模块
+    """
+    import importlib
+
+    from app.lazy import module_available
+
+    importlib.import_module("fitz")
+    if module_available("docx"):
+        importlib.import_module("docx")
+
+def build_warmup_pdf():
+    """
+    生成预热用的一页PDF：标题、西文正文、中文正文（加载CJK字体和CMap）和一张PNG图片
+
+    返回:
+        bytes: PDF内容
+    """
+    import fitz
+
+    doc = fitz.open()
+    try:
+        page = doc.new_page()
+        page.insert_text((56, 72), "Warm-up", fontsize=20, fontname="hebo")
+        page.insert_text((56, 110), "The quick brown fox jumps over the lazy dog.", fontsize=11)
+        page.insert_text((56, 135), "预热转换：加载中文字体和编码映射。", fontsize=11, fontname="china-s")
+        pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 64, 48), False)
+        pix.clear_with(200)
+        page.insert_image(fitz.Rect(56, 160, 184, 256), stream=pix.tobytes("png"))
+        return doc.tobytes()
+    finally:
+        doc.close()
+
+def warm_up():
+    """
+    执行一次完整的小型转换（Markdown、Word、裁剪图片），在服务进程接收请求前
+    导入 fitz、PIL、python-docx 并加载字体，首个请求不再承担这部分开销
+
+    预热的阶段耗时不计入 /metrics。
+
+    返回:
+        float: 预热耗时（秒）
+    """
+    from app.converter import pdf_to_formats
+
+    start = time.perf_counter()
+    work_dir = tempfile.mkdtemp(prefix="pdf2md_warmup_")
+    try:
+        with collect_stage_timings():
+            result = pdf_to_formats(f"{work_dir}/warmup.pdf", ["markdown", "word", "images"], work_dir,
+                                    workers=1, pdf_data=build_warmup_pdf())
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    seconds = time.perf_counter() - start
+    if result.get("status") != "success":
+        logger.warning("预热转换失败", extra={"error": result.get("message")})
+    else:
+        logger.info("预热完成", extra={"duration_ms": round(seconds * 1000, 3)})
+    return seconds
@@ -0,0 +1,89 @@
+import os
+import time
+import zipfile
+
+from app.metrics import record_stage
+
+# 已经是压缩格式的文件直接存储（ZIP_STORED），再做deflate只会浪费CPU
+STORED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".jp2", ".jpx", ".zip", ".docx", ".gz"}
+
+# 从磁盘读取文件写入ZIP时的分块大小
+ZIP_CHUNK_SIZE = 256 * 1024
+
+class _StreamBuffer:
+    """
+    供 zipfile 写入的只写缓冲区，不支持seek/tell，
+    zipfile 会自动改用数据描述符（data descriptor）格式
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """取出并清空已写入的数据"""
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+def compress_type_for(arcname):
+    """根据扩展名选择压缩方式：已压缩的图片和文档直接存储，其余使用deflate"""
+    ext = os.path.splitext(arcname)[1].lower()
+    if ext in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    return zipfile.ZIP_DEFLATED
+
+def iter_zip_stream(entries):
+    """
+    边生成边输出ZIP文件内容，峰值内存与ZIP总大小无关
+
+    参数:
+        entries: 可迭代的条目字典，可以是惰性生成器：
+            {"arcname": 压缩包内文件名, "path": 磁盘文件路径} 或
+            {"arcname": 压缩包内文件名, "data": bytes或str}
+
+    返回:
+        generator: 依次产出ZIP文件的字节块
+
+    每个条目的压缩和写入耗时记为 zip_build 阶段（不含生成条目和发送数据的时间）。
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        for entry in entries:
+            arcname = entry["arcname"]
+            compress_type = compress_type_for(arcname)
+            elapsed = 0.0
+            start = time.perf_counter()
+
+            if "path" in entry:
+                zinfo = zipfile.ZipInfo.from_file(entry["path"], arcname)
+                zinfo.compress_type = compress_type
+                with open(entry["path"], "rb") as src, zf.open(zinfo, "w") as dst:
+                    while True:
+                        chunk = src.read(ZIP_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        data = buffer.drain()
+                        if data:
+                            elapsed += time.perf_counter() - start
+                            yield data
+                            start = time.perf_counter()
+            else:
+                zf.writestr(arcname, entry["data"], compress_type=compress_type)
+
+            record_stage("zip_build", elapsed + time.perf_counter() - start)
+            data = buffer.drain()
+            if data:
+                yield data
+
+    # 中央目录在关闭ZipFile时写出
+    data = buffer.drain()
+    if data:
+        yield data
@@ -0,0 +1 @@
+# 转换器基准测试：合成PDF语料（corpus）和测试入口（run）
@@ -0,0 +1,177 @@
+import os
+import random
+
+import fitz
+
+from app.converter import encode_pixmap
+
+# 语料中的文档类型及其默认页数；scale 参数按比例缩放页数（至少1页）
+CORPUS_CASES = {
+    "text_heavy": 60,
+    "image_heavy": 20,
+    "many_small_images": 20,
+    "cjk": 40,
+    "pages_1000": 1000,
+}
+
+PAGE_WIDTH, PAGE_HEIGHT = fitz.paper_size("a4")
+MARGIN = 56
+
+LATIN_WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore "
+    "et dolore magna aliqua enim ad minim veniam quis nostrud exercitation ullamco laboris nisi aliquip "
+    "ex ea commodo consequat duis aute irure in reprehenderit voluptate velit esse cillum fugiat nulla"
+).split()
+
+CJK_CHARS = (
+    "的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能下过子说产种面而方"
+    "后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实加量都两体制机当使点从业本去把性好应开它合还"
+)
+
+def page_count_for(case, scale=1.0):
+    """按缩放比例计算某类文档的页数"""
+    return max(1, int(round(CORPUS_CASES[case] * scale)))
+
+def _latin_paragraph(rng, words):
+    return " ".join(rng.choice(LATIN_WORDS) for _ in range(words)).capitalize() + "."
+
+def _cjk_paragraph(rng, chars):
+    return "".join(rng.choice(CJK_CHARS) for _ in range(chars)) + "。"
+
+def _noise_pixmap(rng, width, height, alpha=False):
+    """
+    生成带渐变和噪声的RGB图片：噪声在1/4分辨率下生成后放大，
+    效果接近照片，不会被压缩成几个字节，也不会大到不真实
+    """
+    small_w, small_h = max(1, width // 4), max(1, height // 4)
+    samples = bytearray(rng.randbytes(small_w * small_h * 3))
+    samples[0::3] = b"".join(bytes([y * 255 // max(1, small_h - 1)]) * small_w for y in range(small_h))
+    samples[1::3] = bytes(x * 255 // max(1, small_w - 1) for x in range(small_w)) * small_h
+    pix = fitz.Pixmap(fitz.csRGB, small_w, small_h, bytes(samples), False)
+    pix = fitz.Pixmap(pix, width, height, None)
+    if alpha:
+        mask = fitz.Pixmap(fitz.csGRAY, width, height,
+                           bytes(255 if (x + y) % 7 else 128 for y in range(height) for x in range(width)), False)
+        pix = fitz.Pixmap(pix, mask)
+    return pix
+
+def _insert_text_block(page, rect, text, fontsize, fontname="helv"):
+    """在矩形区域内排版文本，返回剩余的矩形（放不下时返回None）"""
+    remaining = page.insert_textbox(rect, text, fontsize=fontsize, fontname=fontname)
+    if remaining < 0:
+        return None
+    used = rect.height - remaining
+    return fitz.Rect(rect.x0, rect.y0 + used + fontsize * 0.6, rect.x1, rect.y1)
+
+def _fill_text_page(page, rng, page_number, paragraph, fontname="helv"):
+    """标题 + 小标题 + 若干段正文，直到页面排满"""
+    rect = fitz.Rect(MARGIN, MARGIN, PAGE_WIDTH - MARGIN, PAGE_HEIGHT - MARGIN)
+    rect = _insert_text_block(page, rect, f"Chapter {page_number}", 20, "hebo" if fontname == "helv" else fontname)
+    section = 1
+    while rect is not None and rect.height > 40:
+        if section % 3 == 1:
+            rect = _insert_text_block(page, rect, f"Section {page_number}.{section}", 14,
+                                      "hebo" if fontname == "helv" else fontname)
+            if rect is None:
+                break
+        rect = _insert_text_block(page, rect, paragraph(rng), 11, fontname)
+        section += 1
+
+def _build_text_heavy(doc, rng, pages):
+    for page_number in range(1, pages + 1):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        _fill_text_page(page, rng, page_number, lambda r: _latin_paragraph(r, r.randint(40, 90)))
+
+def _build_cjk(doc, rng, pages):
+    for page_number in range(1, pages + 1):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        _fill_text_page(page, rng, page_number, lambda r: _cjk_paragraph(r, r.randint(80, 200)), "china-s")
+
+def _build_image_heavy(doc, rng, pages):
+    """每页一张大图（每4页一张PNG，其余为JPEG）加一段说明文字"""
+    for page_number in range(1, pages + 1):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        page.insert_text((MARGIN, MARGIN + 14), f"Figure page {page_number}", fontsize=14, fontname="hebo")
+        pix = _noise_pixmap(rng, 1600, 1200)
+        image_format = "png" if page_number % 4 == 0 else "jpeg"
+        data = encode_pixmap(pix, image_format, 85)
+        rect = fitz.Rect(MARGIN, MARGIN + 30, PAGE_WIDTH - MARGIN, MARGIN + 30 + (PAGE_WIDTH - 2 * MARGIN) * 0.75)
+        page.insert_image(rect, stream=data)
+        _insert_text_block(page, fitz.Rect(MARGIN, rect.y1 + 12, PAGE_WIDTH - MARGIN, PAGE_HEIGHT - MARGIN),
+                           _latin_paragraph(rng, 60), 11)
+
+def _build_many_small_images(doc, rng, pages):
+    """每页6x8个不同的小图标（部分带透明通道），以及少量文字"""
+    for page_number in range(1, pages + 1):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        page.insert_text((MARGIN, MARGIN), f"Icons page {page_number}", fontsize=14, fontname="hebo")
+        cell_w = (PAGE_WIDTH - 2 * MARGIN) / 6
+        cell_h = (PAGE_HEIGHT - 2 * MARGIN - 20) / 8
+        for row in range(8):
+            for col in range(6):
+                pix = _noise_pixmap(rng, 48, 48, alpha=(row + col) % 4 == 0)
+                x0 = MARGIN + col * cell_w
+                y0 = MARGIN + 20 + row * cell_h
+                page.insert_image(fitz.Rect(x0 + 4, y0 + 4, x0 + cell_w - 4, y0 + cell_h - 16),
+                                  stream=pix.tobytes("png"))
+                page.insert_text((x0 + 4, y0 + cell_h - 4), f"icon {row}-{col}", fontsize=7)
+
+def _build_pages_1000(doc, rng, pages):
+    """大量短页面：每页一个标题和两段文字"""
+    for page_number in range(1, pages + 1):
+        page = doc.new_page(width=PAGE_WIDTH, height=PAGE_HEIGHT)
+        rect = fitz.Rect(MARGIN, MARGIN, PAGE_WIDTH - MARGIN, PAGE_HEIGHT - MARGIN)
+        rect = _insert_text_block(page, rect, f"Entry {page_number}", 16, "hebo")
+        for _ in range(2):
+            rect = _insert_text_block(page, rect, _latin_paragraph(rng, 50), 11)
+
+_BUILDERS = {
+    "text_heavy": _build_text_heavy,
+    "image_heavy": _build_image_heavy,
+    "many_small_images": _build_many_small_images,
+    "cjk": _build_cjk,
+    "pages_1000": _build_pages_1000,
+}
+
+def build_corpus_pdf(case, scale=1.0, seed=0):
+    """
+    生成一份合成PDF，相同的参数总是得到逐字节相同的结果
+
+    参数:
+        case (str): 文档类型，CORPUS_CASES 中的键
+        scale (float): 页数缩放比例
+        seed (int): 随机数种子
+
+    返回:
+        bytes: PDF内容
+    """
+    if case not in _BUILDERS:
+        raise ValueError(f"未知的语料类型: {case}")
+
+    rng = random.Random(f"{case}:{seed}")
+    doc = fitz.open()
+    try:
+        _BUILDERS[case](doc, rng, page_count_for(case, scale))
+        # 清空元数据（含创建时间）并固定文件ID，保证输出确定
+        doc.set_metadata({})
+        return doc.tobytes(garbage=3, deflate=True, no_new_id=True)
+    finally:
+        doc.close()
+
+def generate_corpus(output_dir, cases=None, scale=1.0, seed=0):
+    """
+    生成语料目录，已存在且内容相同的文件不重写
+
+    返回:
+        dict: 文档类型 -> PDF路径
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    paths = {}
+    for case in cases or CORPUS_CASES:
+        data = build_corpus_pdf(case, scale, seed)
+        path = os.path.join(output_dir, f"{case}.pdf")
+        if not os.path.exists(path) or os.path.getsize(path) != len(data):
+            with open(path, "wb") as f:
+                f.write(data)
+        paths[case] = path
+    return paths
@@ -0,0 +1,314 @@
+"""
+转换器基准测试
+
+生成确定的合成PDF语料，分别测量 pdf_to_markdown、pdf_to_word、pdf_to_cropped_images
+的每秒页数、峰值内存（RSS）和各阶段耗时，结果写入JSON；给出基线文件时，
+任一指标比基线差超过容差即以非零状态退出。
+
+用法（在 backend 目录下）:
+    python -m benchmarks.run                        # 完整语料，与 benchmarks/baseline.json 比较（如存在）
+    python -m benchmarks.run --scale 0.1 --cases text_heavy,cjk
+    python -m benchmarks.run --save-baseline        # 将本次结果保存为基线
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.corpus import CORPUS_CASES, generate_corpus, page_count_for
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+
+CONVERTERS = ("markdown", "word", "cropped_images")
+
+# 计时的转换阶段：converter 模块中的函数名 -> 阶段名
+TIMED_STAGES = {
+    "open_pdf": "open",
+    "build_document": "extract",
+    "document_to_markdown": "markdown",
+    "document_to_word": "word",
+    "render_cropped_pages": "render",
+}
+
+# 峰值内存的增长低于该值（MB）时不算退化，避免小文档上的测量噪声
+RSS_SLACK_MB = 16
+
+# 基线和本次耗时都低于该值（秒）时不比较速度，太短的测量噪声过大
+MIN_TIMED_SECONDS = 0.5
+
+def _peak_rss_mb():
+    """当前进程及其已结束子进程中最大的峰值RSS（MB）"""
+    # Linux 上 ru_maxrss 会跨 exec 继承父进程的峰值，优先读取 exec 后重新计数的 VmHWM
+    peak_kb = None
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    peak_kb = int(line.split()[1])
+                    break
+    except OSError:
+        pass
+
+    if peak_kb is None:
+        peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss 在 macOS 上单位为字节，Linux 上为KB
+        if sys.platform == "darwin":
+            peak_kb /= 1024
+    children_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == "darwin":
+        children_kb /= 1024
+    return max(peak_kb, children_kb) / 1024
+
+def _install_stage_timers(stages):
+    """包装 converter 中各阶段的函数，把耗时累加到 stages"""
+    from app import converter
+
+    def timed(name, func):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                stages[name] = stages.get(name, 0.0) + time.perf_counter() - start
+        return wrapper
+
+    for func_name, stage in TIMED_STAGES.items():
+        setattr(converter, func_name, timed(stage, getattr(converter, func_name)))
+
+def _run_case(pdf_path, converter_name, workers):
+    """
+    在独立的子进程中执行一次转换（每次都是新进程，峰值RSS只反映本次转换）
+
+    返回:
+        dict: {"seconds", "peak_rss_mb", "stages"}
+    """
+    from app import converter
+
+    stages = {}
+    _install_stage_timers(stages)
+
+    work_dir = tempfile.mkdtemp(prefix="pdf2md_bench_")
+    try:
+        # 转换器会在PDF所在目录写入图片和输出文件，复制到临时目录中执行
+        local_pdf = os.path.join(work_dir, os.path.basename(pdf_path))
+        shutil.copyfile(pdf_path, local_pdf)
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            if converter_name == "markdown":
+                result = converter.pdf_to_markdown(local_pdf, workers=workers)
+                failed = result.get("error")
+                message = result.get("markdown_content")
+            elif converter_name == "word":
+                result = converter.pdf_to_word(local_pdf, workers=workers)
+                failed = result.get("status") != "success"
+                message = result.get("message")
+            else:
+                result = converter.pdf_to_cropped_images(local_pdf, workers=workers)
+                failed = result.get("status") != "success"
+                message = result.get("message")
+        seconds = time.perf_counter() - start
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if failed:
+        raise RuntimeError(f"{converter_name} 转换失败: {message}")
+
+    return {
+        "seconds": seconds,
+        "peak_rss_mb": _peak_rss_mb(),
+        "stages": stages
+    }
+
+def run_benchmark(pdf_path, converter_name, pages, repeat=1, workers=1):
+    """
+    多次执行同一转换，取最快一次的耗时和各次中最大的峰值内存
+
+    返回:
+        dict: {"pages", "seconds", "pages_per_sec", "peak_rss_mb", "stages"}
+    """
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    for _ in range(max(1, repeat)):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            runs.append(executor.submit(_run_case, pdf_path, converter_name, workers).result())
+
+    best = min(runs, key=lambda run: run["seconds"])
+    stages = {name: round(seconds, 4) for name, seconds in best["stages"].items()}
+    stages["other"] = round(max(0.0, best["seconds"] - sum(best["stages"].values())), 4)
+    return {
+        "pages": pages,
+        "seconds": round(best["seconds"], 4),
+        "pages_per_sec": round(pages / best["seconds"], 3) if best["seconds"] > 0 else None,
+        "peak_rss_mb": round(max(run["peak_rss_mb"] for run in runs), 1),
+        "stages": stages
+    }
+
+def compare_results(current, baseline, tolerance):
+    """
+    与基线比较，找出退化超过容差的指标
+
+    每秒页数低于基线的 (1 - tolerance) 倍（耗时不足 MIN_TIMED_SECONDS 的用例除外），
+    或峰值内存高于基线的 (1 + tolerance) 倍（且增长超过 RSS_SLACK_MB）时视为退化。
+    基线中没有的用例不比较。
+
+    参数:
+        current (dict): 本次结果（run 的返回值）
+        baseline (dict): 基线结果
+        tolerance (float): 容差，如 0.2 表示20%
+
+    返回:
+        list: [{"benchmark", "metric", "baseline", "current", "change"}, ...]
+    """
+    regressions = []
+    for name, result in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+
+        base_rate, rate = base.get("pages_per_sec"), result.get("pages_per_sec")
+        too_short = max(base.get("seconds") or 0, result.get("seconds") or 0) < MIN_TIMED_SECONDS
+        if base_rate and rate is not None and not too_short and rate < base_rate * (1 - tolerance):
+            regressions.append({
+                "benchmark": name,
+                "metric": "pages_per_sec",
+                "baseline": base_rate,
+                "current": rate,
+                "change": round(rate / base_rate - 1, 4)
+            })
+
+        base_rss, rss = base.get("peak_rss_mb"), result.get("peak_rss_mb")
+        if base_rss and rss is not None and rss > base_rss * (1 + tolerance) and rss - base_rss > RSS_SLACK_MB:
+            regressions.append({
+                "benchmark": name,
+                "metric": "peak_rss_mb",
+                "baseline": base_rss,
+                "current": rss,
+                "change": round(rss / base_rss - 1, 4)
+            })
+    return regressions
+
+def environment_info():
+    """记录运行环境，便于判断结果之间是否可比"""
+    try:
+        import fitz
+        pymupdf_version = fitz.VersionBind
+    except (ImportError, AttributeError):
+        pymupdf_version = None
+    return {
+        "python": platform.python_version(),
+        "pymupdf": pymupdf_version,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+def run(cases=None, converters=None, scale=1.0, seed=0, repeat=1, workers=1, corpus_dir=None, log=print):
+    """
+    生成语料并执行全部基准测试
+
+    返回:
+        dict: {"created_at", "environment", "settings", "results": {"<用例>/<转换器>": {...}}}
+    """
+    cases = list(cases or CORPUS_CASES)
+    converters = list(converters or CONVERTERS)
+
+    temp_corpus = None
+    if corpus_dir is None:
+        temp_corpus = corpus_dir = tempfile.mkdtemp(prefix="pdf2md_corpus_")
+    try:
+        log(f"生成语料 (scale={scale}, seed={seed}) -> {corpus_dir}")
+        paths = generate_corpus(corpus_dir, cases, scale, seed)
+
+        results = {}
+        for case in cases:
+            pages = page_count_for(case, scale)
+            for converter_name in converters:
+                name = f"{case}/{converter_name}"
+                result = run_benchmark(paths[case], converter_name, pages, repeat, workers)
+                results[name] = result
+                log(f"{name:<36} {pages:>5} 页  {result['seconds']:>8.2f} s  "
+                    f"{result['pages_per_sec']:>8.2f} 页/s  {result['peak_rss_mb']:>7.1f} MB")
+    finally:
+        if temp_corpus is not None:
+            shutil.rmtree(temp_corpus, ignore_errors=True)
+
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "environment": environment_info(),
+        "settings": {"scale": scale, "seed": seed, "repeat": repeat, "workers": workers},
+        "results": results
+    }
+
+def _split_list(value, allowed, label):
+    items = [item.strip() for item in value.split(",") if item.strip()]
+    unknown = [item for item in items if item not in allowed]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"未知的{label}: {', '.join(unknown)}（可选: {', '.join(allowed)}）")
+    return items
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="PDF转换器基准测试")
+    parser.add_argument("--cases", type=lambda v: _split_list(v, list(CORPUS_CASES), "语料类型"),
+                        help=f"逗号分隔的语料类型，默认全部: {','.join(CORPUS_CASES)}")
+    parser.add_argument("--converters", type=lambda v: _split_list(v, CONVERTERS, "转换器"),
+                        help=f"逗号分隔的转换器，默认全部: {','.join(CONVERTERS)}")
+    parser.add_argument("--scale", type=float, default=1.0, help="语料页数缩放比例，默认1.0")
+    parser.add_argument("--seed", type=int, default=0, help="语料随机数种子，默认0")
+    parser.add_argument("--repeat", type=int, default=3, help="每项重复次数，取最快一次，默认3")
+    parser.add_argument("--workers", type=int, default=1, help="转换时的并行进程数，默认1")
+    parser.add_argument("--corpus-dir", help="语料保存目录，默认使用临时目录并在结束后删除")
+    parser.add_argument("--output", default="benchmark_results.json", help="结果JSON路径")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线JSON路径，不存在时跳过比较")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的退化比例，默认0.2")
+    parser.add_argument("--save-baseline", action="store_true", help="将本次结果保存为基线，不做比较")
+    args = parser.parse_args(argv)
+
+    current = run(args.cases, args.converters, args.scale, args.seed, args.repeat, args.workers,
+                  args.corpus_dir)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(current, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入: {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"基线文件不存在，跳过比较: {args.baseline}")
+        return 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    base_settings = baseline.get("settings", {})
+    if base_settings.get("scale") != args.scale or base_settings.get("seed") != args.seed:
+        print(f"基线的语料参数 {base_settings} 与本次不同，结果不可比")
+        return 2
+
+    regressions = compare_results(current, baseline, args.tolerance)
+    if not regressions:
+        print(f"与基线相比无超过 {args.tolerance:.0%} 的退化")
+        return 0
+
+    print(f"发现 {len(regressions)} 项超过 {args.tolerance:.0%} 的退化:")
+    for item in regressions:
+        print(f"  {item['benchmark']:<36} {item['metric']:<14} {item['baseline']} -> {item['current']} "
+              f"({item['change']:+.1%})")
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,25 @@
+"""
+测试共用的 fixture
+"""
+
+import os
+
+import pytest
+
+@pytest.fixture(scope="module")
+def routes(tmp_path_factory):
+    """
+    在临时目录中导入 app.routes 并创建测试客户端（routes.client）
+
+    导入 app.routes 时会在当前目录下创建临时文件和缓存目录，测试期间切换到临时目录，
+    这些目录不会留在仓库中。
+    """
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("routes"))
+    try:
+        from app import create_app
+        from app import routes
+        routes.client = create_app().test_client()
+        yield routes
+    finally:
+        os.chdir(cwd)
@@ -0,0 +1,59 @@
+"""
+生产环境服务配置（gunicorn）
+
+    gunicorn -c gunicorn.conf.py run:app
+
+- 多个预先 fork 的工作进程，应用和转换依赖在主进程中加载一次（preload_app、when_ready），
+  fork 后共享已导入的模块；
+- 每个工作进程开始接收请求前执行一次预热转换（见 app/warmup.py）；
+- 处理 max_requests 个请求后替换工作进程，限制 MuPDF 长期运行的内存增长；
+- 收到 SIGTERM 后停止接收新连接，等待进行中的请求和异步任务在 graceful_timeout 内结束；
+- 异步任务的进程池按工作进程数平分，任务状态写入任务目录，任何工作进程都能查询；
+  临时文件只由一个工作进程清理（见 app/storage.py 的清理锁）。
+"""
+
+import multiprocessing
+import os
+
+bind = os.environ.get("PDF2MD_BIND", "0.0.0.0:5000")
+
+# 工作进程数，默认CPU核数；每个进程用若干线程处理请求，流式响应不会独占进程
+workers = int(os.environ.get("PDF2MD_SERVER_WORKERS", multiprocessing.cpu_count()))
+
+# 应用据此把异步任务的进程池和排队上限平分到各工作进程（preload_app 时应用在读取配置之后导入）
+os.environ["PDF2MD_SERVER_WORKERS"] = str(workers)
+worker_class = "gthread"
+threads = int(os.environ.get("PDF2MD_SERVER_THREADS", 4))
+
+# 单个请求的最长处理时间（秒），大文件的同步转换可能需要数分钟
+timeout = int(os.environ.get("PDF2MD_SERVER_TIMEOUT", 300))
+
+# 停止或替换工作进程时等待进行中请求结束的时间（秒）
+graceful_timeout = int(os.environ.get("PDF2MD_GRACEFUL_TIMEOUT", 120))
+
+# 每个工作进程处理的请求数上限，加随机抖动避免所有进程同时重启；0 表示不限制
+max_requests = int(os.environ.get("PDF2MD_MAX_REQUESTS", 500))
+max_requests_jitter = int(os.environ.get("PDF2MD_MAX_REQUESTS_JITTER", 50))
+
+preload_app = True
+
+# 应用日志由 app.logs 输出到 stderr，这里只保留 gunicorn 自身的错误日志
+accesslog = None
+errorlog = "-"
+loglevel = os.environ.get("PDF2MD_LOG_LEVEL", "info").lower()
+
+def when_ready(server):
+    """主进程在 fork 工作进程之前导入 fitz 和 python-docx（app 本身延迟导入它们）"""
+    from app.warmup import load_dependencies
+    load_dependencies()
+
+def post_worker_init(worker):
+    """工作进程初始化完成、开始接收请求之前执行预热转换"""
+    from app.warmup import warm_up
+    warm_up()
+
+def worker_exit(server, worker):
+    """工作进程退出：取消排队中的异步任务，等待执行中的任务结束，停止临时文件清理线程"""
+    from app.routes import job_manager, storage_manager
+    job_manager.shutdown(wait=True)
+    storage_manager.stop()
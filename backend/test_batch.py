@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+测试批量转换的输出布局和清单续跑
+"""
+
+import json
+import os
+
+from app.batch import load_manifest, run_batch
+from benchmarks.corpus import build_corpus_pdf
+
+def test_batch_resumes_from_manifest(tmp_path):
+    """已完成且内容未变的文件不再转换，内容变化或参数变化时重新转换"""
+    input_dir = tmp_path / "in"
+    (input_dir / "sub").mkdir(parents=True)
+    (input_dir / "a.pdf").write_bytes(build_corpus_pdf("image_heavy", scale=0.1))
+    (input_dir / "sub" / "b.pdf").write_bytes(build_corpus_pdf("text_heavy", scale=0.05))
+    output_dir = tmp_path / "out"
+    messages = []
+
+    summary = run_batch([str(input_dir)], str(output_dir), ["markdown", "word"], workers=2, log=messages.append)
+    assert (summary["converted"], summary["skipped"], summary["failed"]) == (2, 0, 0)
+    assert summary["pages"] == 5
+    assert (output_dir / "sub" / "b.md").exists()
+    assert (output_dir / "sub" / "b.docx").exists()
+    # Markdown 中的图片引用指向 .md 旁边的图片目录
+    markdown = (output_dir / "a.md").read_text(encoding="utf-8")
+    assert "](a_images/a_page1_img1.jpg)" in markdown
+    assert (output_dir / "a_images" / "a_page1_img1.jpg").exists()
+
+    manifest = load_manifest(str(output_dir / "manifest.jsonl"))
+    assert set(manifest) == {"a.pdf", "sub/b.pdf"}
+    assert all(record["status"] == "done" and len(record["sha256"]) == 64 for record in manifest.values())
+
+    # 重新运行：全部跳过
+    summary = run_batch([str(input_dir)], str(output_dir), ["markdown", "word"], workers=2, log=messages.append)
+    assert (summary["converted"], summary["skipped"]) == (0, 2)
+
+    # 只改修改时间：比较哈希后跳过；改内容：重新转换
+    os.utime(input_dir / "a.pdf", ns=(1, 1))
+    (input_dir / "sub" / "b.pdf").write_bytes(build_corpus_pdf("text_heavy", scale=0.05, seed=1))
+    summary = run_batch([str(input_dir)], str(output_dir), ["markdown", "word"], workers=2, log=messages.append)
+    assert (summary["converted"], summary["skipped"]) == (1, 1)
+
+    # 参数变化：全部重新转换，旧格式的输出被删除
+    summary = run_batch([str(input_dir)], str(output_dir), ["markdown"], workers=2, log=messages.append)
+    assert summary["converted"] == 2
+    assert not (output_dir / "a.docx").exists()
+
+    with open(output_dir / "manifest.jsonl", encoding="utf-8") as f:
+        assert len([json.loads(line) for line in f]) == 6
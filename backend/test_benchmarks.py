@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+测试基准测试的语料生成和基线比较
+"""
+
+import hashlib
+
+import fitz
+
+from benchmarks.corpus import CORPUS_CASES, build_corpus_pdf, page_count_for
+from benchmarks.run import compare_results, run
+
+def test_corpus_is_deterministic():
+    """相同参数生成的语料逐字节相同，页数按比例缩放"""
+    for case in CORPUS_CASES:
+        first = build_corpus_pdf(case, scale=0.01)
+        second = build_corpus_pdf(case, scale=0.01)
+        assert hashlib.sha256(first).digest() == hashlib.sha256(second).digest()
+
+        doc = fitz.open(stream=first, filetype="pdf")
+        assert doc.page_count == page_count_for(case, 0.01)
+        doc.close()
+
+    assert page_count_for("pages_1000", 1.0) == 1000
+
+def test_compare_results_flags_regressions():
+    """速度和内存超过容差才算退化，太短的测量不比较速度"""
+    baseline = {"results": {
+        "a/markdown": {"seconds": 2.0, "pages_per_sec": 50.0, "peak_rss_mb": 100.0},
+        "b/word": {"seconds": 2.0, "pages_per_sec": 50.0, "peak_rss_mb": 100.0},
+        "c/word": {"seconds": 0.01, "pages_per_sec": 5000.0, "peak_rss_mb": 100.0},
+    }}
+    current = {"results": {
+        "a/markdown": {"seconds": 2.2, "pages_per_sec": 45.0, "peak_rss_mb": 110.0},
+        "b/word": {"seconds": 4.0, "pages_per_sec": 25.0, "peak_rss_mb": 200.0},
+        "c/word": {"seconds": 0.02, "pages_per_sec": 2500.0, "peak_rss_mb": 100.0},
+        "d/new": {"seconds": 1.0, "pages_per_sec": 1.0, "peak_rss_mb": 1.0},
+    }}
+
+    regressions = compare_results(current, baseline, tolerance=0.2)
+    assert sorted((item["benchmark"], item["metric"]) for item in regressions) == [
+        ("b/word", "pages_per_sec"),
+        ("b/word", "peak_rss_mb"),
+    ]
+
+def test_run_small_corpus():
+    """缩小的语料上完整跑一遍，结果包含各项指标和阶段耗时"""
+    results = run(cases=["text_heavy"], converters=["markdown"], scale=0.02, log=lambda *args: None)
+
+    result = results["results"]["text_heavy/markdown"]
+    assert result["pages"] == page_count_for("text_heavy", 0.02)
+    assert result["pages_per_sec"] > 0
+    assert result["peak_rss_mb"] > 0
+    assert "extract" in result["stages"] and "markdown" in result["stages"]
+    assert results["settings"]["scale"] == 0.02
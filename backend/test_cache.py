@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+测试转换结果缓存：内存层和磁盘层的命中与未命中、按字节数的LRU淘汰，以及多个进程共用磁盘目录
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+from app import cache
+from app.cache import ConversionCache, make_cache_key
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def test_memory_and_disk_hits(tmp_path):
+    """内存层命中直接返回；重启后磁盘层命中并回填内存层；未命中返回None"""
+    first = ConversionCache(str(tmp_path), 1024, 4096)
+    first.put("a", b"x" * 100)
+    assert first.get("a") == b"x" * 100
+    assert first.get("missing") is None
+    assert (first.stats()["memory_hits"], first.stats()["misses"]) == (1, 1)
+
+    restarted = ConversionCache(str(tmp_path), 1024, 4096)
+    assert restarted.get("a") == b"x" * 100
+    assert restarted.get("a") == b"x" * 100
+    stats = restarted.stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["hits"]) == (1, 1, 2)
+
+def test_lru_eviction(tmp_path):
+    """两层各自按总字节数淘汰最久未使用的条目，最近读取过的条目保留"""
+    store = ConversionCache(str(tmp_path), 250, 350)
+    for key in "abc":
+        store.put(key, key.encode() * 100)
+    # 内存层只能放两条：a 被淘汰；磁盘层放得下三条
+    assert store.stats()["memory_entries"] == 2
+    assert store.get("a") == b"a" * 100  # 磁盘命中，a 成为最近使用
+
+    store.put("d", b"d" * 100)  # 磁盘层超出上限，淘汰最久未使用的 b
+    assert sorted(os.listdir(tmp_path)) == ["a", "c", "d"]
+    stats = store.stats()
+    assert stats["disk_evictions"] == 1 and stats["disk_bytes"] == 300
+    assert stats["memory_evictions"] >= 2
+
+    # 超过内存层上限的值只写入磁盘层
+    store.put("big", b"z" * 300)
+    assert "big" not in store._memory and store.get("big") == b"z" * 300
+
+def test_invalidate(tmp_path):
+    store = ConversionCache(str(tmp_path), 1024, 4096)
+    store.put("a", b"x")
+    store.invalidate("a")
+    assert store.get("a") is None and os.listdir(tmp_path) == []
+
+def test_entries_written_by_other_processes(tmp_path, monkeypatch):
+    """其他进程写入的条目被本进程采纳，定期重建索引后按整个目录的占用淘汰"""
+    store = ConversionCache(str(tmp_path), 0, 250)
+    script = ("import sys; from app.cache import ConversionCache; "
+              "ConversionCache(sys.argv[1], 0, 250).put(sys.argv[2], b'o' * 100)")
+    for key in ("other1", "other2"):
+        subprocess.run([sys.executable, "-c", script, str(tmp_path), key], cwd=BACKEND_DIR, check=True)
+        stamp = time.time() - 100
+        os.utime(tmp_path / key, (stamp, stamp))
+
+    assert store.get("other1") == b"o" * 100
+    assert store.stats()["disk_hits"] == 1
+
+    # 本进程写入时重建索引：目录中共有 300 字节，超出上限，淘汰最久未访问的 other2（other1 刚被读取过）
+    monkeypatch.setattr(cache, "DISK_RESYNC_INTERVAL", -1)
+    store.put("mine", b"m" * 100)
+    assert sorted(os.listdir(tmp_path)) == ["mine", "other1"]
+    assert store.stats()["disk_bytes"] == 200
+
+def test_cache_key_covers_options():
+    """内容、格式和选项任一不同时缓存键不同，选项顺序无关"""
+    key = make_cache_key("0" * 64, "markdown", {"pages": "1-3", "filename": "a.pdf"})
+    assert key == make_cache_key("0" * 64, "markdown", {"filename": "a.pdf", "pages": "1-3"})
+    assert len({key,
+                make_cache_key("1" * 64, "markdown", {"pages": "1-3", "filename": "a.pdf"}),
+                make_cache_key("0" * 64, "word", {"pages": "1-3", "filename": "a.pdf"}),
+                make_cache_key("0" * 64, "markdown", {"pages": "1-3", "filename": "b.pdf"})}) == 4
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+测试文档级图片去重：同一图片（相同 xref）在多个页面出现时只提取一次，各页面引用同一个文件
+"""
+
+import os
+
+import fitz
+
+from app.converter import extract_images_from_page, pdf_to_markdown, pdf_to_word
+
+PAGE_COUNT = 4
+
+def build_pdf(path):
+    """每页一张本页的图片，所有页面还引用同一个标志图片（相同 xref）"""
+    doc = fitz.open()
+    logo_xref = 0
+    for number in range(PAGE_COUNT):
+        page = doc.new_page()
+        page.insert_text((72, 60), f"Page {number + 1}", fontsize=11)
+        pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 64, 48), False)
+        pix.set_rect(pix.irect, (number * 50, 80, 160))
+        page.insert_image(fitz.Rect(72, 120, 264, 264), stream=pix.tobytes("png"))
+        if logo_xref:
+            page.insert_image(fitz.Rect(400, 40, 448, 88), xref=logo_xref)
+        else:
+            logo = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 32, 32), False)
+            logo.set_rect(logo.irect, (200, 30, 30))
+            logo_xref = page.insert_image(fitz.Rect(400, 40, 448, 88), stream=logo.tobytes("png"))
+    doc.save(str(path))
+    doc.close()
+
+def test_markdown_extracts_shared_image_once(tmp_path):
+    """标志图片只保存一个文件，其余页面的条目标记为 deduplicated 并引用该文件"""
+    build_pdf(tmp_path / "doc.pdf")
+    result = pdf_to_markdown(str(tmp_path / "doc.pdf"), workers=1)
+
+    assert result["deduplicated_images"] == PAGE_COUNT - 1
+    logos = [img for img in result["images"] if (img["width"], img["height"]) == (32, 32)]
+    assert [img["page"] for img in logos] == list(range(1, PAGE_COUNT + 1))
+    assert [bool(img.get("deduplicated")) for img in logos] == [False] + [True] * (PAGE_COUNT - 1)
+    assert len({img["filename"] for img in logos}) == 1
+    assert result["markdown_content"].count(logos[0]["filename"]) == PAGE_COUNT
+
+    # 每页一张本页的图片，加一个标志图片
+    assert len(os.listdir(tmp_path / "doc_images")) == PAGE_COUNT + 1
+
+def test_word_reports_deduplicated_images(tmp_path):
+    build_pdf(tmp_path / "doc.pdf")
+    result = pdf_to_word(str(tmp_path / "doc.pdf"), str(tmp_path / "doc.docx"), workers=1)
+    assert result["status"] == "success"
+    assert (result["images_count"], result["deduplicated_images"]) == (2 * PAGE_COUNT, PAGE_COUNT - 1)
+
+def test_without_registry_every_page_extracts(tmp_path):
+    """不传登记表时（逐页独立处理）每页都提取自己的副本"""
+    build_pdf(tmp_path / "doc.pdf")
+    doc = fitz.open(str(tmp_path / "doc.pdf"))
+    try:
+        images = [img for number in range(PAGE_COUNT)
+                  for img in extract_images_from_page(doc[number], number, str(tmp_path), "doc")]
+    finally:
+        doc.close()
+    assert len(images) == 2 * PAGE_COUNT
+    assert not any(img.get("deduplicated") for img in images)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+测试图片服务：图片索引和按任务目录的回退查找，强ETag、条件请求（304）和Range请求（206）
+"""
+
+import os
+import uuid
+
+from app.storage import ImageIndex, job_dir
+
+def create_image(root, content=b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4):
+    """在一个新的任务目录的图片子目录中创建图片文件，返回 (文件名, 路径)"""
+    job_id = str(uuid.uuid4())
+    images_dir = os.path.join(job_dir(root, job_id), f"{job_id}_doc_images")
+    os.makedirs(images_dir)
+    filename = f"{job_id}_doc_page1_img1.png"
+    path = os.path.join(images_dir, filename)
+    with open(path, "wb") as f:
+        f.write(content)
+    return filename, path
+
+def test_index_lookup_and_fallback(tmp_path):
+    """未登记的图片按文件名中的任务ID只在该任务目录中查找，找到后登记"""
+    index = ImageIndex(str(tmp_path))
+    filename, path = create_image(str(tmp_path))
+    assert index.lookup(filename) == path
+    assert index._paths[filename] == path
+
+    # 登记的路径失效后重新查找
+    moved = os.path.join(os.path.dirname(os.path.dirname(path)), filename)
+    os.replace(path, moved)
+    assert index.lookup(filename) == moved
+
+    # 不是以任务ID开头、包含路径分隔符或不存在的文件名都找不到
+    assert index.lookup("page1_img1.png") is None
+    assert index.lookup(f"../{filename}") is None
+    assert index.lookup(f"{uuid.uuid4()}_missing.png") is None
+
+    index.forget_job(filename[:36])
+    assert filename not in index._paths
+
+def test_etag_follows_content(tmp_path):
+    index = ImageIndex(str(tmp_path))
+    _, path = create_image(str(tmp_path))
+    etag = index.etag(path)
+    assert etag == index.etag(path) and len(etag) == 32
+
+    with open(path, "ab") as f:
+        f.write(b"changed")
+    assert index.etag(path) != etag
+
+def test_serve_image_conditional_and_range(routes):
+    """图片响应带强ETag和长期缓存头，If-None-Match 返回304，Range 返回206"""
+    content = b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4
+    filename, _ = create_image(routes.TEMP_UPLOAD_FOLDER, content)
+    url = f"/api/images/{filename}"
+
+    response = routes.client.get(url)
+    assert response.status_code == 200 and response.data == content
+    etag = response.headers["ETag"]
+    assert etag == f'"{routes.image_index.etag(routes.image_index.lookup(filename))}"'
+    cache_control = response.headers["Cache-Control"]
+    assert "public" in cache_control and "immutable" in cache_control
+    assert f"max-age={routes.IMAGE_CACHE_MAX_AGE}" in cache_control
+
+    response = routes.client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304 and response.data == b""
+
+    response = routes.client.get(url, headers={"Range": "bytes=8-15"})
+    assert response.status_code == 206
+    assert response.data == content[8:16]
+    assert response.headers["Content-Range"] == f"bytes 8-15/{len(content)}"
+
+    # If-Range 与当前ETag不匹配（客户端持有的是旧内容）时返回完整内容
+    response = routes.client.get(url, headers={"Range": "bytes=8-15", "If-Range": '"stale"'})
+    assert response.status_code == 200 and response.data == content
+
+    assert routes.client.get(f"/api/images/{uuid.uuid4()}_missing.png").status_code == 404
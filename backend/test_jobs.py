@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+测试异步转换任务：队列已满时返回429和 Retry-After，提交失败时释放排队名额，逐页进度上报
+"""
+
+import io
+import os
+import queue
+from concurrent.futures import Future
+
+import fitz
+import pytest
+
+from app import jobs
+from app.jobs import JOB_STATE_FILENAME, JobManager, JobQueueFull
+from app.storage import job_dir
+
+class FakeExecutor:
+    """代替进程池：submit 返回不会自行完成的 Future，或抛出给定的异常"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.futures = []
+
+    def submit(self, *args, **kwargs):
+        if self.error is not None:
+            raise self.error
+        future = Future()
+        self.futures.append(future)
+        return future
+
+def fake_manager(tmp_path, executor, max_pending=1):
+    manager = JobManager(1, max_pending, 60, store_root=str(tmp_path))
+    manager._ensure_executor = lambda: executor
+    return manager
+
+def submit(manager, tmp_path, job_id):
+    """为任务创建任务目录和输入文件后提交"""
+    pdf_path = os.path.join(job_dir(str(tmp_path), job_id), "input.pdf")
+    open(pdf_path, "wb").close()
+    return manager.submit(pdf_path, ["markdown"], os.path.dirname(pdf_path), "doc.pdf", job_id=job_id)
+
+def build_pdf(page_count):
+    """生成每页一行文字的PDF"""
+    doc = fitz.open()
+    for number in range(page_count):
+        doc.new_page().insert_text((72, 72), f"Page {number + 1}")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+JOB_IDS = ["00000000-0000-4000-8000-%012d" % number for number in range(2)]
+
+def test_queue_full_until_job_finishes(tmp_path):
+    """排队名额用完时拒绝新任务，任务结束后名额释放"""
+    executor = FakeExecutor()
+    manager = fake_manager(tmp_path, executor)
+    assert submit(manager, tmp_path, JOB_IDS[0])["status"] == "queued"
+
+    with pytest.raises(JobQueueFull) as excinfo:
+        submit(manager, tmp_path, JOB_IDS[1])
+    assert excinfo.value.retry_after == 5  # 还没有完成的任务时的默认估计
+
+    executor.futures[0].set_result(({"status": "success", "formats": {}}, []))
+    assert manager.get(JOB_IDS[0])["status"] == "done"
+    assert manager.result(JOB_IDS[0]) == {"status": "success", "formats": {}}
+    assert manager.stats()["pending"] == 0
+    assert submit(manager, tmp_path, JOB_IDS[1])["status"] == "queued"
+
+def test_submit_failure_releases_slot(tmp_path):
+    """重建进程池后仍无法提交时抛出异常，任务记录撤销，不会永久占用排队名额"""
+    manager = fake_manager(tmp_path, FakeExecutor(error=RuntimeError("pool broken")))
+    for job_id in JOB_IDS[:2]:
+        with pytest.raises(RuntimeError):
+            submit(manager, tmp_path, job_id)
+        assert manager.stats()["pending"] == 0
+        assert job_id not in manager._jobs
+
+def test_progress_is_shared_through_store(tmp_path):
+    """工作进程上报的进度更新任务状态，并写入任务目录供其他服务进程查询"""
+    manager = fake_manager(tmp_path, FakeExecutor(), max_pending=2)
+    submit(manager, tmp_path, JOB_IDS[0])
+
+    class ProgressQueue:
+        def __init__(self, items):
+            self.items = list(items)
+
+        def get(self):
+            if not self.items:
+                raise EOFError
+            return self.items.pop(0)
+
+    manager._consume_progress(ProgressQueue([(JOB_IDS[0], "start", 0, None),
+                                             (JOB_IDS[0], "extract", 2, 3)]))
+    job = manager.get(JOB_IDS[0])
+    assert (job["status"], job["progress"]) == ("running", {"stage": "extract", "page": 2, "page_count": 3})
+
+    other = JobManager(1, 1, 60, store_root=str(tmp_path))
+    assert other.get(JOB_IDS[0])["progress"] == job["progress"]
+    assert os.path.exists(os.path.join(job_dir(str(tmp_path), JOB_IDS[0]), JOB_STATE_FILENAME))
+
+def test_conversion_reports_progress(tmp_path, monkeypatch):
+    """工作进程中的转换从 start 开始逐页上报进度"""
+    progress_queue = queue.Queue()
+    monkeypatch.setattr(jobs, "_progress_queue", progress_queue)
+    pdf_path = tmp_path / "doc.pdf"
+    pdf_path.write_bytes(build_pdf(3))
+
+    result, _ = jobs._run_conversion_job(JOB_IDS[0], str(pdf_path), ["markdown"], str(tmp_path))
+    assert result["status"] == "success"
+
+    reports = []
+    while not progress_queue.empty():
+        reports.append(progress_queue.get())
+    assert reports[0] == (JOB_IDS[0], "start", 0, None)
+    pages = [(page, page_count) for _, stage, page, page_count in reports[1:] if page_count == 3]
+    assert pages[-1] == (3, 3)
+    assert [page for page, _ in pages] == sorted(page for page, _ in pages)
+
+def test_queue_full_response(routes, monkeypatch):
+    """/api/jobs 队列已满时返回429和 Retry-After，进程池无法提交时返回500"""
+    executor = FakeExecutor()
+    manager = fake_manager(routes.TEMP_UPLOAD_FOLDER, executor)
+    monkeypatch.setattr(routes, "job_manager", manager)
+    stored_jobs = routes.storage_manager.stats()["jobs"]
+
+    def post():
+        return routes.client.post("/api/jobs", data={"file": (io.BytesIO(build_pdf(1)), "doc.pdf",
+                                                              "application/pdf")},
+                                  content_type="multipart/form-data")
+
+    assert post().status_code == 202
+    response = post()
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "5"
+    assert response.get_json()["status"] == "error"
+
+    executor.futures[0].set_result(({"status": "success", "formats": {}}, []))
+    executor.error = RuntimeError("pool broken")
+    response = post()
+    assert response.status_code == 500
+    assert manager.stats()["pending"] == 0
+
+    # 被拒绝和提交失败的任务目录都已删除
+    assert routes.storage_manager.stats()["jobs"] == stored_jobs + 1
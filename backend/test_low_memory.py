@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+测试低内存的两遍转换与普通转换输出一致
+"""
+
+import io
+
+from app.converter import pdf_to_markdown, pdf_to_markdown_stream
+from benchmarks.corpus import build_corpus_pdf
+
+def test_low_memory_matches_full_conversion(tmp_path):
+    """逐页写出的Markdown与一次性转换全文的结果逐字节相同"""
+    for case, scale in (("text_heavy", 0.1), ("image_heavy", 0.15), ("cjk", 0.1)):
+        case_dir = tmp_path / case
+        case_dir.mkdir()
+        pdf_path = case_dir / f"{case}.pdf"
+        pdf_path.write_bytes(build_corpus_pdf(case, scale=scale))
+
+        for pages in (None, "2-"):
+            full = pdf_to_markdown(str(pdf_path), pages=pages, low_memory=False)
+            low = pdf_to_markdown(str(pdf_path), pages=pages, low_memory=True)
+            assert low["markdown_content"] == full["markdown_content"]
+            assert low["images"] == full["images"]
+
+            output = io.StringIO()
+            result = pdf_to_markdown_stream(str(pdf_path), output, pages=pages)
+            assert result["status"] == "success"
+            assert result["image_count"] == len(full["images"])
+            assert output.getvalue() == full["markdown_content"]
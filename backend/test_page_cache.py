@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+测试页级缓存：修订版PDF只重新提取改动的页面，结果与不使用缓存时相同
+"""
+
+import fitz
+
+from app.cache import ConversionCache
+from app.converter import pdf_to_markdown
+from benchmarks.corpus import build_corpus_pdf
+
+def convert(tmp_path, name, data, page_cache=None):
+    """转换到独立目录，返回 (转换结果, Markdown、图片信息和图片内容)"""
+    work_dir = tmp_path / name
+    work_dir.mkdir()
+    result = pdf_to_markdown(str(work_dir / "doc.pdf"), pdf_data=data, page_cache=page_cache)
+    images = [(img["filename"], img["page"], img["width"], img["height"], img["deduplicated"],
+               open(img["path"], "rb").read()) for img in result["images"]]
+    return result, (result["markdown_content"], images)
+
+def test_revised_document_reuses_unchanged_pages(tmp_path):
+    """改动两页后只重新提取这两页；对象重新编号的同一版本全部复用"""
+    original = build_corpus_pdf("image_heavy", scale=0.3)
+    doc = fitz.open(stream=original)
+    doc[1].insert_text((100, 100), "Revised paragraph", fontsize=11)
+    doc[-1].insert_text((100, 120), "Changed heading", fontsize=30)
+    revised = doc.tobytes()
+    renumbered = doc.tobytes(garbage=4)
+    page_count = doc.page_count
+    doc.close()
+
+    cache = ConversionCache(str(tmp_path / "cache"), 64 * 1024 * 1024, 1024 * 1024 * 1024)
+    _, expected = convert(tmp_path, "plain", revised)
+
+    result, _ = convert(tmp_path, "v1", original, cache)
+    assert (result["pages_reused"], result["pages_recomputed"]) == (0, page_count)
+
+    result, output = convert(tmp_path, "v2", revised, cache)
+    assert (result["pages_reused"], result["pages_recomputed"]) == (page_count - 2, 2)
+    assert output == expected
+
+    result, output = convert(tmp_path, "v2_renumbered", renumbered, cache)
+    assert (result["pages_reused"], result["pages_recomputed"]) == (page_count, 0)
+    assert output == expected
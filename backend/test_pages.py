@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+测试页面选择：表达式解析、按文档页数选择页面，以及各转换端点对超出范围的页面一律返回400
+"""
+
+import io
+
+import fitz
+import pytest
+
+from app.converter import select_pages
+
+def build_pdf(page_count):
+    """生成每页一行文字的PDF"""
+    doc = fitz.open()
+    for number in range(page_count):
+        doc.new_page().insert_text((72, 72), f"Page {number + 1}")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+def test_select_pages():
+    """单页、闭区间、开区间按页数截断，结果升序且不重复"""
+    assert select_pages(None, 3) == [0, 1, 2]
+    assert select_pages("3,1-2,2", 10) == [0, 1, 2]
+    assert select_pages("40-", 45) == [39, 40, 41, 42, 43, 44]
+    assert select_pages("-2", 10) == [0, 1]
+    assert select_pages("8-20", 10) == [7, 8, 9]
+    assert select_pages("2,5", 3) == [1]
+
+@pytest.mark.parametrize("selector", ["a", "0", "3-1", "-", "1--2", "1-2-3", ",", "0-4"])
+def test_select_pages_rejects_malformed(selector):
+    with pytest.raises(ValueError, match="无效的页面选择|页面选择为空"):
+        select_pages(selector, 10)
+
+@pytest.mark.parametrize("selector, page_count", [("5", 3), ("4-", 3), ("11-20,30", 10)])
+def test_select_pages_rejects_out_of_range(selector, page_count):
+    with pytest.raises(ValueError, match="超出文档范围"):
+        select_pages(selector, page_count)
+
+def test_parse_pages(routes):
+    """未提供时为None，空格被去除，格式错误时返回错误信息"""
+    assert routes.parse_pages(None) == (None, None)
+    assert routes.parse_pages("  ") == (None, None)
+    assert routes.parse_pages(" 1 - 3 , 40- ") == ("1-3,40-", None)
+    pages, error = routes.parse_pages("1,x")
+    assert pages is None and "x" in error
+
+@pytest.mark.parametrize("url", ["/api/convert_pdf_to_md", "/api/convert_pdf_to_word",
+                                 "/api/convert_pdf_to_images", "/api/convert_pdf", "/api/jobs"])
+def test_out_of_range_pages_rejected(routes, url):
+    """3页的PDF选择第5页，所有端点都返回400，不把错误信息当作转换结果"""
+    response = routes.client.post(url, data={"file": (io.BytesIO(build_pdf(3)), "doc.pdf", "application/pdf"),
+                                             "pages": "5"},
+                                  content_type="multipart/form-data")
+    assert response.status_code == 400
+    assert response.get_json() == {"status": "error", "message": "所选页面超出文档范围（共3页）"}
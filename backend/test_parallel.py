@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+测试按页并行提取：多进程转换的 Markdown、图片列表和图片文件与串行转换逐字节相同
+"""
+
+import os
+
+import fitz
+
+from app.converter import pdf_to_markdown
+
+PAGE_COUNT = 12
+
+def build_pdf(path):
+    """每页一段文字和一张本页的图片，所有页面还引用同一个标志图片（相同 xref）"""
+    doc = fitz.open()
+    logo_xref = 0
+    for number in range(PAGE_COUNT):
+        page = doc.new_page()
+        page.insert_text((72, 60), f"Section {number + 1}", fontsize=18)
+        page.insert_text((72, 100), f"Body text of page {number + 1}.", fontsize=11)
+        pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 64, 48), False)
+        pix.set_rect(pix.irect, (number * 20 % 256, 80, 160))
+        page.insert_image(fitz.Rect(72, 120, 264, 264), stream=pix.tobytes("png"))
+        if logo_xref:
+            page.insert_image(fitz.Rect(400, 40, 448, 88), xref=logo_xref)
+        else:
+            logo = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 32, 32), False)
+            logo.set_rect(logo.irect, (200, 30, 30))
+            logo_xref = page.insert_image(fitz.Rect(400, 40, 448, 88), stream=logo.tobytes("png"))
+    doc.save(str(path))
+    doc.close()
+
+def convert(tmp_path, name, workers):
+    """在单独的目录中转换同名PDF，返回转换结果和图片目录中的文件内容"""
+    directory = tmp_path / name
+    directory.mkdir()
+    build_pdf(directory / "doc.pdf")
+    result = pdf_to_markdown(str(directory / "doc.pdf"), workers=workers)
+    images_dir = directory / "doc_images"
+    files = {name: (images_dir / name).read_bytes() for name in sorted(os.listdir(images_dir))}
+    return result, files
+
+def test_parallel_matches_serial(tmp_path):
+    """跨进程边界重复出现的图片合并后，结果与串行完全一致"""
+    serial, serial_files = convert(tmp_path, "serial", workers=1)
+    parallel, parallel_files = convert(tmp_path, "parallel", workers=3)
+
+    assert not serial.get("error") and not parallel.get("error")
+    assert parallel["markdown_content"] == serial["markdown_content"]
+    assert parallel["deduplicated_images"] == serial["deduplicated_images"] == PAGE_COUNT - 1
+
+    def describe(images):
+        return [(img["filename"], img["page"], img["width"], img["height"], bool(img.get("deduplicated")))
+                for img in images]
+    assert describe(parallel["images"]) == describe(serial["images"])
+
+    # 其他进程重复保存的标志图片已删除，图片目录中的文件逐字节相同
+    assert parallel_files == serial_files
+    assert len(serial_files) == PAGE_COUNT + 1
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+测试页面渲染结果缓存：页面预览和裁剪图片导出共用渲染结果
+"""
+
+import zipfile
+
+from app.cache import ConversionCache
+from app.converter import pdf_to_cropped_images, render_page_preview
+from app.rasters import RasterCache
+from benchmarks.corpus import build_corpus_pdf
+
+def test_preview_and_export_share_rasters(tmp_path):
+    """预览过的页面导出时不再渲染，导出的图片与预览逐字节相同"""
+    pdf_path = tmp_path / "doc.pdf"
+    pdf_path.write_bytes(build_corpus_pdf("image_heavy", scale=0.1))
+    rasters = RasterCache(ConversionCache(str(tmp_path / "rasters"), 64 * 1024 * 1024, 1024 * 1024 * 1024),
+                          "0" * 64)
+
+    preview = render_page_preview(str(pdf_path), 2, scale=2, crop=True, rasters=rasters)
+    assert (preview["status"], preview["cached"]) == ("success", False)
+    assert render_page_preview(str(pdf_path), 2, scale=2, crop=True, rasters=rasters)["cached"]
+
+    result = pdf_to_cropped_images(str(pdf_path), str(tmp_path), render_options={"dpi": 144},
+                                   rasters=rasters)
+    stats = rasters.cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 2)
+
+    (tmp_path / "plain").mkdir()
+    plain = pdf_to_cropped_images(str(pdf_path), str(tmp_path / "plain"), render_options={"dpi": 144})
+    with zipfile.ZipFile(result["zip_path"]) as cached_zip, zipfile.ZipFile(plain["zip_path"]) as plain_zip:
+        names = cached_zip.namelist()
+        assert [cached_zip.read(name) for name in names] == [plain_zip.read(name) for name in names]
+        assert cached_zip.read(names[1]) == preview["data"]
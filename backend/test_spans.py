@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+测试按列存储的文本片段表：内存占用、整列标题判定，以及 Word 输出直接读取列的结果与逐个字典相同
+"""
+
+import pickle
+import random
+import tracemalloc
+
+import pytest
+
+from app.converter import add_text_to_word_doc, classify_heading_levels, classify_word_heading_levels
+from app.spans import SpanTable
+
+def generate_spans(count=20000, spans_per_page=50):
+    """生成确定的片段数据（文本、字号、字体标志、边界框、页码）"""
+    rng = random.Random(0)
+    for i in range(count):
+        y = 100.0 + i % 40 * 15
+        yield (f"word{i} " * rng.randint(1, 8), rng.choice([9.0, 10.0, 12.0, 14.0, 18.0]),
+               rng.choice([0, 2, 16]), (72.0, y, 300.0, y + 12), i // spans_per_page + 1)
+
+def retained_bytes(build):
+    """build() 返回的对象在 tracemalloc 下占用的内存（字节）"""
+    tracemalloc.start()
+    try:
+        result = build()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return current
+
+def build_table():
+    table = SpanTable()
+    for span in generate_spans():
+        table.append(*span)
+    table.text_buffer  # 合并文本缓冲区
+    return table
+
+def test_span_table_memory():
+    """400页、2万个片段：按列存储的占用不到每个片段一个字典时的一半，pickle 往返不变"""
+    dicts = retained_bytes(lambda: [{"text": text, "font_size": size, "font_flags": flags, "bbox": bbox,
+                                     "page": page} for text, size, flags, bbox, page in generate_spans()])
+    table = retained_bytes(build_table)
+    assert table < dicts / 2, f"SpanTable {table / 1e6:.1f} MB，字典列表 {dicts / 1e6:.1f} MB"
+
+    original = build_table()
+    restored = pickle.loads(pickle.dumps(original))
+    assert len(restored) == len(original) == 20000
+    assert restored[-1] == original.element(len(original) - 1)
+    assert restored.page_ranges() == original.page_ranges()
+
+def scalar_heading_level(size, avg_font_size):
+    """逐个片段判定的标题级别，作为整列判定的参照"""
+    title_threshold = avg_font_size * 1.2
+    if size >= title_threshold * 1.3:
+        return 1
+    if size >= title_threshold * 1.1:
+        return 2
+    if size >= title_threshold:
+        return 3
+    if size >= avg_font_size * 1.1:
+        return 4
+    return 0
+
+def test_classify_heading_levels_matches_scalar():
+    table = build_table()
+    avg_font_size = sum(table.sizes) / len(table.sizes)
+    levels = classify_heading_levels(table.sizes, avg_font_size)
+    assert list(levels) == [scalar_heading_level(size, avg_font_size) for size in table.sizes]
+    assert list(classify_heading_levels([9.0, 11.5, 12.5, 14.0, 18.0], 10.0)) == [0, 4, 3, 2, 1]
+
+    # Word 标题：达到1.2倍且为最大字号的为2级，达到1.1倍的为3级
+    assert list(classify_word_heading_levels([10.0, 10.0, 10.0, 13.0, 16.0])) == [0, 0, 0, 3, 2]
+
+def test_word_text_reads_columns():
+    """Word 输出直接读取列与按旧的字典列表生成的文档相同"""
+    docx = pytest.importorskip("docx")
+
+    spans = list(generate_spans(count=200))
+    elements = [{"text": text, "font_size": size, "font_flags": flags, "bbox": bbox, "page": page}
+                for text, size, flags, bbox, page in spans]
+    table = SpanTable.from_elements(elements)
+
+    def document_xml(add_text):
+        word_doc = docx.Document()
+        add_text(word_doc)
+        return word_doc.element.xml
+
+    from_dicts = document_xml(lambda word_doc: add_text_to_word_doc(word_doc, elements))
+    from_columns = document_xml(lambda word_doc: add_text_to_word_doc(
+        word_doc, table, page_texts=[(i, table.text(i).strip()) for i in range(len(table))]))
+    assert from_columns == from_dicts
+    assert "Heading" in from_dicts
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+测试启动耗时预算：导入 app 并创建应用时不加载转换依赖
+"""
+
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 导入 app 并执行 create_app() 的耗时预算（秒），不含 Flask 本身的导入耗时；
+# 启动时导入 fitz 或 python-docx 会超出预算
+STARTUP_BUDGET_SECONDS = float(os.environ.get("PDF2MD_STARTUP_BUDGET", 0.15))
+
+# 启动时不应加载的模块，第一次转换时才导入
+HEAVY_MODULES = ("fitz", "pymupdf", "docx")
+
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import flask, flask_cors
+flask_seconds = time.perf_counter() - start
+from app import create_app
+create_app()
+app_seconds = time.perf_counter() - start - flask_seconds
+from app.converter import DOCX_AVAILABLE
+print(json.dumps({
+    "app_seconds": app_seconds,
+    "loaded": [name for name in %r if name in sys.modules],
+    "docx_available": DOCX_AVAILABLE
+}))
+""" % (HEAVY_MODULES,)
+
+def measure_startup(work_dir):
+    """在新的解释器中导入 app，返回耗时和已加载的重量级模块
+
+    参数:
+        work_dir: 子进程的工作目录；导入 app 时创建的临时目录和缓存目录都在这里，不会留在仓库中
+    """
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [BACKEND_DIR, os.environ.get("PYTHONPATH")])))
+    output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], cwd=work_dir, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def test_startup_does_not_load_heavy_dependencies(tmp_path):
+    """创建应用时不导入 fitz 和 python-docx，但 DOCX_AVAILABLE 仍然准确"""
+    result = measure_startup(tmp_path)
+    assert result["loaded"] == []
+    assert result["docx_available"] == (importlib.util.find_spec("docx") is not None)
+
+def test_startup_time_budget(tmp_path):
+    """导入 app 的耗时不超过预算（取三次中最快的一次，减少测量噪声）"""
+    seconds = min(measure_startup(tmp_path)["app_seconds"] for _ in range(3))
+    assert seconds <= STARTUP_BUDGET_SECONDS, (
+        f"导入 app 用时 {seconds:.3f}s，超出预算 {STARTUP_BUDGET_SECONDS:.3f}s")
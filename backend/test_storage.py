@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+测试多个进程共用临时文件目录时，清理不会删除其他进程最近访问或正在使用的任务目录
+"""
+
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+from app.storage import IN_USE_MARKER_PREFIX, StorageManager, job_dir
+
+def create_job(root, age):
+    """创建一个 age 秒之前最后修改的任务目录"""
+    job_id = str(uuid.uuid4())
+    path = job_dir(root, job_id)
+    file_path = os.path.join(path, "page.png")
+    with open(file_path, "wb") as f:
+        f.write(b"x" * 16)
+    stamp = time.time() - age
+    os.utime(file_path, (stamp, stamp))
+    os.utime(path, (stamp, stamp))
+    return job_id
+
+def test_reap_respects_other_processes(tmp_path):
+    """其他进程 touch 过或持有使用标记的目录保留，其余过期目录删除"""
+    root = str(tmp_path)
+    reaper = StorageManager(root, ttl=100, quota_bytes=1024 * 1024, reap_interval=3600)
+    other = StorageManager(root, ttl=100, quota_bytes=1024 * 1024, reap_interval=3600)
+    touched, in_use, stale = (create_job(root, 50) for _ in range(3))
+    assert reaper.reap() == 0  # 纳入管理，尚未过期
+
+    other.touch(touched)
+    holder = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    try:
+        path = job_dir(root, in_use)
+        open(os.path.join(path, f"{IN_USE_MARKER_PREFIX}{holder.pid}"), "w").close()
+        stamp = time.time() - 50
+        os.utime(path, (stamp, stamp))  # 只靠使用标记保留
+        assert reaper.reap(now=time.time() + 90) == 1
+    finally:
+        holder.kill()
+        holder.wait()
+
+    exists = {job_id: os.path.isdir(job_dir(root, job_id, create=False)) for job_id in (touched, in_use, stale)}
+    assert exists == {touched: True, in_use: True, stale: False}
+
+    # 持有标记的进程退出后，标记失效
+    assert reaper.reap(now=time.time() + 300) == 2
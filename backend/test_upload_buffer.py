@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""
+测试上传文件的存放方式：小文件保存在内存中，大文件或大小未知时写入临时文件，两种情况都以零拷贝方式读取
+"""
+
+import io
+
+import pytest
+from werkzeug.test import EnvironBuilder
+
+from app import uploads
+from app.uploads import UploadRequest, open_upload_buffer
+
+CONTENT = b"%PDF-1.4\n" + bytes(range(256)) * 64
+
+def uploaded_file():
+    """通过 UploadRequest 解析一个带PDF文件的 multipart 请求"""
+    builder = EnvironBuilder(method="POST", data={"file": (io.BytesIO(CONTENT), "doc.pdf", "application/pdf")})
+    request = UploadRequest(builder.get_environ())
+    return request.files["file"]
+
+@pytest.mark.parametrize("limit, stream_type", [(1024 * 1024, io.BytesIO), (1024, io.BufferedRandom)])
+def test_upload_buffer(monkeypatch, limit, stream_type):
+    """请求体大小决定存放方式；两种情况都返回缓冲区视图（临时文件为内存映射），内容与上传内容相同"""
+    monkeypatch.setattr(uploads, "UPLOAD_MEMORY_LIMIT", limit)
+    file = uploaded_file()
+    assert isinstance(file.stream, stream_type)
+
+    with open_upload_buffer(file) as pdf_data:
+        assert isinstance(pdf_data, memoryview)
+        assert bytes(pdf_data) == CONTENT
+    assert uploads.upload_size(file) == len(CONTENT)
+    assert file.stream.tell() == 0
+
+def test_unknown_size_goes_to_disk():
+    """没有 Content-Length（分块传输）时直接写入临时文件"""
+    assert not isinstance(UploadRequest({})._get_file_stream(None, "application/pdf"), io.BytesIO)
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+测试上传校验：所有接收PDF的端点对缺少文件、空文件名和非PDF文件返回相同的状态码和错误信息
+"""
+
+import io
+
+import pytest
+
+PDF_ROUTES = ["/api/upload_pdf", "/api/convert_pdf_to_md", "/api/convert_pdf_to_md/stream",
+              "/api/convert_pdf_to_word", "/api/convert_pdf_to_images", "/api/convert_pdf", "/api/jobs"]
+
+@pytest.mark.parametrize("url", PDF_ROUTES)
+def test_upload_errors_are_consistent(routes, url):
+    def post(data):
+        return routes.client.post(url, data=data, content_type="multipart/form-data")
+
+    response = post({})
+    assert response.status_code == 400
+    assert response.get_json()["message"] == "未找到文件。请确保使用'file'字段上传PDF文件。"
+
+    assert post({"file": (io.BytesIO(b"%PDF-"), "", "application/pdf")}).status_code == 400
+
+    for name, mimetype in (("doc.txt", "application/pdf"), ("doc.pdf", "text/plain")):
+        response = post({"file": (io.BytesIO(b"%PDF-"), name, mimetype)})
+        assert response.status_code == 415
+        assert response.get_json() == {"status": "error", "message": "无效的文件类型。只接受PDF文件。"}